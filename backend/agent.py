@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Stream Agent
+Runs the stream jobs queued by the web tier when STREAM_SCHEDULER is enabled
+
+Start one or more agents (each with a share of the CPUs) on the host of the
+web tier. Agents and web workers must share STREAM_STATE_DIR and
+HLS_OUTPUT_DIR; coordination relies on local PIDs and flock, so agents on
+other hosts are not supported.
+"""
+
+import argparse
+from config import Config
+from app.utils.scheduler import StreamAgent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run scheduled stream jobs within a CPU budget')
+    parser.add_argument('--cpu', type=float, default=Config.SCHEDULER_AGENT_CPU,
+                        help='CPU cores the agent may use for streams (default: SCHEDULER_AGENT_CPU)')
+    parser.add_argument('--id', dest='agent_id', help='Agent ID (default: hostname plus a random suffix)')
+    args = parser.parse_args()
+    StreamAgent(args.cpu, args.agent_id).run()
+
+
+if __name__ == '__main__':
+    main()
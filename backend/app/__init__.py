@@ -1,12 +1,16 @@
 from flask import Flask
 from flask_cors import CORS
-from pymongo import MongoClient
 from config import Config
+from app.database import mongo
 import os
 
-# Initialize MongoDB client
-mongo_client = None
-db = None
+def __getattr__(name):
+    """app.db and app.mongo_client resolve to this process's lazily created client"""
+    if name == 'db':
+        return mongo.db
+    if name == 'mongo_client':
+        return mongo.client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_app(config_class=Config):
     """Application factory pattern"""
@@ -22,28 +26,44 @@ def create_app(config_class=Config):
         }
     })
     
-    # Initialize MongoDB
-    global mongo_client, db
-    try:
-        mongo_client = MongoClient(app.config['MONGO_URI'])
-        db = mongo_client.get_database()
-        print(f"✓ Connected to MongoDB: {db.name}")
-    except Exception as e:
-        print(f"✗ MongoDB connection failed: {e}")
-        raise
+    # MongoDB client is created on first use, once per worker process
+    mongo.init_app(app)
     
     # Create HLS output directory
     os.makedirs(app.config['HLS_OUTPUT_DIR'], exist_ok=True)
     
+    # Request metrics
+    from app.utils import metrics
+    metrics.init_app(app)
+    
+    # Admin-only profiler; without a token nothing of it is installed
+    if config_class.PROFILER_TOKEN:
+        from app.utils import profiler
+        profiler.init_app(app)
+        from app.routes.profiler_routes import profiler_bp
+        app.register_blueprint(profiler_bp, url_prefix='/api/admin/profiler')
+    
     # Register blueprints
     from app.routes.overlay_routes import overlay_bp
     from app.routes.stream_routes import stream_bp
+    from app.routes.event_routes import event_bp
     app.register_blueprint(overlay_bp, url_prefix='/api')
+    app.register_blueprint(event_bp, url_prefix='/api')
+    from app.routes.image_routes import image_bp
+    app.register_blueprint(image_bp, url_prefix='/api')
     app.register_blueprint(stream_bp)
+    from app.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp)
+    from app.routes.ingest_routes import ingest_bp
+    app.register_blueprint(ingest_bp)
+    from app.routes.thumbnail_routes import thumbnail_bp
+    app.register_blueprint(thumbnail_bp)
     
     # Health check route
     @app.route('/health')
     def health():
-        return {'status': 'healthy', 'database': 'connected'}, 200
+        # Answered from the background pinger after the first check
+        health = mongo.health()
+        return health, 200 if health['status'] == 'healthy' else 503
     
     return app
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+ASGI - Async serving mode for the viewer-facing HLS routes
+
+Under the sync workers every viewer request holds a worker thread until it
+is answered, including LL-HLS blocking playlist reloads that wait for the
+next part. This ASGI app serves playlists, segments and parts on the event
+loop instead: cached files are sent from memory, LL-HLS reloads and preload
+hints wait with asyncio.sleep, and DVR segments are sent with the server's
+pathsend extension or read in a thread. Everything else (the API, DVR
+windows, LL-HLS segments, 404 pages) is passed to the Flask app, which runs
+in a thread pool of ASGI_WSGI_THREADS threads and shares Config, the stream
+managers and the caches with the async routes.
+
+Run with:
+    gunicorn asgi:app -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker
+"""
+
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import http_date, parse_date
+from config import Config
+from app.routes.stream_routes import MIMETYPES, STREAMS_DIR, hls_cache_control
+from app.utils import dvr, llhls
+from app.utils.ingest import get_uploaded
+from app.utils.metrics import HTTP_BYTES, HTTP_LATENCY, SEGMENT_EXTENSIONS, viewer_id, viewer_tracker
+from app.utils.segment_cache import CHUNK_SIZE, segment_cache
+
+# /<file> and /streams/<stream_id>/<file>, including dvr/<file>
+HLS_PATH_PATTERN = re.compile(
+    r'^/(?:streams/(?P<stream_id>[A-Za-z0-9_-]{1,64})/)?(?P<filename>(?:dvr/)?[A-Za-z0-9_.-]+)$'
+)
+SEGMENT_ROUTE_PATTERN = re.compile(r'^stream\d+\.ts$')
+
+
+class HlsRequest:
+    """The parts of an ASGI request the HLS routes look at"""
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.started = time.perf_counter()
+
+    def arg(self, name: str) -> Optional[str]:
+        values = self.query.get(name)
+        return values[0] if values else None
+
+    def is_fresh(self, etag: str, last_modified) -> bool:
+        """Whether the client's cached copy is current (If-None-Match, then If-Modified-Since)"""
+        if_none_match = self.headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+            return '*' in tags or etag in tags
+        if_modified_since = parse_date(self.headers.get('if-modified-since'))
+        return if_modified_since is not None and last_modified.replace(microsecond=0) <= if_modified_since
+
+
+class HlsAsgiApp:
+    """Serves HLS files on the event loop and everything else through Flask"""
+
+    def __init__(self, flask_app, threads: Optional[int] = None):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=threads or Config.ASGI_WSGI_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            if await self._serve_hls(HlsRequest(scope), send):
+                return
+        await self.wsgi(scope, receive, send)
+
+    @staticmethod
+    async def _lifespan(receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _serve_hls(self, request: HlsRequest, send) -> bool:
+        """
+        Serve an HLS request without a thread, or return False to hand it to Flask
+
+        Nothing is sent before deciding, so Flask answers every case this
+        doesn't handle (and the errors) exactly as in sync mode.
+        """
+        match = HLS_PATH_PATTERN.match(request.path)
+        if match is None or os.path.splitext(match.group('filename'))[1] not in MIMETYPES:
+            return False
+        stream_id = match.group('stream_id')
+        filename = match.group('filename')
+        prefix = f'{stream_id}/' if stream_id else ''
+
+        if filename.startswith('dvr/'):
+            return await self._send_dvr_segment(request, send, stream_id, filename[len('dvr/'):])
+
+        if filename == 'stream.m3u8':
+            if request.arg('start') is not None or request.arg('end') is not None:
+                return False
+            playlist = llhls.get_playlist(os.path.join(STREAMS_DIR, prefix))
+            if playlist is not None:
+                return await self._send_low_latency_playlist(request, send, playlist)
+        elif llhls.SEGMENT_PATTERN.match(filename):
+            # Full LL-HLS segments are concatenated from parts by the Flask route
+            return False
+        elif llhls.PART_PATTERN.match(filename):
+            await llhls.wait_for_file_async(os.path.join(STREAMS_DIR, prefix, filename), 3 * Config.LLHLS_PART_DURATION)
+
+        # A hit is a dict lookup; a miss maps the file without reading it
+        relpath = f'{prefix}{filename}'
+        cached = get_uploaded(relpath) or segment_cache.get(relpath)
+        if cached is None:
+            return False
+        etag = f'"{cached.etag}"'
+        headers = self._hls_headers(MIMETYPES[os.path.splitext(filename)[1]], hls_cache_control(not cached.is_mutable))
+        headers += [(b'etag', etag.encode()), (b'last-modified', http_date(cached.last_modified).encode())]
+        if request.is_fresh(etag, cached.last_modified):
+            await self._respond(request, send, 304, headers)
+        else:
+            headers.append((b'content-length', str(cached.size).encode()))
+            await self._respond(request, send, 200, headers, cached.iter_chunks())
+        return True
+
+    async def _send_low_latency_playlist(self, request: HlsRequest, send, playlist: llhls.LowLatencyPlaylist) -> bool:
+        """LL-HLS playlist; a blocking reload waits on the event loop"""
+        try:
+            msn = int(request.arg('_HLS_msn')) if request.arg('_HLS_msn') is not None else None
+            part = int(request.arg('_HLS_part')) if request.arg('_HLS_part') is not None else None
+        except ValueError:
+            return False
+        if part is not None and msn is None:
+            return False
+        if msn is not None:
+            if playlist.parts and msn > playlist.position(playlist.parts[-1].sequence)[0] + 2:
+                return False
+            if not await playlist.wait_for_async(msn, part):
+                await self._respond(request, send, 503, [(b'content-type', b'text/plain')], [b'Playlist update timed out'])
+                return True
+
+        body = playlist.render()
+        # A blocking reload URL names one exact playlist version, so edge caches may keep it
+        headers = self._hls_headers(MIMETYPES['.m3u8'], 'public, max-age=60' if msn is not None else 'no-cache')
+        headers.append((b'content-length', str(len(body)).encode()))
+        await self._respond(request, send, 200, headers, [body])
+        return True
+
+    async def _send_dvr_segment(self, request: HlsRequest, send, stream_id: Optional[str], filename: str) -> bool:
+        """Archived segment, sent by the server (pathsend) or read off the event loop"""
+        path = dvr.dvr_store.segment_path(stream_id, filename)
+        if path is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        headers = self._hls_headers(MIMETYPES['.ts'], hls_cache_control(immutable=True))
+        headers.append((b'etag', etag.encode()))
+        if request.is_fresh(etag, _mtime(stat)):
+            await self._respond(request, send, 304, headers)
+            return True
+        headers.append((b'content-length', str(stat.st_size).encode()))
+
+        if request.method == 'GET' and 'http.response.pathsend' in request.scope.get('extensions', {}):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            await send({'type': 'http.response.pathsend', 'path': path})
+            self._record(request, 200, stat.st_size)
+            return True
+        try:
+            f = await asyncio.get_running_loop().run_in_executor(None, open, path, 'rb')
+        except OSError:
+            return False
+        try:
+            await self._respond(request, send, 200, headers, _read_chunks(f))
+        finally:
+            f.close()
+        return True
+
+    @staticmethod
+    def _hls_headers(mimetype: str, cache_control: str) -> List[Tuple[bytes, bytes]]:
+        return [
+            (b'content-type', mimetype.encode()),
+            (b'access-control-allow-origin', b'*'),
+            (b'cache-control', cache_control.encode())
+        ]
+
+    async def _respond(self, request: HlsRequest, send, status: int, headers: list, body: Iterable = ()) -> None:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        sent = 0
+        if request.method == 'GET':
+            async for chunk in _aiter(body):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                sent += len(chunk)
+        await send({'type': 'http.response.body', 'body': b''})
+        self._record(request, status, sent)
+
+    @staticmethod
+    def _record(request: HlsRequest, status: int, sent: int) -> None:
+        """Same request metrics as metrics.init_app records for the Flask routes"""
+        match = HLS_PATH_PATTERN.match(request.path)
+        if match.group('stream_id'):
+            endpoint = 'stream.serve_stream_file'
+        elif match.group('filename') == 'stream.m3u8':
+            endpoint = 'stream.serve_m3u8'
+        elif SEGMENT_ROUTE_PATTERN.match(match.group('filename')):
+            endpoint = 'stream.serve_segment'
+        else:
+            endpoint = 'stream.serve_hls_file'
+        HTTP_LATENCY.labels(endpoint, request.method, str(status)).observe(time.perf_counter() - request.started)
+        if sent:
+            HTTP_BYTES.labels(endpoint).inc(sent)
+        if status in (200, 206, 304) and request.path.endswith(SEGMENT_EXTENSIONS):
+            client = request.scope.get('client')
+            viewer_tracker.record(match.group('stream_id') or 'default', viewer_id(
+                request.headers.get('x-forwarded-for', ''), client[0] if client else None, request.headers.get('user-agent', '')
+            ))
+
+
+def _mtime(stat: os.stat_result) -> datetime:
+    return datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+
+
+async def _read_chunks(f):
+    while True:
+        chunk = await asyncio.get_running_loop().run_in_executor(None, f.read, CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _aiter(body):
+    if hasattr(body, '__aiter__'):
+        async for chunk in body:
+            yield chunk
+    else:
+        for chunk in body:
+            yield chunk
+
+
+def create_asgi_app(flask_app=None) -> HlsAsgiApp:
+    """ASGI app serving HLS on the event loop in front of the Flask app"""
+    if flask_app is None:
+        from app import create_app
+        flask_app = create_app()
+    return HlsAsgiApp(flask_app)
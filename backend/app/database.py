@@ -0,0 +1,136 @@
+"""
+Database - Lazily created, fork-safe MongoDB client
+
+No connection is made at import or in create_app: the client is created on
+first use, once per process, so gunicorn workers (forked from a master that
+may have imported the app with --preload) never share the master's sockets
+or monitor threads, and workers that only serve HLS never touch MongoDB.
+Collections are bound through LazyCollection, which resolves them against
+the current process's client and creates their indexes on first use.
+"""
+
+import os
+import threading
+import time
+from typing import List, Optional
+from config import Config
+
+
+class Mongo:
+    """Per-process MongoClient with explicit pool sizing and timeouts"""
+
+    def __init__(self, uri: Optional[str] = None):
+        self.uri = uri or Config.MONGO_URI
+        self.lock = threading.Lock()
+        self._client = None
+        self._pid: Optional[int] = None
+        self._health: Optional[dict] = None
+        self._health_thread: Optional[threading.Thread] = None
+
+    def init_app(self, app) -> None:
+        """Use the app's MONGO_URI; the client is still only created on first use"""
+        if app.config['MONGO_URI'] != self.uri:
+            with self.lock:
+                self.uri = app.config['MONGO_URI']
+                self._client = None
+
+    @property
+    def client(self):
+        """MongoClient of this process, created on first use"""
+        if self._client is None or self._pid != os.getpid():
+            with self.lock:
+                if self._client is None or self._pid != os.getpid():
+                    from pymongo import MongoClient
+                    # A client inherited through fork is dropped, not closed: its
+                    # sockets belong to the parent
+                    self._client = MongoClient(
+                        self.uri,
+                        maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                        minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                        serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                        connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                        waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS
+                    )
+                    self._pid = os.getpid()
+                    self._health = None
+                    self._health_thread = None
+                    print(f"✓ MongoDB client created for {self._client.get_database().name} (pid {self._pid})")
+        return self._client
+
+    @property
+    def db(self):
+        """Default database of MONGO_URI"""
+        return self.client.get_database()
+
+    def ping(self, timeout: Optional[float] = None) -> dict:
+        """Ping the server now; returns the health status"""
+        import pymongo
+        try:
+            with pymongo.timeout(timeout or Config.MONGO_HEALTH_TIMEOUT):
+                self.client.admin.command('ping')
+            self._health = {'status': 'healthy', 'database': 'connected', 'checked_at': time.time()}
+        except Exception as e:
+            self._health = {'status': 'unhealthy', 'database': 'disconnected', 'error': str(e), 'checked_at': time.time()}
+        return self._health
+
+    def health(self) -> dict:
+        """
+        Latest health status, kept fresh by a background pinger
+
+        The first call pings inline and starts a thread that re-pings every
+        MONGO_HEALTH_INTERVAL seconds, so health checks don't wait on MongoDB.
+        """
+        if self._health is None or self._pid != os.getpid():
+            health = self.ping()
+            with self.lock:
+                if self._health_thread is None:
+                    self._health_thread = threading.Thread(target=self._ping_loop, name='mongo-health', daemon=True)
+                    self._health_thread.start()
+            return health
+        return self._health
+
+    def _ping_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(Config.MONGO_HEALTH_INTERVAL)
+            self.ping()
+
+
+# Global client holder
+mongo = Mongo()
+
+
+class LazyCollection:
+    """
+    Class attribute resolving to a collection of the current process's client
+
+    indexes are (keys, options) pairs created in a background thread the
+    first time the collection is used in a process, so neither startup nor
+    the first request waits for them.
+    """
+
+    def __init__(self, name: str, indexes: Optional[List[tuple]] = None,
+                 holder: Optional[Mongo] = None):
+        self.name = name
+        self.indexes = indexes or []
+        self.holder = holder or mongo
+        self._ready_pid: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        collection = self.holder.db[self.name]
+        if self.indexes and self._ready_pid != os.getpid():
+            with self.lock:
+                if self._ready_pid != os.getpid():
+                    self._ready_pid = os.getpid()
+                    threading.Thread(target=self._create_indexes, args=(collection,),
+                                     name=f'indexes-{self.name}', daemon=True).start()
+        return collection
+
+    def _create_indexes(self, collection) -> None:
+        for keys, options in self.indexes:
+            try:
+                collection.create_index(keys, **options)
+            except Exception as e:
+                # Queries still work without the index, just slower; retried by the next process
+                print(f"✗ Index creation on {self.name} failed: {e}")
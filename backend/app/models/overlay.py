@@ -1,16 +1,43 @@
 from bson import ObjectId
 from datetime import datetime
-from app import db
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from app.database import LazyCollection
+from app.utils.metrics import timed_mongo
+
+# Document in the meta collection whose counter changes with every overlay write
+VERSION_ID = 'overlays'
 
 class Overlay:
     """Overlay model for managing video overlays"""
     
-    collection = db.overlays if db is not None else None
+    # Per-stream listings filter on stream_id and page through _id
+    collection = LazyCollection('overlays', indexes=[([('stream_id', 1), ('_id', 1)], {})])
+    meta = LazyCollection('meta')
     
     @staticmethod
-    def create(data):
-        """Create a new overlay"""
-        overlay = {
+    @timed_mongo('overlay', 'get_version')
+    def get_version():
+        """Current collection version, shared by every worker through the meta collection"""
+        doc = Overlay.meta.find_one({'_id': VERSION_ID})
+        return doc['version'] if doc else 0
+    
+    @staticmethod
+    @timed_mongo('overlay', 'bump_version')
+    def bump_version():
+        """Record that the overlays changed; returns the new version"""
+        doc = Overlay.meta.find_one_and_update(
+            {'_id': VERSION_ID},
+            {'$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc['version']
+    
+    @staticmethod
+    def build_document(data, now=None):
+        """New overlay document from request data"""
+        now = now or datetime.utcnow()
+        return {
             'type': data.get('type'),  # 'text' or 'image'
             'content': data.get('content'),  # text string or image URL
             'position': {
@@ -22,14 +49,48 @@ class Overlay:
                 'height': data.get('size', {}).get('height', 50)
             },
             'style': data.get('style', {}), 
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'stream_id': data.get('stream_id'),  # None shows the overlay on every stream
+            # Optional window: datetimes (wall clock) or seconds since the stream started
+            'start_at': data.get('start_at'),
+            'end_at': data.get('end_at'),
+            'created_at': now,
+            'updated_at': now
+        }
+    
+    @staticmethod
+    def build_update(data, now=None):
+        """$set fields for an update from request data"""
+        update_data = {
+            'updated_at': now or datetime.utcnow()
         }
+        
+        for field in ('type', 'content', 'position', 'size', 'style', 'stream_id', 'start_at', 'end_at'):
+            if field in data:
+                update_data[field] = data[field]
+        return update_data
+    
+    @staticmethod
+    def schedule_error(start_at, end_at):
+        """Error message for an invalid start_at/end_at window, or None"""
+        bounds = [bound for bound in (start_at, end_at) if bound is not None]
+        if len({isinstance(bound, datetime) for bound in bounds}) > 1:
+            return 'start_at and end_at must both be dates or both be stream seconds'
+        if len(bounds) == 2 and not start_at < end_at:
+            return 'end_at must be after start_at'
+        return None
+    
+    @staticmethod
+    @timed_mongo('overlay', 'create')
+    def create(data):
+        """Create a new overlay"""
+        overlay = Overlay.build_document(data)
         result = Overlay.collection.insert_one(overlay)
         overlay['_id'] = str(result.inserted_id)
+        Overlay.bump_version()
         return overlay
     
     @staticmethod
+    @timed_mongo('overlay', 'get_all')
     def get_all():
         """Get all overlays"""
         overlays = list(Overlay.collection.find())
@@ -38,6 +99,42 @@ class Overlay:
         return overlays
     
     @staticmethod
+    def stream_filter(stream_id):
+        """Query for the overlays shown on a stream: its own and those without a stream"""
+        return {'stream_id': {'$in': [stream_id, None]}}
+    
+    @staticmethod
+    @timed_mongo('overlay', 'get_for_stream')
+    def get_for_stream(stream_id):
+        """Get the overlays shown on a stream (None is the default stream)"""
+        overlays = list(Overlay.collection.find(Overlay.stream_filter(stream_id)))
+        for overlay in overlays:
+            overlay['_id'] = str(overlay['_id'])
+        return overlays
+    
+    @staticmethod
+    def find_page(stream_id=None, after=None, limit=100, fields=None, scoped=False):
+        """
+        Cursor over one page of overlays in _id order
+        
+        Args:
+            stream_id: only overlays shown on this stream (with scoped=True)
+            after: ObjectId the page starts after
+            limit: page size; one extra document is fetched to tell whether
+                another page follows
+            fields: fields to return besides _id (None for all)
+        
+        Documents are fetched in batches as the cursor is iterated, so a page
+        is never held in memory as a whole.
+        """
+        query = Overlay.stream_filter(stream_id) if scoped else {}
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        projection = {field: 1 for field in fields} if fields else None
+        return Overlay.collection.find(query, projection).sort('_id', 1).limit(limit + 1)
+    
+    @staticmethod
+    @timed_mongo('overlay', 'get_by_id')
     def get_by_id(overlay_id):
         """Get overlay by ID"""
         try:
@@ -49,38 +146,125 @@ class Overlay:
             return None
     
     @staticmethod
+    @timed_mongo('overlay', 'update')
     def update(overlay_id, data):
         """Update an overlay"""
         try:
-            update_data = {
-                'updated_at': datetime.utcnow()
-            }
-            
-            if 'type' in data:
-                update_data['type'] = data['type']
-            if 'content' in data:
-                update_data['content'] = data['content']
-            if 'position' in data:
-                update_data['position'] = data['position']
-            if 'size' in data:
-                update_data['size'] = data['size']
-            if 'style' in data:
-                update_data['style'] = data['style']
+            update_data = Overlay.build_update(data)
             
             result = Overlay.collection.update_one(
                 {'_id': ObjectId(overlay_id)},
                 {'$set': update_data}
             )
             
-            return result.modified_count > 0
+            if result.modified_count > 0:
+                Overlay.bump_version()
+                return True
+            return False
         except:
             return False
     
     @staticmethod
+    @timed_mongo('overlay', 'apply_field_updates')
+    def apply_field_updates(updates):
+        """
+        Write buffered field changes of many overlays with one bulk_write
+        
+        Args:
+            updates: {overlay_id: {field: value}}
+        
+        Returns:
+            list: the written documents, read back with one query
+        """
+        ids = [ObjectId(overlay_id) for overlay_id in updates]
+        Overlay.collection.bulk_write([
+            UpdateOne({'_id': _id}, {'$set': updates[str(_id)]}) for _id in ids
+        ], ordered=False)
+        Overlay.bump_version()
+        overlays = list(Overlay.collection.find({'_id': {'$in': ids}}))
+        for overlay in overlays:
+            overlay['_id'] = str(overlay['_id'])
+        return overlays
+    
+    @staticmethod
+    @timed_mongo('overlay', 'delete')
     def delete(overlay_id):
         """Delete an overlay"""
         try:
             result = Overlay.collection.delete_one({'_id': ObjectId(overlay_id)})
-            return result.deleted_count > 0
+            if result.deleted_count > 0:
+                Overlay.bump_version()
+                return True
+            return False
         except:
-            return False
\ No newline at end of file
+            return False
+    
+    @staticmethod
+    @timed_mongo('overlay', 'batch')
+    def batch(operations):
+        """
+        Apply create/update/delete operations with a single bulk_write
+        
+        Documents touched by updates and deletes are fetched with one query, and
+        the resulting documents are computed from them instead of re-read.
+        Operations run in order, so later ones may update or delete overlays
+        created earlier in the same batch.
+        
+        Returns:
+            list: one result per operation, with the resulting document for
+            creates and updates
+        """
+        ids = {}
+        for op in operations:
+            if op['op'] in ('update', 'delete'):
+                try:
+                    ids[op['id']] = ObjectId(op['id'])
+                except Exception:
+                    pass
+        
+        current = {}
+        if ids:
+            for document in Overlay.collection.find({'_id': {'$in': list(ids.values())}}):
+                current[str(document['_id'])] = document
+        
+        now = datetime.utcnow()
+        requests = []
+        results = []
+        for index, op in enumerate(operations):
+            if op['op'] == 'create':
+                document = Overlay.build_document(op['data'], now)
+                document['_id'] = ObjectId()
+                requests.append(InsertOne(document))
+                current[str(document['_id'])] = document
+                results.append({'index': index, 'op': 'create', 'status': 'success', 'id': str(document['_id'])})
+                continue
+            
+            document = current.get(op['id'])
+            if document is None:
+                results.append({'index': index, 'op': op['op'], 'status': 'error', 'id': op['id'], 'error': 'Overlay not found'})
+                continue
+            if op['op'] == 'update':
+                update_data = Overlay.build_update(op['data'], now)
+                # A window may be changed one end at a time
+                error = Overlay.schedule_error(update_data.get('start_at', document.get('start_at')),
+                                               update_data.get('end_at', document.get('end_at')))
+                if error:
+                    results.append({'index': index, 'op': 'update', 'status': 'error', 'id': op['id'], 'error': error})
+                    continue
+                requests.append(UpdateOne({'_id': document['_id']}, {'$set': update_data}))
+                document.update(update_data)
+            else:
+                requests.append(DeleteOne({'_id': document['_id']}))
+                del current[op['id']]
+            results.append({'index': index, 'op': op['op'], 'status': 'success', 'id': op['id']})
+        
+        if requests:
+            Overlay.collection.bulk_write(requests, ordered=True)
+            Overlay.bump_version()
+        
+        # Attach final documents (an overlay updated twice shows its end state)
+        for result in results:
+            document = current.get(result['id'])
+            if result['status'] == 'success' and result['op'] != 'delete' and document is not None:
+                result['data'] = dict(document, _id=result['id'])
+        return results
@@ -0,0 +1,15 @@
+from flask import Blueprint, Response, request
+from app.utils.event_bus import event_bus
+
+event_bp = Blueprint('events', __name__)
+
+@event_bp.route('/events', methods=['GET'])
+def events():
+    """Server-Sent Events stream of overlay changes and stream state transitions"""
+    # EventSource resends the last id it saw when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(event_bus.stream(last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,64 @@
+from flask import Blueprint, request, jsonify, redirect, send_file, url_for
+from app.models.overlay import Overlay
+from app.utils.image_proxy import MIMETYPES, image_proxy
+from app.utils.profiler import profiler
+
+image_bp = Blueprint('images', __name__)
+
+# Served images never change (names are content hashes)
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MAX_PIXEL_RATIO = 3
+
+@image_bp.route('/overlays/<overlay_id>/image', methods=['GET'])
+def get_overlay_image(overlay_id):
+    """Redirect to the overlay's image scaled to its size (?dpr=2 for high-density screens)"""
+    overlay = Overlay.get_by_id(overlay_id)
+    if not overlay or overlay.get('type') != 'image':
+        return jsonify({
+            'success': False,
+            'error': 'Image overlay not found'
+        }), 404
+
+    try:
+        ratio = int(request.args.get('dpr', 1))
+    except ValueError:
+        ratio = 0
+    if not 1 <= ratio <= MAX_PIXEL_RATIO:
+        return jsonify({
+            'success': False,
+            'error': f'dpr must be 1 to {MAX_PIXEL_RATIO}'
+        }), 400
+
+    size = overlay.get('size') or {}
+    try:
+        name = image_proxy.render(overlay['content'], size.get('width', 100) * ratio, size.get('height', 50) * ratio)
+    except (TypeError, ValueError):
+        name = None
+    if name is None:
+        return jsonify({
+            'success': False,
+            'error': 'Overlay image could not be fetched'
+        }), 502
+
+    # The target changes whenever the image or the overlay size does
+    response = redirect(url_for('images.get_cached_image', name=name), code=302)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@image_bp.route('/overlay-images/<name>', methods=['GET'])
+def get_cached_image(name):
+    """A fetched or scaled overlay image from the proxy cache"""
+    path = image_proxy.path(name)
+    if path is None:
+        return jsonify({
+            'success': False,
+            'error': 'Image not found'
+        }), 404
+
+    with profiler.phase('send_file'):
+        response = send_file(path, mimetype=MIMETYPES[name.rsplit('.', 1)[1]], etag=name, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE
+    # Images from other sites (SVG in particular) must not run as pages of this one
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,52 @@
+import hmac
+from flask import Blueprint, Response, request
+from config import Config
+from app.utils.ingest import FILENAME_PATTERN, ingest_ring
+from app.utils.process_registry import process_registry
+from app.utils.stream_manager import stream_registry
+
+ingest_bp = Blueprint('ingest', __name__)
+
+def _authorized(stream_id, token):
+    """Only the FFmpeg run that was given this stream's token may upload"""
+    state = process_registry.read('stream' if stream_id is None else f'stream-{stream_id}')
+    expected = (state or {}).get('ingest_token')
+    return bool(expected) and hmac.compare_digest(expected, token)
+
+def _ingest(stream_id, token, filename):
+    if stream_id is not None and not stream_registry.is_valid_id(stream_id):
+        return Response('Not found', status=404)
+    if not FILENAME_PATTERN.match(filename):
+        return Response('Invalid file name', status=400)
+    if not _authorized(stream_id, token):
+        return Response('Forbidden', status=403)
+
+    if request.method == 'DELETE':
+        ingest_ring.delete(stream_id, filename)
+        return Response(status=204)
+
+    if request.content_length is not None and request.content_length > Config.INGEST_MAX_UPLOAD_BYTES:
+        return Response('Upload too large', status=413)
+    # FFmpeg sends chunked uploads without a length, so cap the read as well
+    chunks = []
+    size = 0
+    while True:
+        chunk = request.stream.read(64 * 1024)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > Config.INGEST_MAX_UPLOAD_BYTES:
+            return Response('Upload too large', status=413)
+        chunks.append(chunk)
+    ingest_ring.put(stream_id, filename, b''.join(chunks))
+    return Response(status=201)
+
+@ingest_bp.route('/ingest/<token>/<filename>', methods=['PUT', 'DELETE'])
+def ingest_default(token, filename):
+    """Receive a playlist or segment uploaded by FFmpeg for the default stream"""
+    return _ingest(None, token, filename)
+
+@ingest_bp.route('/ingest/<stream_id>/<token>/<filename>', methods=['PUT', 'DELETE'])
+def ingest_stream(stream_id, token, filename):
+    """Receive a playlist or segment uploaded by FFmpeg for one stream in the registry"""
+    return _ingest(stream_id, token, filename)
@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from app.utils import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics, summed over all gunicorn workers"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
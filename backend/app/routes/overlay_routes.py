@@ -1,18 +1,194 @@
-from flask import Blueprint, request, jsonify
+import hashlib
+import math
+import threading
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, Response, current_app, request, jsonify
+from config import Config
 from app.models.overlay import Overlay
+from app.utils.event_bus import event_bus
+from app.utils.image_proxy import image_proxy
+from app.utils.overlay_cache import overlay_cache
+from app.utils.schedule_index import parse_schedule_time, schedule_index, timestamp
+from app.utils.stream_manager import STREAM_ID_PATTERN, stream_manager, stream_registry, sync_burn_in_overlays
+from app.utils.write_buffer import overlay_write_buffer
 
 overlay_bp = Blueprint('overlays', __name__)
 
+MAX_BATCH_OPERATIONS = 500
+# Fields a listing may be narrowed to with ?fields= (_id is always returned)
+PROJECTABLE_FIELDS = ('type', 'content', 'position', 'size', 'style', 'stream_id', 'start_at', 'end_at',
+                      'created_at', 'updated_at')
+PAGE_PARAMS = ('stream_id', 'after', 'limit', 'fields')
+
+def _overlays_changed(events):
+    """
+    Propagate overlay writes: refresh this worker's cache, push the changes
+    to event clients, update streams that burn overlays into the video and
+    refresh the proxied images of created and updated image overlays
+    """
+    overlay_cache.invalidate()
+    event_bus.publish_many(events)
+    threading.Thread(target=sync_burn_in_overlays, daemon=True).start()
+    images = [data for event_type, data in events if event_type != 'overlay.deleted' and data.get('type') == 'image']
+    if images:
+        threading.Thread(target=image_proxy.refresh, args=(images,), daemon=True).start()
+
+# Buffered moves and resizes propagate when they are written
+overlay_write_buffer.add_listener(_overlays_changed)
+
+def _validate_stream_id(data):
+    """Error message for an invalid stream_id in create or update data, or None"""
+    stream_id = data.get('stream_id')
+    if stream_id is not None and (not isinstance(stream_id, str) or not STREAM_ID_PATTERN.match(stream_id)):
+        return 'stream_id must be 1-64 letters, digits, "-" or "_" (or null for every stream)'
+    return None
+
+def _validate_schedule(data):
+    """
+    Error message for invalid start_at/end_at in create or update data, or
+    None; valid times are converted in place (date strings to datetimes)
+    """
+    for field in ('start_at', 'end_at'):
+        if field in data:
+            try:
+                data[field] = parse_schedule_time(data[field])
+            except ValueError as e:
+                return f'{field}: {e}'
+    return Overlay.schedule_error(data.get('start_at'), data.get('end_at'))
+
+def _validate_new_overlay(data):
+    """Error message for invalid create data, or None"""
+    if not isinstance(data, dict):
+        return 'Overlay data must be an object'
+    if not data.get('type') or data['type'] not in ['text', 'image']:
+        return 'Invalid overlay type. Must be "text" or "image"'
+    if not data.get('content'):
+        return 'Content is required'
+    return _validate_stream_id(data) or _validate_schedule(data)
+
+def _validate_operation(op):
+    """Error message for an invalid batch operation, or None"""
+    if not isinstance(op, dict) or op.get('op') not in ('create', 'update', 'delete'):
+        return 'Each operation needs "op": "create", "update" or "delete"'
+    if op['op'] == 'create':
+        return _validate_new_overlay(op.get('data'))
+    if not isinstance(op.get('id'), str):
+        return f'"{op["op"]}" needs the overlay "id"'
+    if op['op'] == 'update':
+        if not isinstance(op.get('data'), dict):
+            return '"update" needs "data" with the fields to change'
+        return _validate_stream_id(op['data']) or _validate_schedule(op['data'])
+    return None
+
+def _parse_page_args(args):
+    """
+    Listing parameters from the query string
+    
+    Returns:
+        tuple: (options for Overlay.find_page, error message or None)
+    """
+    options = {'limit': Config.OVERLAY_PAGE_SIZE}
+    stream_id = args.get('stream_id')
+    if stream_id is not None:
+        if not STREAM_ID_PATTERN.match(stream_id):
+            return None, 'Invalid stream_id'
+        options['stream_id'] = stream_id
+        options['scoped'] = True
+    if args.get('after'):
+        try:
+            options['after'] = ObjectId(args['after'])
+        except (InvalidId, TypeError):
+            return None, 'after must be an overlay id'
+    if args.get('limit'):
+        try:
+            options['limit'] = int(args['limit'])
+        except ValueError:
+            return None, 'limit must be a number'
+        if not 1 <= options['limit'] <= Config.OVERLAY_MAX_PAGE_SIZE:
+            return None, f'limit must be between 1 and {Config.OVERLAY_MAX_PAGE_SIZE}'
+    if args.get('fields'):
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in PROJECTABLE_FIELDS]
+        if unknown:
+            return None, f'Unknown fields: {", ".join(unknown)}'
+        options['fields'] = fields
+    return options, None
+
+def _stream_page(first, cursor, limit, dumps):
+    """
+    JSON body of one page, serialized one overlay at a time
+    
+    The cursor holds one more document than the page when another page
+    follows; its id is not sent, the last sent id is the next cursor. The
+    body is produced after the view returned, outside the app context, so
+    the app's JSON serializer is passed in.
+    """
+    try:
+        yield b'{"success": true, "data": ['
+        count = 0
+        last_id = None
+        has_more = False
+        document = first
+        while document is not None:
+            if count == limit:
+                has_more = True
+                break
+            document['_id'] = str(document['_id'])
+            document = overlay_write_buffer.apply(document)
+            yield (b',' if count else b'') + dumps(document).encode()
+            count += 1
+            last_id = document['_id']
+            document = next(cursor, None)
+        yield f'], "count": {count}, "next": {dumps(last_id if has_more else None)}}}'.encode()
+    finally:
+        cursor.close()
+
+def _get_overlay_page():
+    """Paginated, projected listing, streamed from the cursor"""
+    options, error = _parse_page_args(request.args)
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
+    
+    # Same page at the same collection version is the same body
+    overlay_cache.ensure_started()
+    query = '&'.join(f'{name}={request.args[name]}' for name in PAGE_PARAMS if name in request.args)
+    etag = f'overlays-{overlay_cache.current_version()}-{hashlib.sha1(query.encode()).hexdigest()[:16]}'
+    etag += overlay_write_buffer.validator_suffix()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cursor = Overlay.find_page(**options)
+        # The first batch is read here, so database errors still get an error response
+        first = next(cursor, None)
+        response = Response(_stream_page(first, cursor, options['limit'], current_app.json.dumps), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @overlay_bp.route('/overlays', methods=['GET'])
 def get_overlays():
-    """Get all overlays"""
+    """Get all overlays (conditional on the collection version), or one page of them"""
     try:
-        overlays = Overlay.get_all()
-        return jsonify({
-            'success': True,
-            'data': overlays,
-            'count': len(overlays)
-        }), 200
+        if any(name in request.args for name in PAGE_PARAMS):
+            return _get_overlay_page()
+        cached = overlay_cache.get()
+        suffix = overlay_write_buffer.validator_suffix()
+        if suffix:
+            # Moves this worker hasn't written yet
+            listing = current_app.json.loads(cached.body)
+            listing['data'] = [overlay_write_buffer.apply(overlay) for overlay in listing['data']]
+            response = Response(current_app.json.dumps(listing), mimetype='application/json')
+        else:
+            response = Response(cached.body, mimetype='application/json')
+        response.set_etag(cached.etag + suffix)
+        # Clients may keep the list but must revalidate; unchanged lists get a 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -32,7 +208,76 @@ def get_overlay(overlay_id):
     
     return jsonify({
         'success': True,
-        'data': overlay
+        'data': overlay_write_buffer.apply(overlay)
+    }), 200
+
+def _parse_active_args(args):
+    """
+    (stream_id, Unix time, stream offset in seconds or None, error message or None)
+    
+    The offset defaults to the time since the stream was started, and is
+    None when the stream isn't running.
+    """
+    stream_id = args.get('stream_id')
+    if stream_id is not None and not STREAM_ID_PATTERN.match(stream_id):
+        return None, None, None, 'Invalid stream_id'
+    at = time.time()
+    if args.get('at'):
+        try:
+            at = float(args['at'])
+        except ValueError:
+            try:
+                parsed = parse_schedule_time(args['at'])
+            except ValueError:
+                return None, None, None, 'at must be a date or Unix time'
+            at = timestamp(parsed)
+    if not math.isfinite(at):
+        return None, None, None, 'at must be a date or Unix time'
+    if args.get('offset'):
+        try:
+            offset = float(args['offset'])
+        except ValueError:
+            return None, None, None, 'offset must be a number of seconds'
+        if not math.isfinite(offset):
+            return None, None, None, 'offset must be a number of seconds'
+        return stream_id, at, offset, None
+    manager = stream_manager if stream_id is None else stream_registry.get(stream_id)
+    started_at = manager.get_session_start() if manager is not None else None
+    offset = at - started_at if started_at is not None and at >= started_at else None
+    return stream_id, at, offset, None
+
+@overlay_bp.route('/overlays/active', methods=['GET'])
+def get_active_overlays():
+    """Overlays shown on a stream at a time (?at=, default now) according to their windows"""
+    try:
+        stream_id, at, offset, error = _parse_active_args(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        schedule_index.sync()
+        overlays = sorted(schedule_index.active(at, stream_id, offset), key=lambda overlay: overlay['_id'])
+        return jsonify({
+            'success': True,
+            'data': [overlay_write_buffer.apply(dict(overlay)) for overlay in overlays],
+            'count': len(overlays),
+            'at': at,
+            'offset': offset
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@overlay_bp.route('/overlays/write-buffer', methods=['GET'])
+def get_write_buffer_stats():
+    """This worker's buffered moves/resizes and how many updates each write absorbed"""
+    return jsonify({
+        'success': True,
+        'data': overlay_write_buffer.get_stats()
     }), 200
 
 @overlay_bp.route('/overlays', methods=['POST'])
@@ -42,19 +287,15 @@ def create_overlay():
         data = request.get_json()
         
         # Validation
-        if not data.get('type') or data['type'] not in ['text', 'image']:
+        error = _validate_new_overlay(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Invalid overlay type. Must be "text" or "image"'
-            }), 400
-        
-        if not data.get('content'):
-            return jsonify({
-                'success': False,
-                'error': 'Content is required'
+                'error': error
             }), 400
         
         overlay = Overlay.create(data)
+        _overlays_changed([('overlay.created', overlay)])
         
         return jsonify({
             'success': True,
@@ -73,6 +314,37 @@ def update_overlay(overlay_id):
     try:
         data = request.get_json()
         
+        if not isinstance(data, dict):
+            error = 'Overlay data must be an object'
+        else:
+            error = _validate_stream_id(data) or _validate_schedule(data)
+        if not error and ('start_at' in data) != ('end_at' in data):
+            # One end of the window changes: check it against the other
+            current = Overlay.get_by_id(overlay_id) or {}
+            error = Overlay.schedule_error(data.get('start_at', current.get('start_at')),
+                                           data.get('end_at', current.get('end_at')))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        if overlay_write_buffer.accepts(data):
+            # Moves and resizes are written with the next flush
+            buffered_overlay = overlay_write_buffer.update(overlay_id, data)
+            if buffered_overlay is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Overlay not found or update failed'
+                }), 404
+            return jsonify({
+                'success': True,
+                'data': buffered_overlay,
+                'message': 'Overlay updated successfully'
+            }), 200
+        
+        # Buffered changes are written along with this update, not after it
+        data = dict(overlay_write_buffer.discard(overlay_id), **data)
         success = Overlay.update(overlay_id, data)
         
         if not success:
@@ -82,6 +354,7 @@ def update_overlay(overlay_id):
             }), 404
         
         updated_overlay = Overlay.get_by_id(overlay_id)
+        _overlays_changed([('overlay.updated', updated_overlay)])
         
         return jsonify({
             'success': True,
@@ -98,6 +371,7 @@ def update_overlay(overlay_id):
 def delete_overlay(overlay_id):
     """Delete an overlay"""
     try:
+        overlay_write_buffer.discard(overlay_id)
         success = Overlay.delete(overlay_id)
         
         if not success:
@@ -106,6 +380,7 @@ def delete_overlay(overlay_id):
                 'error': 'Overlay not found or delete failed'
             }), 404
         
+        _overlays_changed([('overlay.deleted', {'_id': overlay_id})])
         return jsonify({
             'success': True,
             'message': 'Overlay deleted successfully'
@@ -114,4 +389,59 @@ def delete_overlay(overlay_id):
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@overlay_bp.route('/overlays/batch', methods=['POST'])
+def batch_overlays():
+    """Create, update and delete many overlays in one request"""
+    try:
+        data = request.get_json(silent=True) or {}
+        operations = data.get('operations')
+        
+        if not isinstance(operations, list) or not operations:
+            return jsonify({
+                'success': False,
+                'error': 'operations must be a non-empty list'
+            }), 400
+        
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_BATCH_OPERATIONS} operations per batch'
+            }), 400
+        
+        # Reject the whole batch up front rather than apply part of it
+        for index, op in enumerate(operations):
+            error = _validate_operation(op)
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': f'Operation {index}: {error}'
+                }), 400
+        
+        for op in operations:
+            if op['op'] != 'create':
+                pending = overlay_write_buffer.discard(op['id'])
+                if op['op'] == 'update':
+                    op['data'] = dict(pending, **op['data'])
+        
+        results = Overlay.batch(operations)
+        events = [
+            (f"overlay.{result['op']}d", result.get('data') or {'_id': result['id']})
+            for result in results if result['status'] == 'success'
+        ]
+        if events:
+            _overlays_changed(events)
+        
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return jsonify({
+            'success': failed == 0,
+            'results': results,
+            'applied': len(results) - failed,
+            'failed': failed
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
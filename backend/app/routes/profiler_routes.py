@@ -0,0 +1,60 @@
+import hmac
+from flask import Blueprint, Response, request, jsonify
+from config import Config
+from app.utils.profiler import profiler
+
+profiler_bp = Blueprint('profiler', __name__)
+
+@profiler_bp.before_request
+def require_admin_token():
+    """Profiler endpoints need "Authorization: Bearer <PROFILER_TOKEN>" """
+    supplied = request.headers.get('Authorization', '')
+    if supplied.startswith('Bearer '):
+        supplied = supplied[len('Bearer '):]
+    supplied = supplied.strip()
+    if not supplied or not hmac.compare_digest(supplied.encode(), Config.PROFILER_TOKEN.encode()):
+        return jsonify({'status': 'error', 'message': 'Admin token required'}), 401
+    return None
+
+def _parse_number(data, name, default, low, high):
+    value = data.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise ValueError(f'{name} must be a number between {low:g} and {high:g}')
+    return float(value)
+
+@profiler_bp.route('/start', methods=['POST'])
+def start_profiler():
+    """Start sampling and phase timing in this worker (restarting clears earlier data)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        interval_ms = _parse_number(data, 'interval_ms', Config.PROFILER_INTERVAL_MS, 1, 1000)
+        duration = _parse_number(data, 'duration', Config.PROFILER_MAX_SECONDS, 1, Config.PROFILER_MAX_SECONDS)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    profiler.start(interval_ms / 1000, duration, phases=data.get('phases', True) is not False,
+                   include_idle=data.get('include_idle') is True)
+    return jsonify({'status': 'success', 'message': f'Profiling worker for up to {duration:g}s', 'profiler': profiler.get_status()}), 200
+
+@profiler_bp.route('/stop', methods=['POST'])
+def stop_profiler():
+    """Stop sampling; the data stays available until the next start"""
+    profiler.stop()
+    return jsonify({'status': 'success', 'message': 'Profiling stopped', 'profiler': profiler.get_status()}), 200
+
+@profiler_bp.route('', methods=['GET'])
+def get_profiler_status():
+    """Whether this worker is profiling, and how much it collected"""
+    return jsonify(profiler.get_status()), 200
+
+@profiler_bp.route('/collapsed', methods=['GET'])
+def get_collapsed_stacks():
+    """Samples as collapsed stacks, for flamegraph.pl or speedscope"""
+    response = Response(profiler.collapsed(), mimetype='text/plain')
+    response.headers['X-Profiler-Pid'] = str(profiler.get_status()['pid'])
+    return response
+
+@profiler_bp.route('/phases', methods=['GET'])
+def get_phases():
+    """Time per endpoint spent in database calls, JSON serialization and file serving"""
+    return jsonify({'pid': profiler.get_status()['pid'], 'endpoints': profiler.get_phase_stats()}), 200
@@ -1,7 +1,14 @@
-from flask import Blueprint, send_from_directory, Response, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file
 from config import Config
-from app.utils.stream_manager import stream_manager
+from app.utils import abr, dvr, llhls
+from app.utils.stream_manager import stream_manager, stream_registry, parse_stream_options
+from app.utils.scheduler import scheduler
+from app.utils.segment_cache import segment_cache
+from app.utils.ingest import get_uploaded
+from app.utils.profiler import profiler
+import math
 import os
+import time
 
 stream_bp = Blueprint('stream', __name__)
 
@@ -10,6 +17,18 @@ STREAMS_DIR = os.path.abspath(Config.HLS_OUTPUT_DIR)
 
 # ============= Stream Management API =============
 
+def _schedule_start(stream_id, rtsp_url, options):
+    """Queue a start for the agents; 202 until an agent runs it"""
+    result = scheduler.submit(stream_id, rtsp_url, options)
+    status_code = 202 if result['status'] == 'success' else 503
+    return jsonify(result), status_code
+
+def _with_job(status, stream_id):
+    """Add the scheduler job of a stream to its status"""
+    if Config.STREAM_SCHEDULER:
+        status['job'] = scheduler.get_job(stream_id)
+    return status
+
 @stream_bp.route('/api/stream/start', methods=['POST'])
 def start_stream():
     """Start RTSP to HLS conversion"""
@@ -19,13 +38,23 @@ def start_stream():
     if not rtsp_url:
         return jsonify({'status': 'error', 'message': 'rtsp_url is required'}), 400
     
-    result = stream_manager.start_stream(rtsp_url)
+    try:
+        options = parse_stream_options(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    if Config.STREAM_SCHEDULER:
+        return _schedule_start(None, rtsp_url, options)
+    
+    result = stream_manager.start_stream(rtsp_url, options)
     status_code = 200 if result['status'] == 'success' else 400
     return jsonify(result), status_code
 
 @stream_bp.route('/api/stream/stop', methods=['POST'])
 def stop_stream():
     """Stop current stream"""
+    if Config.STREAM_SCHEDULER:
+        return jsonify(scheduler.cancel(None)), 200
     result = stream_manager.stop_stream()
     return jsonify(result), 200
 
@@ -33,60 +62,249 @@ def stop_stream():
 def get_stream_status():
     """Get current stream status"""
     status = stream_manager.get_status()
-    return jsonify(status), 200
+    return jsonify(_with_job(status, None)), 200
 
 @stream_bp.route('/api/stream/restart', methods=['POST'])
 def restart_stream():
     """Restart current stream"""
+    if Config.STREAM_SCHEDULER:
+        result = scheduler.restart(None)
+        return jsonify(result), 202 if result['status'] == 'success' else 400
     result = stream_manager.restart_stream()
     status_code = 200 if result['status'] == 'success' else 400
     return jsonify(result), status_code
 
+# ============= Multi-Stream Management API =============
+
+@stream_bp.route('/api/streams', methods=['GET'])
+def list_streams():
+    """List all streams with per-stream resource usage"""
+    return jsonify(stream_registry.list_streams()), 200
+
+@stream_bp.route('/api/streams/<stream_id>/start', methods=['POST'])
+def start_stream_by_id(stream_id):
+    """Start RTSP to HLS conversion for one stream"""
+    data = request.get_json(silent=True) or {}
+    rtsp_url = data.get('rtsp_url')
+    
+    if not rtsp_url:
+        return jsonify({'status': 'error', 'message': 'rtsp_url is required'}), 400
+    
+    try:
+        options = parse_stream_options(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    if Config.STREAM_SCHEDULER:
+        if not stream_registry.is_valid_id(stream_id):
+            return jsonify({'status': 'error', 'message': 'Invalid stream id. Use letters, digits, "-" or "_" (max 64 chars)'}), 400
+        return _schedule_start(stream_id, rtsp_url, options)
+    
+    result = stream_registry.start_stream(stream_id, rtsp_url, options)
+    status_code = 200 if result['status'] == 'success' else 400
+    return jsonify(result), status_code
+
+@stream_bp.route('/api/streams/<stream_id>/stop', methods=['POST'])
+def stop_stream_by_id(stream_id):
+    """Stop one stream"""
+    if Config.STREAM_SCHEDULER and scheduler.get_job(stream_id) is not None:
+        return jsonify(scheduler.cancel(stream_id)), 200
+    result = stream_registry.stop_stream(stream_id)
+    status_code = 404 if result['status'] == 'error' else 200
+    return jsonify(result), status_code
+
+@stream_bp.route('/api/streams/<stream_id>/status', methods=['GET'])
+def get_stream_status_by_id(stream_id):
+    """Get status of one stream"""
+    status = stream_registry.get_status(stream_id)
+    if status is None and Config.STREAM_SCHEDULER and scheduler.get_job(stream_id) is not None:
+        # Queued, not started by an agent yet
+        status = {'stream_id': stream_id, 'is_running': False}
+    if status is None:
+        return jsonify({'status': 'error', 'message': f'Unknown stream: {stream_id}'}), 404
+    return jsonify(_with_job(status, stream_id)), 200
+
+@stream_bp.route('/api/scheduler', methods=['GET'])
+def get_scheduler():
+    """Agents with their CPU budget and load, and the job queue"""
+    if not Config.STREAM_SCHEDULER:
+        return jsonify({'status': 'info', 'message': 'The stream scheduler is disabled (STREAM_SCHEDULER=false)'}), 200
+    return jsonify(scheduler.overview()), 200
+
 # ============= HLS File Serving =============
 
+MIMETYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/MP2T',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4'
+}
+
+def hls_cache_control(immutable):
+    """Cache-Control for segments (never change) or playlists (rewritten every segment)"""
+    if immutable:
+        return f'public, max-age={Config.HLS_SEGMENT_MAX_AGE}, immutable'
+    return f'public, max-age={Config.HLS_PLAYLIST_MAX_AGE}'
+
+def _hls_response(body, mimetype, immutable):
+    """Build a response with CORS and the caching policy for playlists or segments"""
+    response = Response(body, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = hls_cache_control(immutable)
+    return response
+
+def _serve_hls(relpath):
+    """
+    Serve a playlist or segment from the in-memory segment cache
+    
+    Segments never change once written, so they get a long immutable max-age;
+    playlists are rewritten every segment and only get a short one.
+    Streams in ingest mode are served from the shared-memory ingest ring.
+    """
+    # Segments are served from memory, which replaced send_from_directory
+    with profiler.phase('segment_cache'):
+        cached = get_uploaded(relpath) or segment_cache.get(relpath)
+    if cached is None:
+        return None
+    
+    response = _hls_response(cached.iter_chunks(), MIMETYPES[os.path.splitext(relpath)[1]], not cached.is_mutable)
+    response.content_length = cached.size
+    response.set_etag(cached.etag)
+    response.last_modified = cached.last_modified
+    return response.make_conditional(request)
+
+def _serve_dvr_playlist(stream_id):
+    """
+    Serve a playlist for a time window of the DVR archive
+    
+    Without an end, or with an end that hasn't been recorded yet, this is
+    an EVENT playlist that grows as segments are archived; otherwise a VOD
+    playlist. Windows are cut from the in-memory index, not the directory.
+    """
+    now = time.time()
+    try:
+        start = dvr.parse_time(request.args['start'], now) if 'start' in request.args else None
+        end = dvr.parse_time(request.args['end'], now) if 'end' in request.args else None
+    except ValueError as e:
+        return Response(f'Invalid start or end: {e}', status=400)
+    if start is not None and end is not None and end <= start:
+        return Response('end must be after start', status=400)
+    
+    index = dvr.dvr_store.index(stream_id)
+    stats = index.get_stats()
+    if stats is None:
+        return Response('No recording for this stream', status=404)
+    segments = index.window(start if start is not None else stats['start'], end if end is not None else math.inf)
+    if not segments:
+        return Response('No recording in this window', status=404)
+    
+    complete = end is not None and end <= stats['end']
+    response = _hls_response(dvr.build_playlist(segments, complete), MIMETYPES['.m3u8'], immutable=False)
+    if complete:
+        # Only changes when the window's oldest segments are evicted
+        response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+def _serve_dvr_segment(stream_id, filename):
+    """Serve an archived segment straight from disk"""
+    path = dvr.dvr_store.segment_path(stream_id, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    with profiler.phase('send_file'):
+        response = send_file(path, mimetype=MIMETYPES['.ts'], conditional=True)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = hls_cache_control(immutable=True)
+    return response
+
+def _serve_playlist(prefix):
+    """Serve stream.m3u8 of a stream directory, as LL-HLS if the stream runs in low-latency mode"""
+    if 'start' in request.args or 'end' in request.args:
+        return _serve_dvr_playlist(prefix.rstrip('/') or None)
+    
+    playlist = llhls.get_playlist(os.path.join(STREAMS_DIR, prefix))
+    if playlist is None:
+        # Streams with a bitrate ladder only have a master playlist
+        return _serve_hls(f'{prefix}stream.m3u8') or _serve_hls(f'{prefix}{abr.MASTER_PLAYLIST}')
+    
+    # Blocking playlist reload: hold the request until the requested segment/part exists
+    msn = request.args.get('_HLS_msn', type=int)
+    part = request.args.get('_HLS_part', type=int)
+    if part is not None and msn is None:
+        return Response('_HLS_part requires _HLS_msn', status=400)
+    if msn is not None:
+        if playlist.parts and msn > playlist.position(playlist.parts[-1].sequence)[0] + 2:
+            return Response('_HLS_msn is too far in the future', status=400)
+        if not playlist.wait_for(msn, part):
+            return Response('Playlist update timed out', status=503)
+    
+    response = _hls_response(playlist.render(), MIMETYPES['.m3u8'], immutable=False)
+    # A blocking reload URL names one exact playlist version, so edge caches may keep it
+    response.headers['Cache-Control'] = 'public, max-age=60' if msn is not None else 'no-cache'
+    return response
+
+def _serve_stream_file(prefix, filename):
+    """Serve a file of a stream directory, including LL-HLS parts and segments"""
+    if filename == 'stream.m3u8':
+        return _serve_playlist(prefix)
+    if filename.startswith('dvr/'):
+        return _serve_dvr_segment(prefix.rstrip('/') or None, filename[len('dvr/'):])
+    
+    segment_match = llhls.SEGMENT_PATTERN.match(filename)
+    if segment_match:
+        playlist = llhls.get_playlist(os.path.join(STREAMS_DIR, prefix))
+        if playlist is None:
+            return None
+        parts = [segment_cache.get(f'{prefix}{name}') for name in playlist.segment_part_files(int(segment_match.group(1)))]
+        if any(cached is None for cached in parts):
+            return None
+        response = _hls_response(b''.join(b''.join(cached.iter_chunks()) for cached in parts), MIMETYPES['.m4s'], immutable=True)
+        response.set_etag('-'.join(cached.etag for cached in parts))
+        return response.make_conditional(request)
+    
+    if llhls.PART_PATTERN.match(filename):
+        # Preload hints point at the next part before it exists; hold the request until it does
+        llhls.wait_for_file(os.path.join(STREAMS_DIR, prefix, filename), 3 * Config.LLHLS_PART_DURATION)
+    
+    return _serve_hls(f'{prefix}{filename}')
+
 @stream_bp.route('/stream.m3u8')
 def serve_m3u8():
     """Serve HLS manifest file with CORS headers"""
-    try:
-        response = send_from_directory(
-            STREAMS_DIR,
-            'stream.m3u8',
-            mimetype='application/vnd.apple.mpegurl'
-        )
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Cache-Control'] = 'no-cache'
-        return response
-    except FileNotFoundError:
+    response = _serve_playlist('')
+    if response is None:
         return jsonify({
             'error': 'Stream not found',
             'message': 'No active stream. Start a stream first using /api/stream/start'
         }), 404
+    return response
+
+@stream_bp.route('/master.m3u8')
+def serve_master_m3u8():
+    """Serve the master playlist of a stream started with a bitrate ladder"""
+    response = _serve_hls(abr.MASTER_PLAYLIST)
+    if response is None:
+        return jsonify({
+            'error': 'Master playlist not found',
+            'message': 'Start a stream with a "ladder" to produce renditions'
+        }), 404
+    return response
 
 @stream_bp.route('/stream<int:segment>.ts')
 def serve_segment(segment):
     """Serve HLS video segments with CORS headers"""
-    filename = f'stream{segment}.ts'
-    try:
-        response = send_from_directory(
-            STREAMS_DIR,
-            filename,
-            mimetype='video/MP2T'
-        )
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Cache-Control'] = 'no-cache'
-        return response
-    except FileNotFoundError:
+    response = _serve_hls(f'stream{segment}.ts')
+    if response is None:
         return Response('Segment not found', status=404)
+    return response
+
+@stream_bp.route('/streams/<stream_id>/<path:filename>')
+def serve_stream_file(stream_id, filename):
+    """Serve playlists and segments of one stream in the registry"""
+    if not stream_registry.is_valid_id(stream_id):
+        return Response('Not found', status=404)
+    return _serve_stream_file(f'{stream_id}/', filename) or Response('File not found', status=404)
 
 @stream_bp.route('/<path:filename>')
 def serve_hls_file(filename):
     """Serve any HLS-related file with CORS headers"""
-    if filename.endswith('.m3u8') or filename.endswith('.ts'):
-        try:
-            response = send_from_directory(STREAMS_DIR, filename)
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Cache-Control'] = 'no-cache'
-            return response
-        except FileNotFoundError:
-            return Response('File not found', status=404)
-    return Response('Not found', status=404)
+    return _serve_stream_file('', filename) or Response('File not found', status=404)
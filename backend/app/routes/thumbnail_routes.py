@@ -0,0 +1,102 @@
+from flask import Blueprint, Response, request, jsonify, url_for
+from config import Config
+from app.utils.stream_manager import stream_manager, stream_registry
+from app.utils.thumbnails import MAX_WIDTH, MIN_WIDTH, thumbnail_service
+
+thumbnail_bp = Blueprint('thumbnails', __name__)
+
+def _get_manager(stream_id):
+    """Manager of a stream that has state (running, or crashed and keeping its files)"""
+    manager = stream_manager if stream_id is None else stream_registry.get(stream_id)
+    if manager is None or manager._load_state() is None:
+        return None
+    return manager
+
+def _parse_width(default):
+    """Requested image width, or None if invalid"""
+    try:
+        width = int(request.args.get('width', default))
+    except ValueError:
+        return None
+    return width if MIN_WIDTH <= width <= MAX_WIDTH else None
+
+def _error(message, status_code):
+    return jsonify({'status': 'error', 'message': message}), status_code
+
+def _image_response(image, max_age):
+    response = Response(image.data, mimetype='image/jpeg')
+    response.set_etag(image.etag)
+    response.last_modified = image.created_at
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    return response.make_conditional(request)
+
+def _thumbnail(stream_id):
+    manager = _get_manager(stream_id)
+    if manager is None:
+        return _error('No stream is running', 404)
+    width = _parse_width(Config.THUMBNAIL_WIDTH)
+    if width is None:
+        return _error(f'width must be between {MIN_WIDTH} and {MAX_WIDTH}', 400)
+
+    image = thumbnail_service.thumbnail(manager, width)
+    if image is None:
+        return _error('No segment to take a thumbnail from yet', 404)
+    return _image_response(image, int(Config.THUMBNAIL_INTERVAL))
+
+def _sprite(stream_id, vtt):
+    manager = _get_manager(stream_id)
+    if manager is None:
+        return _error('No stream is running', 404)
+    width = _parse_width(Config.THUMBNAIL_SPRITE_WIDTH)
+    if width is None:
+        return _error(f'width must be between {MIN_WIDTH} and {MAX_WIDTH}', 400)
+
+    if not vtt and request.args.get('v'):
+        # A version named by a track: the same sheet for as long as it is cached
+        sprite = thumbnail_service.cache.find(request.args['v'])
+        if sprite is not None:
+            return _image_response(sprite, Config.HLS_SEGMENT_MAX_AGE)
+
+    sprite = thumbnail_service.sprite(manager, width)
+    if sprite is None:
+        return _error('No segments to build a sprite sheet from yet', 404)
+    if not vtt:
+        return _image_response(sprite, int(Config.THUMBNAIL_INTERVAL))
+
+    # The sheet URL names this version, so players fetch the sheet the cues describe
+    endpoint = 'thumbnails.get_sprite' if stream_id is None else 'thumbnails.get_sprite_by_id'
+    image_url = url_for(endpoint, stream_id=stream_id, width=width, v=sprite.etag)
+    response = Response(sprite.render_vtt(image_url), mimetype='text/vtt')
+    response.set_etag(sprite.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@thumbnail_bp.route('/api/stream/thumbnail', methods=['GET'])
+def get_thumbnail():
+    """Keyframe of the newest segment as a JPEG"""
+    return _thumbnail(None)
+
+@thumbnail_bp.route('/api/streams/<stream_id>/thumbnail', methods=['GET'])
+def get_thumbnail_by_id(stream_id):
+    """Keyframe of one stream's newest segment as a JPEG"""
+    return _thumbnail(stream_id)
+
+@thumbnail_bp.route('/api/stream/sprite.jpg', methods=['GET'])
+def get_sprite():
+    """Sprite sheet of the retained segments"""
+    return _sprite(None, vtt=False)
+
+@thumbnail_bp.route('/api/streams/<stream_id>/sprite.jpg', methods=['GET'])
+def get_sprite_by_id(stream_id):
+    """Sprite sheet of one stream's retained segments"""
+    return _sprite(stream_id, vtt=False)
+
+@thumbnail_bp.route('/api/stream/sprite.vtt', methods=['GET'])
+def get_sprite_track():
+    """WebVTT thumbnail track for the sprite sheet"""
+    return _sprite(None, vtt=True)
+
+@thumbnail_bp.route('/api/streams/<stream_id>/sprite.vtt', methods=['GET'])
+def get_sprite_track_by_id(stream_id):
+    """WebVTT thumbnail track for one stream's sprite sheet"""
+    return _sprite(stream_id, vtt=True)
@@ -0,0 +1,136 @@
+"""
+Adaptive Bitrate - Rendition ladders for multi-bitrate HLS output
+"""
+
+import os
+from typing import List, Optional, Union
+from config import Config
+
+MASTER_PLAYLIST = 'master.m3u8'
+
+# Building blocks for ladders; height is the output height, width follows the source aspect
+RENDITIONS = {
+    '1080p': {'height': 1080, 'video_bitrate': '5000k', 'audio_bitrate': '128k'},
+    '720p': {'height': 720, 'video_bitrate': '2800k', 'audio_bitrate': '128k'},
+    '480p': {'height': 480, 'video_bitrate': '1400k', 'audio_bitrate': '96k'},
+    '360p': {'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '64k'},
+    '240p': {'height': 240, 'video_bitrate': '400k', 'audio_bitrate': '64k'}
+}
+
+
+def parse_ladders(spec: str) -> dict:
+    """Parse named ladders from 'name=1080p,720p;mobile=720p,360p'"""
+    ladders = {}
+    for entry in spec.split(';'):
+        if '=' not in entry:
+            continue
+        name, renditions = entry.split('=', 1)
+        ladders[name.strip()] = [rendition.strip() for rendition in renditions.split(',') if rendition.strip()]
+    return ladders
+
+
+def resolve_ladder(value: Union[str, List[str]]) -> List[str]:
+    """
+    Resolve a ladder name or an explicit list of rendition names
+
+    Raises:
+        ValueError: if the ladder or a rendition is unknown
+    """
+    if isinstance(value, str):
+        ladders = parse_ladders(Config.ABR_LADDERS)
+        if value not in ladders:
+            raise ValueError(f'Unknown ladder "{value}". Available: {", ".join(sorted(ladders))}')
+        names = ladders[value]
+    elif isinstance(value, list) and all(isinstance(name, str) for name in value):
+        names = value
+    else:
+        raise ValueError('ladder must be a ladder name or a list of rendition names')
+
+    unknown = [name for name in names if name not in RENDITIONS]
+    if unknown:
+        raise ValueError(f'Unknown renditions: {", ".join(unknown)}. Available: {", ".join(RENDITIONS)}')
+    if not names or len(set(names)) != len(names):
+        raise ValueError('ladder must list each rendition once')
+    # Highest quality first, as players expect in the master playlist
+    return sorted(names, key=lambda name: -RENDITIONS[name]['height'])
+
+
+def build_output_args(ladder: List[str], output_dir: str, segment_time: int = 2,
+                      prefilter: Optional[str] = None, prefilter_label: Optional[str] = None,
+                      audio: bool = True) -> list:
+    """
+    FFmpeg output arguments encoding every rendition in one process
+
+    The decoded video is split once and scaled per rendition. Keyframes are
+    forced on segment boundaries so all renditions switch cleanly. An optional
+    prefilter graph (e.g. overlay burn-in) runs once before the split.
+    Without audio (a source probed to have no audio track) the renditions
+    are video-only; mapping a missing track would make FFmpeg exit.
+    """
+    count = len(ladder)
+    filters = [prefilter] if prefilter else []
+    source = f'[{prefilter_label}]' if prefilter else '[0:v]'
+    filters.append(f'{source}split={count}' + ''.join(f'[v{i}]' for i in range(count)))
+    for i, name in enumerate(ladder):
+        height = RENDITIONS[name]['height']
+        # Never upscale a source smaller than the rendition
+        filters.append(f"[v{i}]scale=-2:'min({height},ih)'[v{i}out]")
+
+    args = ['-filter_complex', ';'.join(filters)]
+    stream_map = []
+    for i, name in enumerate(ladder):
+        rendition = RENDITIONS[name]
+        bitrate = int(rendition['video_bitrate'].rstrip('k'))
+        args += [
+            '-map', f'[v{i}out]',
+            f'-c:v:{i}', 'libx264',
+            f'-b:v:{i}', rendition['video_bitrate'],
+            f'-maxrate:v:{i}', f'{int(bitrate * 1.07)}k',
+            f'-bufsize:v:{i}', f'{int(bitrate * 1.5)}k'
+        ]
+        if audio:
+            args += ['-map', '0:a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', rendition['audio_bitrate']]
+            stream_map.append(f'v:{i},a:{i},name:{name}')
+        else:
+            stream_map.append(f'v:{i},name:{name}')
+
+    args += [
+        '-preset', 'veryfast',
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_time})',
+        '-sc_threshold', '0',
+        '-f', 'hls',
+        '-hls_time', str(segment_time),
+        '-hls_list_size', '10',
+        '-hls_flags', 'delete_segments+temp_file+program_date_time+independent_segments',
+        '-hls_start_number_source', 'epoch',
+        '-master_pl_name', MASTER_PLAYLIST,
+        '-var_stream_map', ' '.join(stream_map),
+        '-hls_segment_filename', os.path.join(output_dir, 'stream_%v_%d.ts'),
+        '-loglevel', 'warning',
+        os.path.join(output_dir, 'stream_%v.m3u8')
+    ]
+    return args
+
+
+def estimate_rendition_cpu(ladder: List[str], cpu_percent: Optional[float]) -> list:
+    """
+    Split the process CPU usage across renditions
+
+    All renditions share one FFmpeg process, so per-rendition cost is
+    estimated by weighting each one by its pixel count (height squared, the
+    aspect ratio being the same for all of them).
+    """
+    weights = [RENDITIONS[name]['height'] ** 2 for name in ladder]
+    total = sum(weights)
+    renditions = []
+    for name, weight in zip(ladder, weights):
+        rendition = RENDITIONS[name]
+        renditions.append({
+            'name': name,
+            'height': rendition['height'],
+            'video_bitrate': rendition['video_bitrate'],
+            'playlist': f'stream_{name}.m3u8',
+            'cpu_share': round(weight / total, 3),
+            'cpu_percent': round(cpu_percent * weight / total, 1) if cpu_percent is not None else None
+        })
+    return renditions
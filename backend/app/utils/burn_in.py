@@ -0,0 +1,204 @@
+"""
+Overlay Burn-In - Draws stored overlays into the video with FFmpeg filters
+
+Text overlays are rendered by a fixed pool of named drawtext filters. A zmq
+filter at the head of the graph lets any worker re-target those slots at
+runtime ("drawtext@t3 reinit text=..."), so creating, editing, moving or
+deleting a text overlay never restarts the encoder. Image overlays use movie
+sources, which FFmpeg cannot swap at runtime: their position is updated live
+through the overlay filters, but adding, removing or changing an image
+requires a restart. Images are read from the image proxy's cache, never
+from the overlay's URL: the proxy only fetches public http(s) addresses,
+and an image it can't fetch is left out of the video.
+
+Runtime updates need FFmpeg built with --enable-libzmq and pyzmq installed.
+"""
+
+import socket
+from typing import List, Optional, Tuple
+from config import Config
+from app.utils.image_proxy import image_proxy
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+OUTPUT_LABEL = 'vburn'
+# Images are fetched at this multiple of their canvas size: enough for 4K output
+IMAGE_SCALE = 2160 / Config.BURN_IN_CANVAS_HEIGHT
+
+
+def allocate_port() -> int:
+    """Pick a free local TCP port for the zmq command socket"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def split_overlays(overlays: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """Text overlays that fit in the slot pool, and image overlays, in creation order"""
+    ordered = sorted(overlays, key=lambda overlay: (str(overlay.get('created_at', '')), str(overlay['_id'])))
+    texts = [overlay for overlay in ordered if overlay.get('type') == 'text'][:Config.BURN_IN_TEXT_SLOTS]
+    images = [overlay for overlay in ordered if overlay.get('type') == 'image']
+    return texts, images
+
+
+def image_file(image: dict) -> Optional[str]:
+    """Local copy of an image overlay from the image proxy, or None if it can't be burned in"""
+    size = image.get('size') or {}
+    try:
+        name = image_proxy.render(image.get('content') or '', size.get('width', 100) * IMAGE_SCALE,
+                                  size.get('height', 50) * IMAGE_SCALE)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"✗ Image overlay {image.get('_id')} left out of burn-in: {e}")
+        return None
+    if name is None or name.endswith('.svg'):
+        # SVGs need an FFmpeg built with librsvg
+        print(f"✗ Image overlay {image.get('_id')} left out of burn-in: image unavailable")
+        return None
+    return image_proxy.path(name)
+
+
+def burnable_images(overlays: List[dict]) -> List[Tuple[dict, str]]:
+    """(overlay, local file) of the image overlays that can be burned in, in creation order"""
+    _, images = split_overlays(overlays)
+    files = [(image, image_file(image)) for image in images]
+    return [(image, path) for image, path in files if path is not None]
+
+
+def image_signature(overlays: List[dict]) -> list:
+    """What the filtergraph depends on; a change here needs an encoder restart"""
+    return [[image['content'], path, image['size']['width'], image['size']['height'], _opacity(image)]
+            for image, path in burnable_images(overlays)]
+
+
+def _quote(value) -> str:
+    """Quote an option value for FFmpeg's option parser"""
+    return "'" + str(value).replace("'", "'\\''") + "'"
+
+
+def _graph_escape(value: str) -> str:
+    """Escape filter arguments for the filtergraph parser (second escaping level)"""
+    for char in ('\\', "'", '[', ']', ',', ';'):
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def _opacity(overlay: dict) -> float:
+    try:
+        return max(0.0, min(1.0, float(overlay.get('style', {}).get('opacity', 1))))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _scaled(value, axis: str, prefix: str = '') -> str:
+    """
+    Expression mapping editor canvas pixels to video pixels
+
+    prefix selects the filter's name for the main video size ('' for drawtext's
+    w/h, 'main_' for overlay and scale2ref).
+    """
+    canvas = Config.BURN_IN_CANVAS_WIDTH if axis == 'x' else Config.BURN_IN_CANVAS_HEIGHT
+    frame = prefix + ('w' if axis == 'x' else 'h')
+    try:
+        return f'{float(value)}*{frame}/{canvas}'
+    except (TypeError, ValueError):
+        return '0'
+
+
+def _text_options(overlay: Optional[dict]) -> str:
+    """drawtext options for one slot; an empty slot draws a transparent space"""
+    if overlay is None:
+        return "text=' ':alpha=0"
+    style = overlay.get('style', {})
+    options = [
+        f"text={_quote(overlay.get('content') or ' ')}",
+        f"x={_scaled(overlay['position']['x'], 'x')}",
+        f"y={_scaled(overlay['position']['y'], 'y')}",
+        f"fontsize={_quote(style.get('fontSize', 24))}",
+        f"fontcolor={_quote(style.get('color', 'white'))}",
+        f"alpha={_opacity(overlay)}"
+    ]
+    if style.get('fontFamily'):
+        options.append(f"font={_quote(style['fontFamily'])}")
+    return ':'.join(options)
+
+
+def build_filtergraph(overlays: List[dict], zmq_port: int, input_label: str = '0:v') -> str:
+    """Filtergraph drawing all overlays onto the input video, ending in [vburn]"""
+    images = burnable_images(overlays)
+    chain = [f"zmq=bind_address='tcp\\://127.0.0.1\\:{zmq_port}'"]
+    for slot in range(Config.BURN_IN_TEXT_SLOTS):
+        chain.append(f"drawtext@t{slot}=" + _graph_escape("expansion=none:text=' ':alpha=0"))
+    graph = [f"[{input_label}]{','.join(chain)}[base0]"]
+
+    for index, (image, path) in enumerate(images):
+        width, height = image['size']['width'], image['size']['height']
+        # Scale to the overlay box relative to the main video, like the editor canvas does
+        graph.append(
+            f"movie={_graph_escape(_quote(path))},format=rgba,"
+            f"colorchannelmixer=aa={_opacity(image)}[img{index}src]"
+        )
+        graph.append(
+            f"[img{index}src][base{index}]scale2ref="
+            f"w={_scaled(width, 'x', 'main_')}:h={_scaled(height, 'y', 'main_')}"
+            f"[img{index}][main{index}]"
+        )
+        graph.append(
+            f"[main{index}][img{index}]overlay@i{index}="
+            f"x={_scaled(image['position']['x'], 'x', 'main_')}:"
+            f"y={_scaled(image['position']['y'], 'y', 'main_')}[base{index + 1}]"
+        )
+
+    graph.append(f"[base{len(images)}]null[{OUTPUT_LABEL}]")
+    return ';'.join(graph)
+
+
+def build_commands(overlays: List[dict]) -> List[str]:
+    """zmq messages bringing a running graph in line with the overlays"""
+    texts, _ = split_overlays(overlays)
+    images = burnable_images(overlays)
+    commands = []
+    for slot in range(Config.BURN_IN_TEXT_SLOTS):
+        overlay = texts[slot] if slot < len(texts) else None
+        commands.append(f'drawtext@t{slot} reinit {_text_options(overlay)}')
+    for index, (image, _) in enumerate(images):
+        commands.append(f"overlay@i{index} x {_scaled(image['position']['x'], 'x', 'main_')}")
+        commands.append(f"overlay@i{index} y {_scaled(image['position']['y'], 'y', 'main_')}")
+    return commands
+
+
+def send_commands(zmq_port: int, commands: List[str], timeout_ms: int = 1000) -> dict:
+    """Send filter commands to a running FFmpeg through its zmq filter"""
+    if zmq is None:
+        return {'status': 'error', 'message': 'pyzmq is not installed; overlays apply on next restart'}
+
+    context = zmq.Context.instance()
+    sock = context.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    sock.setsockopt(zmq.SNDTIMEO, timeout_ms)
+    failed = []
+    try:
+        sock.connect(f'tcp://127.0.0.1:{zmq_port}')
+        for command in commands:
+            sock.send_string(command)
+            reply = sock.recv_string()
+            # FFmpeg answers "<code> <message>", 0 meaning success
+            if not reply.startswith('0 '):
+                failed.append({'command': command.split(' ', 1)[0], 'reply': reply})
+    except zmq.ZMQError as e:
+        return {'status': 'error', 'message': f'Encoder did not accept commands: {e}'}
+    finally:
+        sock.close()
+
+    if failed:
+        return {'status': 'error', 'message': 'Some filter commands failed', 'failed': failed}
+    return {'status': 'success', 'message': f'Applied {len(commands)} filter commands'}
+
+
+def load_overlays(stream_id: Optional[str] = None) -> List[dict]:
+    """Current overlays of a stream from the database"""
+    from app.models.overlay import Overlay
+    return Overlay.get_for_stream(stream_id)
@@ -0,0 +1,330 @@
+"""
+DVR - Archives segments beyond the live window for rewind and replay
+
+FFmpeg only keeps the last few segments of a live stream. For streams
+started with "dvr", an archiver thread in the worker that owns FFmpeg
+follows the live playlist and hard-links every new segment into DVR_DIR
+before FFmpeg deletes it (no copy on the same filesystem), appending one
+line per segment to the stream's index.jsonl. The archive is kept within
+DVR_MAX_AGE and DVR_MAX_BYTES by evicting the oldest segments.
+
+Every worker keeps the index in memory and only reads lines appended since
+its last request, so playlists for any time window are built by bisecting
+the in-memory index instead of scanning the archive directory.
+"""
+
+import bisect
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from config import Config
+from app.utils.llhls import LowLatencyPlaylist
+from app.utils.process_registry import process_registry
+
+INDEX_FILENAME = 'index.jsonl'
+# Zone suffix (Z, +hhmm or +hh:mm) and fraction of an ISO 8601 time
+ISO_ZONE_PATTERN = re.compile(r'(Z|[+-]\d{2}:?\d{2})$', re.IGNORECASE)
+ISO_FRACTION_PATTERN = re.compile(r'\.(\d+)')
+# Segments further apart than this (a restart or an outage) are marked as a discontinuity
+GAP_TOLERANCE = 0.5
+# Evict down to this share of the budget so the index isn't rewritten for every new segment
+EVICTION_SLACK = 0.9
+
+
+def parse_iso_time(value: str) -> datetime:
+    """
+    Parse an ISO 8601 time as FFmpeg and clients write it ("...Z", "+0000",
+    any number of fraction digits); datetime.fromisoformat only takes all of
+    these from Python 3.11
+
+    Raises:
+        ValueError: if the value isn't an ISO 8601 time
+    """
+    value = value.strip()
+    zone = ISO_ZONE_PATTERN.search(value)
+    suffix = ''
+    if zone:
+        value = value[:zone.start()]
+        suffix = '+00:00' if zone.group(1).upper() == 'Z' else zone.group(1)[:3] + ':' + zone.group(1)[-2:]
+    value = ISO_FRACTION_PATTERN.sub(lambda match: '.' + match.group(1)[:6].ljust(6, '0'), value)
+    return datetime.fromisoformat(value + suffix)
+
+
+def parse_time(value: str, now: Optional[float] = None) -> float:
+    """
+    Parse a start/end parameter into a Unix timestamp
+
+    Accepts Unix seconds, ISO 8601, or negative seconds relative to now
+    (start=-60 is one minute ago).
+
+    Raises:
+        ValueError: if the value is neither
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = parse_iso_time(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    if not math.isfinite(seconds):
+        raise ValueError(f'Invalid time: {value}')
+    if seconds <= 0:
+        return (now if now is not None else time.time()) + seconds
+    return seconds
+
+
+def _program_date_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat(timespec='milliseconds')
+
+
+class DvrIndex:
+    """In-memory copy of one stream's index.jsonl, refreshed incrementally"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        self.segments: List[dict] = []
+        # Segment start times, for bisecting windows
+        self.starts: List[float] = []
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Read lines appended since the last refresh, or everything after a rewrite"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            with self.lock:
+                self.segments, self.starts, self._inode, self._offset = [], [], None, 0
+            return
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return
+        with self.lock:
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # Evictions rewrite the index into a new file
+                self.segments, self.starts, self._inode, self._offset = [], [], stat.st_ino, 0
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except OSError:
+                return
+            # Only consume complete lines; a line being appended is read next time
+            complete = data[:data.rfind(b'\n') + 1]
+            self._offset += len(complete)
+            for line in complete.splitlines():
+                try:
+                    segment = json.loads(line)
+                except ValueError:
+                    continue
+                if self.segments and segment['seq'] <= self.segments[-1]['seq']:
+                    continue
+                self.segments.append(segment)
+                self.starts.append(segment['start'])
+
+    @property
+    def last_sequence(self) -> Optional[int]:
+        return self.segments[-1]['seq'] if self.segments else None
+
+    def window(self, start: float, end: float) -> List[dict]:
+        """Segments overlapping [start, end)"""
+        # The segment playing at `start` begins before it
+        with self.lock:
+            first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+            last = bisect.bisect_left(self.starts, end)
+            segments = self.segments[first:last]
+        return [segment for segment in segments if segment['start'] + segment['duration'] > start]
+
+    def get_stats(self) -> Optional[dict]:
+        """Time range and size of the archive, for stream status"""
+        if not self.segments:
+            return None
+        newest = self.segments[-1]
+        return {
+            'start': self.segments[0]['start'],
+            'end': newest['start'] + newest['duration'],
+            'segments': len(self.segments),
+            'bytes': sum(segment['size'] for segment in self.segments)
+        }
+
+
+def build_playlist(segments: List[dict], complete: bool, uri_prefix: str = 'dvr/') -> bytes:
+    """
+    Render an EVENT playlist for a window, or a VOD playlist once the window is complete
+
+    Players append to an EVENT playlist as it grows; a VOD playlist is final.
+    """
+    target = math.ceil(max((segment['duration'] for segment in segments), default=2))
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{target}',
+        f'#EXT-X-MEDIA-SEQUENCE:{segments[0]["seq"] if segments else 0}',
+        f'#EXT-X-PLAYLIST-TYPE:{"VOD" if complete else "EVENT"}'
+    ]
+    previous_end = None
+    for segment in segments:
+        if previous_end is not None and abs(segment['start'] - previous_end) > GAP_TOLERANCE:
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{_program_date_time(segment["start"])}')
+        lines.append(f'#EXTINF:{segment["duration"]:.3f},')
+        lines.append(f'{uri_prefix}{segment["file"]}')
+        previous_end = segment['start'] + segment['duration']
+    if complete:
+        lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class DvrStore:
+    """Archive directories and in-memory indexes of every stream"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.abspath(root or Config.DVR_DIR)
+        self.indexes: Dict[Optional[str], DvrIndex] = {}
+        self.lock = threading.Lock()
+
+    def stream_dir(self, stream_id: Optional[str]) -> str:
+        # Same layout as HLS_OUTPUT_DIR: the default stream at the root, others in subdirectories
+        return self.root if stream_id is None else os.path.join(self.root, stream_id)
+
+    def index(self, stream_id: Optional[str]) -> DvrIndex:
+        """Up-to-date index of a stream's archive"""
+        index = self.indexes.get(stream_id)
+        if index is None:
+            with self.lock:
+                index = self.indexes.setdefault(stream_id, DvrIndex(self.stream_dir(stream_id)))
+        index.refresh()
+        return index
+
+    def segment_path(self, stream_id: Optional[str], filename: str) -> Optional[str]:
+        """Path of an archived segment, if the name is a plain file name"""
+        if os.path.basename(filename) != filename or not filename.endswith('.ts'):
+            return None
+        return os.path.join(self.stream_dir(stream_id), filename)
+
+
+class DvrArchiver:
+    """Follows one FFmpeg run's live playlist and archives its segments"""
+
+    def __init__(self, store: DvrStore, stream_id: Optional[str], media_dir: str,
+                 process: subprocess.Popen):
+        self.store = store
+        self.stream_id = stream_id
+        self.media_dir = media_dir
+        self.process = process
+        self.directory = store.stream_dir(stream_id)
+        # Index writes of a stream are serialized across workers: a new run may
+        # start in another worker while this one archives its last segments
+        self.lock_key = 'dvr' if stream_id is None else f'dvr-{stream_id}'
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name=f'dvr-{self.process.pid}', daemon=True).start()
+
+    def _run(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            exited = self.process.poll() is not None
+            try:
+                self.archive()
+            except Exception as e:
+                print(f"✗ DVR archiving failed: {e}")
+            if exited:
+                # One last pass after exit picked up the final segments
+                return
+            time.sleep(Config.DVR_POLL_INTERVAL)
+
+    def archive(self) -> int:
+        """Archive segments of the live playlist that aren't in the index yet"""
+        try:
+            with open(os.path.join(self.media_dir, 'stream.m3u8')) as f:
+                segments = LowLatencyPlaylist._parse(f.read())
+        except OSError:
+            return 0
+
+        archived = 0
+        with process_registry.lock(self.lock_key):
+            index = self.store.index(self.stream_id)
+            last = index.last_sequence
+            previous_end = None
+            lines = []
+            for segment in segments:
+                if segment.program_date_time:
+                    start = parse_iso_time(segment.program_date_time).timestamp()
+                elif previous_end is not None:
+                    start = previous_end
+                else:
+                    start = time.time() - segment.duration
+                previous_end = start + segment.duration
+                if last is not None and segment.sequence <= last:
+                    continue
+                size = self._link(segment.uri)
+                if size is None:
+                    continue
+                lines.append(json.dumps({
+                    'seq': segment.sequence,
+                    'file': segment.uri,
+                    'start': round(start, 3),
+                    'duration': segment.duration,
+                    'size': size
+                }) + '\n')
+            if lines:
+                with open(index.path, 'a') as f:
+                    f.write(''.join(lines))
+                archived = len(lines)
+                self._evict(self.store.index(self.stream_id))
+        return archived
+
+    def _link(self, filename: str) -> Optional[int]:
+        """Hard-link (or copy, across filesystems) one segment into the archive"""
+        source = os.path.join(self.media_dir, filename)
+        target = os.path.join(self.directory, filename)
+        try:
+            try:
+                os.link(source, target)
+            except FileExistsError:
+                pass
+            except OSError:
+                # The ingest ring lives on a tmpfs
+                shutil.copyfile(source, target)
+            return os.stat(target).st_size
+        except OSError:
+            # FFmpeg already deleted it
+            return None
+
+    def _evict(self, index: DvrIndex) -> None:
+        """Drop the oldest segments beyond DVR_MAX_AGE or DVR_MAX_BYTES (caller holds the lock)"""
+        segments = index.segments
+        total = sum(segment['size'] for segment in segments)
+        cutoff = time.time() - Config.DVR_MAX_AGE
+        if not segments or (segments[0]['start'] >= cutoff and total <= Config.DVR_MAX_BYTES):
+            return
+
+        cutoff = time.time() - Config.DVR_MAX_AGE * EVICTION_SLACK
+        dropped = 0
+        while dropped < len(segments) - 1 and (segments[dropped]['start'] < cutoff or total > Config.DVR_MAX_BYTES * EVICTION_SLACK):
+            total -= segments[dropped]['size']
+            dropped += 1
+
+        tmp_path = f'{index.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(json.dumps(segment) + '\n' for segment in segments[dropped:])
+        os.replace(tmp_path, index.path)
+        for segment in segments[:dropped]:
+            try:
+                os.remove(os.path.join(self.directory, segment['file']))
+            except FileNotFoundError:
+                pass
+        index.refresh()
+
+
+# Global archive store
+dvr_store = DvrStore()
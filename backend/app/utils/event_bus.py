@@ -0,0 +1,256 @@
+"""
+Event Bus - Fans out overlay and stream changes to push clients in every worker
+
+Events are inserted into a capped MongoDB collection. Each worker tails it
+with one tailable cursor and hands new events to its connected Server-Sent
+Events clients, so a change made through any worker reaches every client
+and idle clients cost nothing but a keepalive. Events carry a sequence
+number from a counter in the meta collection, which clients send back as
+Last-Event-ID to replay what they missed while reconnecting.
+
+Numbers are taken from the counter before the insert, so two workers may
+insert N+1 before N. The tailing thread delivers events strictly in
+sequence order: events after a missing number are held back until it
+arrives, or for at most GAP_WAIT_SECONDS if it never does (a publish that
+failed after taking its numbers). Replays stop at such a gap as well.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, PyMongoError
+from werkzeug.http import http_date
+from config import Config
+from app.database import mongo
+
+COLLECTION = 'events'
+SEQUENCE_ID = 'events'
+# How long events wait for a missing earlier sequence number
+GAP_WAIT_SECONDS = 2.0
+
+
+def _json_default(value):
+    # Same date format as the REST responses
+    if isinstance(value, datetime):
+        return http_date(value)
+    return str(value)
+
+
+def format_event(event: dict) -> str:
+    """Serialize an event as one SSE message"""
+    data = json.dumps(event['data'], default=_json_default)
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+class Subscriber:
+    """One connected client's queue of pending events"""
+
+    def __init__(self, max_pending: int):
+        self.events: 'queue.Queue[Optional[dict]]' = queue.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def deliver(self, event: dict) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Too slow to keep up: end its stream, the client reconnects and replays
+            self.overflowed = True
+            with self.events.mutex:
+                self.events.queue.clear()
+                self.events.queue.append(None)
+                self.events.not_empty.notify()
+
+
+class EventBus:
+    """Publishes events to MongoDB and delivers them to this worker's subscribers"""
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self.subscribers: List[Subscriber] = []
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._created = False
+        # Every event up to this sequence number was dispatched (or given up on)
+        self.released_seq: Optional[int] = None
+
+    @property
+    def db(self):
+        return mongo.db
+
+    @property
+    def collection(self):
+        """Capped events collection, created on first use"""
+        if not self._created:
+            try:
+                self.db.create_collection(
+                    COLLECTION, capped=True,
+                    size=Config.EVENT_BUS_MAX_BYTES, max=Config.EVENT_BUS_MAX_EVENTS
+                )
+                # Tailable cursors die on an empty collection
+                self.db[COLLECTION].insert_one({'seq': 0, 'type': 'bus.created', 'data': {}})
+            except CollectionInvalid:
+                pass
+            self._created = True
+        return self.db[COLLECTION]
+
+    def _next_sequence(self, count: int = 1) -> int:
+        doc = self.db.meta.find_one_and_update(
+            {'_id': SEQUENCE_ID},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc['seq'] - count + 1
+
+    def publish(self, event_type: str, data: dict) -> None:
+        """Broadcast one event; failures are logged, never raised to the caller"""
+        self.publish_many([(event_type, data)])
+
+    def publish_many(self, events: List[tuple]) -> None:
+        """Broadcast several (type, data) events with one sequence allocation and insert"""
+        if not events:
+            return
+        try:
+            first = self._next_sequence(len(events))
+            self.collection.insert_many([
+                {'seq': first + index, 'type': event_type, 'data': data, 'created_at': datetime.utcnow()}
+                for index, (event_type, data) in enumerate(events)
+            ], ordered=True)
+        except PyMongoError as e:
+            print(f"✗ Event publish failed: {e}")
+
+    def ensure_started(self) -> None:
+        """Start tailing the events collection (once per worker process, also after fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self.lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._tail, name='event-bus', daemon=True)
+            self._thread.start()
+
+    def _tail(self) -> None:
+        last_seq = None
+        # Events that arrived ahead of a missing sequence number
+        held: Dict[int, dict] = {}
+        gap_since = None
+        while True:
+            try:
+                if last_seq is None:
+                    newest = self.collection.find_one(sort=[('$natural', -1)])
+                    last_seq = newest['seq'] if newest else 0
+                    self.released_seq = last_seq
+                cursor = self.collection.find(
+                    {'seq': {'$gt': last_seq}}, cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    for event in cursor:
+                        if event['seq'] > last_seq:
+                            held[event['seq']] = event
+                        last_seq = self._release(held, last_seq)
+                    # The await timed out: check on gaps
+                    if not held:
+                        gap_since = None
+                    elif gap_since is None:
+                        gap_since = time.monotonic()
+                    elif time.monotonic() - gap_since >= GAP_WAIT_SECONDS:
+                        # Last look for the missing events, then move past them
+                        for event in self.collection.find({'seq': {'$gt': last_seq, '$lt': min(held)}}):
+                            held[event['seq']] = event
+                        last_seq = self._release(held, last_seq, skip_gaps=True)
+                        gap_since = None
+            except PyMongoError as e:
+                print(f"✗ Event bus tail failed: {e}")
+            time.sleep(1)
+
+    def _release(self, held: Dict[int, dict], last_seq: int, skip_gaps: bool = False) -> int:
+        """Dispatch held events in sequence order up to the first gap; returns the last dispatched seq"""
+        while held:
+            if last_seq + 1 not in held:
+                if not skip_gaps:
+                    break
+                last_seq = min(held) - 1
+            last_seq += 1
+            self._dispatch(held.pop(last_seq))
+        self.released_seq = last_seq
+        return last_seq
+
+    def _dispatch(self, event: dict) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(event)
+
+    def subscribe(self) -> Subscriber:
+        self.ensure_started()
+        subscriber = Subscriber(self.max_pending)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def replay(self, after_seq: int) -> List[dict]:
+        """
+        Events newer than after_seq still held in the capped collection
+
+        Stops at a missing sequence number the tailing thread is still
+        waiting for: the events after it reach subscribers live, in order.
+        """
+        try:
+            events = list(self.collection.find({'seq': {'$gt': after_seq}}).sort('seq', 1))
+        except PyMongoError as e:
+            print(f"✗ Event replay failed: {e}")
+            return []
+        released = self.released_seq
+        expected = after_seq + 1
+        for index, event in enumerate(events):
+            if event['seq'] != expected and released is not None and event['seq'] > released:
+                return events[:index]
+            expected = event['seq'] + 1
+        return events
+
+    def stream(self, last_event_id: Optional[str] = None) -> Iterator[str]:
+        """SSE messages for one client, starting after Last-Event-ID if given"""
+        subscriber = self.subscribe()
+        try:
+            yield f'retry: {Config.SSE_RETRY_MS}\n\n'
+            last_seq = 0
+            if last_event_id and last_event_id.isdigit():
+                # Subscribed first, so nothing falls between the replay and live events
+                last_seq = int(last_event_id)
+                for event in self.replay(last_seq):
+                    last_seq = event['seq']
+                    yield format_event(event)
+
+            while True:
+                try:
+                    event = subscriber.events.get(timeout=Config.SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Keeps proxies from closing the idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    return
+                if event['seq'] <= last_seq:
+                    continue
+                last_seq = event['seq']
+                yield format_event(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# Global event bus
+event_bus = EventBus()
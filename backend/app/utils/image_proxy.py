@@ -0,0 +1,398 @@
+"""
+Image Proxy - Overlay images fetched once and scaled down to the overlay size
+
+Image overlays point at arbitrary external URLs, often full-size originals
+shown in a box of a few hundred pixels. The proxy downloads each URL once
+and keeps the original on disk under the hash of its content. Each
+overlay size gets a copy scaled by FFmpeg to fit the box, never enlarged.
+File names are content hashes, so a served file never changes and
+browsers may cache it forever.
+
+The cache directory is shared by all workers and bounded by
+IMAGE_PROXY_MAX_BYTES. Least recently used files are deleted first, and a
+served file counts as used. Updating an overlay refreshes its image with a
+conditional request to the origin, at most every
+IMAGE_PROXY_REFRESH_INTERVAL seconds per URL. GIFs (which may be animated)
+and SVGs (which scale by themselves) are served as they are.
+
+The URLs are user input, so the proxy only connects to public addresses:
+every connection, including those of redirects, checks the addresses its
+host resolves to and refuses private, loopback, link-local and reserved
+ones unless the host is in IMAGE_PROXY_ALLOWED_HOSTS. The checked address
+is the one connected to, so DNS can't change the answer in between.
+"""
+
+import hashlib
+import http.client
+import ipaddress
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from config import Config
+from app.utils.thumbnails import jpeg_size
+
+# Served file names: content hash, then the box size for scaled copies
+IMAGE_NAME_PATTERN = re.compile(r'^[0-9a-f]{32}(-\d{1,4}x\d{1,4})?\.(png|jpg|gif|webp|svg)$')
+MIMETYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'svg': 'image/svg+xml'
+}
+# Formats served as fetched
+PASSTHROUGH_FORMATS = {'gif', 'svg'}
+MAX_DIMENSION = 4096
+# URLs that failed aren't fetched again for this long (per worker)
+FAILURE_RETRY_SECONDS = 30
+# Failed URLs remembered at most; the oldest are forgotten first
+MAX_FAILED_URLS = 1024
+
+
+class BlockedAddressError(OSError):
+    """An image URL resolved to an address the proxy may not connect to"""
+
+
+def _allowed_address(host: str, address: str) -> bool:
+    """Whether the proxy may connect to address, which host resolved to"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if getattr(ip, 'ipv4_mapped', None) is not None:
+        ip = ip.ipv4_mapped
+    if ip.is_global and not ip.is_multicast:
+        return True
+    for allowed in Config.IMAGE_PROXY_ALLOWED_HOSTS:
+        if allowed.lower() == host.lower():
+            return True
+        try:
+            if ip in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            # A host name rather than an address or network
+            continue
+    return False
+
+
+def _checked_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection that refuses hosts resolving to non-public addresses"""
+    host, port = address
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        if not _allowed_address(host, info[4][0]):
+            raise BlockedAddressError(f'{host} resolves to {info[4][0]}, which is not a public address')
+    error = None
+    for family, socktype, proto, _, sockaddr in infos:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f'{host} did not resolve')
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _checked_connection
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _checked_connection
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req, context=self._context)
+
+
+# Direct connections only: through a proxy the checked address would be the proxy's
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _CheckedHTTPHandler, _CheckedHTTPSHandler)
+
+
+def detect_format(data: bytes) -> Optional[str]:
+    """Image format from the leading bytes, or None if it isn't a supported image"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if b'<svg' in data[:1024].lower():
+        return 'svg'
+    return None
+
+
+def image_size(data: bytes, image_format: str) -> Optional[Tuple[int, int]]:
+    """(width, height) of a PNG or JPEG, or None when it isn't cheap to read"""
+    if image_format == 'png' and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if image_format == 'jpg':
+        return jpeg_size(data)
+    return None
+
+
+class ImageProxy:
+    """Disk cache of fetched overlay images and their scaled copies"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or Config.IMAGE_PROXY_DIR
+        self.max_bytes = max_bytes or Config.IMAGE_PROXY_MAX_BYTES
+        self.sources_dir = os.path.join(self.cache_dir, 'sources')
+        # Lock and number of threads holding or waiting for it, per URL or file name in use
+        self.locks: Dict[str, List] = {}
+        self.lock = threading.Lock()
+        # Failure time per URL, oldest first
+        self.failed_at: 'OrderedDict[str, float]' = OrderedDict()
+
+    @contextmanager
+    def _locked(self, key: str) -> Iterator[None]:
+        """Hold the lock of a URL or file name, forgotten again once nobody uses it"""
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+    def _failed_recently(self, url: str) -> bool:
+        with self.lock:
+            return time.time() - self.failed_at.get(url, 0) < FAILURE_RETRY_SECONDS
+
+    def _record_failure(self, url: str, failed: bool) -> None:
+        """Remember or forget a failed fetch, dropping expired and excess entries"""
+        now = time.time()
+        with self.lock:
+            self.failed_at.pop(url, None)
+            if failed:
+                self.failed_at[url] = now
+            while self.failed_at and (len(self.failed_at) > MAX_FAILED_URLS
+                                      or now - next(iter(self.failed_at.values())) >= FAILURE_RETRY_SECONDS):
+                self.failed_at.popitem(last=False)
+
+    def path(self, name: str) -> Optional[str]:
+        """Path of a cached file by its served name, marking it as used"""
+        if not IMAGE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.cache_dir, name)
+        try:
+            # Throttled, so popular images don't cost a write per request
+            if time.time() - os.stat(path).st_mtime > 60:
+                os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _write(self, name: str, data: bytes) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used files until the cache fits IMAGE_PROXY_MAX_BYTES"""
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and IMAGE_NAME_PATTERN.match(entry.name):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _source_path(self, url: str) -> str:
+        return os.path.join(self.sources_dir, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def _read_source(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._source_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_source(self, url: str, source: dict) -> None:
+        os.makedirs(self.sources_dir, exist_ok=True)
+        path = self._source_path(url)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(source, f)
+        os.replace(tmp_path, path)
+
+    def source(self, url: str, refresh: bool = False) -> Optional[dict]:
+        """
+        Cached original of a URL: {'hash', 'format', ...}, fetching it if needed
+
+        With refresh, the origin is asked whether the image changed (at most
+        every IMAGE_PROXY_REFRESH_INTERVAL seconds).
+        """
+        with self._locked(url):
+            source = self._read_source(url)
+            original = f'{source["hash"]}.{source["format"]}' if source else None
+            if source is not None and os.path.exists(os.path.join(self.cache_dir, original)):
+                if not refresh or time.time() - source['fetched_at'] < Config.IMAGE_PROXY_REFRESH_INTERVAL:
+                    return source
+            else:
+                # Never fetched, or the original was evicted: fetch unconditionally
+                source = None
+                if self._failed_recently(url):
+                    return None
+            fetched = self._fetch(url, source)
+            self._record_failure(url, fetched is None)
+            return fetched
+
+    def _fetch(self, url: str, previous: Optional[dict]) -> Optional[dict]:
+        if not url.startswith(('http://', 'https://')):
+            print(f"✗ Image proxy only fetches http(s) URLs: {url}")
+            return None
+        headers = {'User-Agent': 'StreamOverlay image proxy'}
+        if previous is not None:
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+        try:
+            with _opener.open(urllib.request.Request(url, headers=headers),
+                              timeout=Config.IMAGE_PROXY_TIMEOUT) as response:
+                data = response.read(Config.IMAGE_PROXY_MAX_SOURCE_BYTES + 1)
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and previous is not None:
+                previous['fetched_at'] = time.time()
+                self._write_source(url, previous)
+                return previous
+            print(f"✗ Fetching image {url} failed: HTTP {e.code}")
+            return previous
+        except (OSError, ValueError) as e:
+            print(f"✗ Fetching image {url} failed: {e}")
+            return previous
+
+        if len(data) > Config.IMAGE_PROXY_MAX_SOURCE_BYTES:
+            print(f"✗ Image {url} is larger than {Config.IMAGE_PROXY_MAX_SOURCE_BYTES} bytes")
+            return previous
+        image_format = detect_format(data)
+        if image_format is None:
+            print(f"✗ {url} is not a PNG, JPEG, GIF, WebP or SVG image")
+            return previous
+        size = image_size(data, image_format)
+        source = {
+            'url': url,
+            'hash': hashlib.sha256(data).hexdigest()[:32],
+            'format': image_format,
+            'width': size[0] if size else None,
+            'height': size[1] if size else None,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time()
+        }
+        self._write(f'{source["hash"]}.{image_format}', data)
+        self._write_source(url, source)
+        return source
+
+    @staticmethod
+    def _name(source: dict, width: int, height: int) -> str:
+        """Served name of an original scaled to fit width x height"""
+        original = f'{source["hash"]}.{source["format"]}'
+        if source['format'] in PASSTHROUGH_FORMATS:
+            return original
+        if source['width'] is not None and source['width'] <= width and source['height'] <= height:
+            # Already fits: no need for a re-encoded copy
+            return original
+        output_format = 'jpg' if source['format'] == 'jpg' else 'png'
+        return f'{source["hash"]}-{width}x{height}.{output_format}'
+
+    def render(self, url: str, width: int, height: int, refresh: bool = False) -> Optional[str]:
+        """Served name of the image scaled to fit width x height, or None if it can't be fetched"""
+        width, height = min(max(int(width), 1), MAX_DIMENSION), min(max(int(height), 1), MAX_DIMENSION)
+        if not refresh:
+            # A cached copy is enough, even if its original was evicted
+            source = self._read_source(url)
+            if source is not None and self.path(self._name(source, width, height)) is not None:
+                return self._name(source, width, height)
+
+        source = self.source(url, refresh)
+        if source is None:
+            return None
+        name = self._name(source, width, height)
+        if self.path(name) is not None:
+            return name
+        with self._locked(name):
+            if self.path(name) is not None:
+                return name
+            original = os.path.join(self.cache_dir, f'{source["hash"]}.{source["format"]}')
+            data = self._scale(original, width, height, name.rsplit('.', 1)[1])
+            if data is None:
+                return None
+            self._write(name, data)
+        return name
+
+    @staticmethod
+    def _scale(path: str, width: int, height: int, output_format: str) -> Optional[bytes]:
+        """Image scaled down to fit width x height, keeping its aspect ratio (and alpha for PNG)"""
+        codec = ['-c:v', 'mjpeg', '-q:v', '3'] if output_format == 'jpg' else ['-c:v', 'png']
+        try:
+            result = subprocess.run(
+                [Config.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-i', path, '-frames:v', '1',
+                 '-vf', f"scale=w='min({width},iw)':h='min({height},ih)':force_original_aspect_ratio=decrease:flags=lanczos",
+                 '-f', 'image2pipe'] + codec + ['pipe:1'],
+                capture_output=True, timeout=Config.IMAGE_PROXY_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"✗ Scaling image failed: {e}")
+            return None
+        if result.returncode != 0 or not result.stdout:
+            message = result.stderr.decode(errors='replace').strip().splitlines()
+            print(f"✗ Scaling image failed: {message[-1] if message else result.returncode}")
+            return None
+        return result.stdout
+
+    def refresh(self, overlays: Iterable[dict]) -> None:
+        """Re-check the images of updated overlays and prepare copies at their new size"""
+        for overlay in overlays:
+            if overlay.get('type') != 'image' or not overlay.get('content'):
+                continue
+            size = overlay.get('size') or {}
+            try:
+                self.render(overlay['content'], size.get('width', 100), size.get('height', 50), refresh=True)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"✗ Refreshing image {overlay['content']} failed: {e}")
+
+
+# Global image proxy
+image_proxy = ImageProxy()
@@ -0,0 +1,128 @@
+"""
+HTTP Ingest - Receives FFmpeg's HLS output over HTTP PUT into shared memory
+
+In ingest mode FFmpeg uploads playlists and segments to /ingest/... on this
+server instead of writing them to HLS_OUTPUT_DIR. Uploads are stored on a
+tmpfs (INGEST_DIR, /dev/shm by default) so every worker can serve them and
+nothing touches the disk; a segment cache over that directory serves them
+to viewers straight from those shared pages. Each stream directory is a ring:
+the oldest segments are evicted beyond INGEST_MAX_SEGMENTS or
+INGEST_MAX_STREAM_BYTES. Only streams started in ingest mode are looked up
+in that cache; the others go straight to the HLS_OUTPUT_DIR cache.
+"""
+
+import os
+import re
+import secrets
+import time
+from typing import Dict, Optional, Tuple
+from config import Config
+from app.utils.process_registry import process_registry
+from app.utils.segment_cache import CachedFile, SegmentCache, MUTABLE_EXTENSIONS
+
+FILENAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+\.(m3u8|ts|m4s|mp4)$')
+# How long a worker trusts what it read of a stream's ingest option (seconds)
+MODE_CHECK_SECONDS = 1.0
+
+
+def new_token() -> str:
+    """Secret path component authorizing FFmpeg's uploads for one run of a stream"""
+    return secrets.token_urlsafe(16)
+
+
+def ingest_url(stream_id: Optional[str], token: str) -> str:
+    """Base URL FFmpeg uploads one stream's files to"""
+    prefix = '' if stream_id is None else f'{stream_id}/'
+    return f'{Config.INGEST_BASE_URL}/ingest/{prefix}{token}'
+
+
+class IngestRing:
+    """Per-stream rings of uploaded HLS files on a tmpfs"""
+
+    def __init__(self, root: Optional[str] = None, max_segments: Optional[int] = None,
+                 max_stream_bytes: Optional[int] = None):
+        self.root = os.path.abspath(root or Config.INGEST_DIR)
+        self.max_segments = max_segments or Config.INGEST_MAX_SEGMENTS
+        self.max_stream_bytes = max_stream_bytes or Config.INGEST_MAX_STREAM_BYTES
+
+    def stream_dir(self, stream_id: Optional[str]) -> str:
+        # Same layout as HLS_OUTPUT_DIR: the default stream at the root, others in subdirectories
+        return self.root if stream_id is None else os.path.join(self.root, stream_id)
+
+    def put(self, stream_id: Optional[str], filename: str, data: bytes) -> None:
+        """Store one uploaded file; it becomes visible only once complete"""
+        directory = self.stream_dir(stream_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if not filename.endswith(MUTABLE_EXTENSIONS):
+            self._evict(directory)
+
+    def delete(self, stream_id: Optional[str], filename: str) -> bool:
+        try:
+            os.remove(os.path.join(self.stream_dir(stream_id), filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _evict(self, directory: str) -> None:
+        """Drop the oldest segments while the ring is over its limits"""
+        segments = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and FILENAME_PATTERN.match(entry.name) and not entry.name.endswith(MUTABLE_EXTENSIONS):
+                    stat = entry.stat()
+                    segments.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        segments.sort()
+        total = sum(size for _, size, _ in segments)
+        while segments and (len(segments) > self.max_segments or total > self.max_stream_bytes):
+            _, size, path = segments.pop(0)
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self, stream_id: Optional[str]) -> None:
+        """Remove everything uploaded for a stream (not other streams' subdirectories)"""
+        try:
+            with os.scandir(self.stream_dir(stream_id)) as entries:
+                paths = [entry.path for entry in entries if entry.is_file()]
+        except OSError:
+            return
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Global ring and the cache serving it to viewers
+ingest_ring = IngestRing()
+ingest_cache = SegmentCache(ingest_ring.root)
+# stream_id -> (monotonic time read, started with ingest), for streams with state
+_modes: Dict[Optional[str], Tuple[float, bool]] = {}
+
+
+def uses_ingest(stream_id: Optional[str]) -> bool:
+    """Whether a stream's options say it was started in ingest mode"""
+    now = time.monotonic()
+    mode = _modes.get(stream_id)
+    if mode is None or now - mode[0] >= MODE_CHECK_SECONDS:
+        state = process_registry.read('stream' if stream_id is None else f'stream-{stream_id}')
+        if state is None:
+            # Never started: nothing to remember, and unknown IDs don't grow the table
+            _modes.pop(stream_id, None)
+            return False
+        mode = (now, bool(state.get('options', {}).get('ingest')))
+        _modes[stream_id] = mode
+    return mode[1]
+
+
+def get_uploaded(relpath: str) -> Optional[CachedFile]:
+    """Uploaded file by the same relative path as in HLS_OUTPUT_DIR, if its stream is in ingest mode"""
+    stream_id = relpath.split('/', 1)[0] if '/' in relpath else None
+    return ingest_cache.get(relpath) if uses_ingest(stream_id) else None
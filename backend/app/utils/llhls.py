@@ -0,0 +1,256 @@
+"""
+Low-Latency HLS - Builds LL-HLS playlists on top of FFmpeg's HLS muxer
+
+FFmpeg cannot write LL-HLS partial segments itself. In low-latency mode it
+cuts short fMP4 segments (one per forced keyframe) into a source playlist,
+and this module presents them as parts: every LLHLS_PARTS_PER_SEGMENT parts
+form one full segment, served by concatenating the part files (fMP4
+fragments can be concatenated as-is). Parts are numbered from the clock at
+the part rate, so a restarted stream never reuses the name of a part or
+segment that players and CDNs may have cached as immutable.
+"""
+
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from config import Config
+
+SOURCE_PLAYLIST = 'll_source.m3u8'
+INIT_SEGMENT = 'init.mp4'
+PART_FILENAME = 'part%d.m4s'
+PART_PATTERN = re.compile(r'^part(\d+)\.m4s$')
+SEGMENT_PATTERN = re.compile(r'^llseg(\d+)\.m4s$')
+
+# How many trailing segments list their parts, as recommended by the LL-HLS spec
+PART_WINDOW_SEGMENTS = 3
+# Playlists kept per worker; the least recently used beyond this are parsed again when requested
+MAX_PLAYLISTS = 256
+
+
+def start_number(part_duration: Optional[float] = None, parts_per_segment: Optional[int] = None,
+                 now: Optional[float] = None) -> int:
+    """
+    First part number of a new run: parts since the epoch at the part rate
+
+    Rounded up to a whole segment, plus one segment of margin for a previous
+    run that got ahead of the clock, so the first segment is complete and no
+    number of an earlier run comes back.
+    """
+    part_duration = part_duration or Config.LLHLS_PART_DURATION
+    parts_per_segment = parts_per_segment or Config.LLHLS_PARTS_PER_SEGMENT
+    now = time.time() if now is None else now
+    return (math.ceil(now / part_duration / parts_per_segment) + 1) * parts_per_segment
+
+
+class Part:
+    """One FFmpeg segment, presented as an LL-HLS part"""
+
+    __slots__ = ('sequence', 'duration', 'uri', 'program_date_time')
+
+    def __init__(self, sequence: int, duration: float, uri: str, program_date_time: Optional[str]):
+        self.sequence = sequence
+        self.duration = duration
+        self.uri = uri
+        self.program_date_time = program_date_time
+
+
+class LowLatencyPlaylist:
+    """LL-HLS view over the source playlist in one stream directory"""
+
+    def __init__(self, directory: str, part_duration: Optional[float] = None,
+                 parts_per_segment: Optional[int] = None):
+        self.directory = directory
+        self.part_duration = part_duration or Config.LLHLS_PART_DURATION
+        self.parts_per_segment = parts_per_segment or Config.LLHLS_PARTS_PER_SEGMENT
+        self.source_path = os.path.join(directory, SOURCE_PLAYLIST)
+        self.parts: List[Part] = []
+        self._mtime_ns: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.source_path)
+
+    def refresh(self) -> None:
+        """Re-parse the source playlist if FFmpeg rewrote it"""
+        try:
+            mtime_ns = os.stat(self.source_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        with self.lock:
+            if mtime_ns == self._mtime_ns:
+                return
+            try:
+                with open(self.source_path) as f:
+                    self.parts = self._parse(f.read())
+            except OSError:
+                return
+            self._mtime_ns = mtime_ns
+
+    @staticmethod
+    def _parse(text: str) -> List[Part]:
+        parts = []
+        sequence = 0
+        duration = None
+        program_date_time = None
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                sequence = int(line.split(':', 1)[1])
+            elif line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+                program_date_time = line.split(':', 1)[1]
+            elif line.startswith('#EXTINF:'):
+                duration = float(line.split(':', 1)[1].split(',')[0])
+            elif line and not line.startswith('#') and duration is not None:
+                parts.append(Part(sequence, duration, os.path.basename(line), program_date_time))
+                sequence += 1
+                duration = None
+                program_date_time = None
+        return parts
+
+    def position(self, sequence: int) -> Tuple[int, int]:
+        """Map an FFmpeg sequence number to (media sequence number, part index)"""
+        return divmod(sequence, self.parts_per_segment)
+
+    def has(self, msn: int, part: Optional[int] = None) -> bool:
+        """Check whether a segment (or one of its parts) has been produced"""
+        if not self.parts:
+            return False
+        last = self.parts[-1].sequence
+        if part is None:
+            return last >= msn * self.parts_per_segment + self.parts_per_segment - 1
+        return last >= msn * self.parts_per_segment + part
+
+    def wait_for(self, msn: int, part: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Block until a segment or part exists (blocking playlist reload)"""
+        if timeout is None:
+            timeout = 3 * self.target_duration
+        deadline = time.time() + timeout
+        while True:
+            self.refresh()
+            if self.has(msn, part):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(min(0.05, self.part_duration / 4))
+
+    async def wait_for_async(self, msn: int, part: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """wait_for() for the async serving mode: waits without holding a thread"""
+        if timeout is None:
+            timeout = 3 * self.target_duration
+        deadline = time.time() + timeout
+        while True:
+            self.refresh()
+            if self.has(msn, part):
+                return True
+            if time.time() >= deadline:
+                return False
+            await asyncio.sleep(min(0.05, self.part_duration / 4))
+
+    @property
+    def target_duration(self) -> int:
+        return math.ceil(self.part_duration * self.parts_per_segment)
+
+    def _segments(self) -> List[Tuple[int, List[Part]]]:
+        """
+        Group parts into (msn, parts) in playlist order
+
+        A first group that starts mid-segment (FFmpeg numbers parts from the
+        epoch, and the source playlist drops old parts) never gets all its
+        parts, so it is left out.
+        """
+        segments: List[Tuple[int, List[Part]]] = []
+        for part in self.parts:
+            msn, index = self.position(part.sequence)
+            if segments and segments[-1][0] == msn:
+                segments[-1][1].append(part)
+            elif segments or index == 0:
+                segments.append((msn, [part]))
+        return segments
+
+    def segment_part_files(self, msn: int) -> List[str]:
+        """Part file names that make up one full segment"""
+        first = msn * self.parts_per_segment
+        return [PART_FILENAME % sequence for sequence in range(first, first + self.parts_per_segment)]
+
+    def render(self) -> bytes:
+        """Render the LL-HLS media playlist"""
+        segments = self._segments()
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:9',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            f'#EXT-X-PART-INF:PART-TARGET={self.part_duration:.3f}',
+            f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_duration:.3f}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0][0] if segments else 0}',
+            '#EXT-X-INDEPENDENT-SEGMENTS',
+            f'#EXT-X-MAP:URI="{INIT_SEGMENT}"'
+        ]
+        for index, (msn, parts) in enumerate(segments):
+            complete = len(parts) == self.parts_per_segment
+            if parts[0].program_date_time:
+                lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{parts[0].program_date_time}')
+            if index >= len(segments) - PART_WINDOW_SEGMENTS:
+                for part in parts:
+                    # Every part starts on a forced keyframe
+                    lines.append(f'#EXT-X-PART:DURATION={part.duration:.3f},URI="{part.uri}",INDEPENDENT=YES')
+            if complete:
+                lines.append(f'#EXTINF:{sum(part.duration for part in parts):.3f},')
+                lines.append(f'llseg{msn}.m4s')
+        if self.parts:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{PART_FILENAME % (self.parts[-1].sequence + 1)}"')
+        return ('\n'.join(lines) + '\n').encode()
+
+
+# Stream directory -> playlist, least recently used first
+_playlists: 'OrderedDict[str, LowLatencyPlaylist]' = OrderedDict()
+_playlists_lock = threading.Lock()
+
+
+def get_playlist(directory: str) -> Optional[LowLatencyPlaylist]:
+    """LL-HLS playlist for a stream directory, or None if it isn't in low-latency mode"""
+    with _playlists_lock:
+        playlist = _playlists.get(directory)
+        if playlist is not None:
+            _playlists.move_to_end(directory)
+    if playlist is None:
+        # Only streams in low-latency mode get an entry, not every directory requested
+        if not os.path.exists(os.path.join(directory, SOURCE_PLAYLIST)):
+            return None
+        with _playlists_lock:
+            playlist = _playlists.setdefault(directory, LowLatencyPlaylist(directory))
+            while len(_playlists) > MAX_PLAYLISTS:
+                _playlists.popitem(last=False)
+    if not playlist.exists():
+        with _playlists_lock:
+            if _playlists.get(directory) is playlist:
+                del _playlists[directory]
+        return None
+    playlist.refresh()
+    return playlist
+
+
+def wait_for_file(path: str, timeout: float) -> bool:
+    """Wait for a preload-hinted part to appear on disk"""
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+async def wait_for_file_async(path: str, timeout: float) -> bool:
+    """wait_for_file() for the async serving mode"""
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() >= deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
@@ -0,0 +1,277 @@
+"""
+Metrics - Prometheus instrumentation for HTTP, MongoDB and the transcoders
+
+Request and Mongo metrics are counters/histograms kept per worker. Under
+gunicorn, PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py) makes
+prometheus_client store them in shared files so /metrics on any worker
+reports the sum over all workers. FFmpeg and HLS metrics are read at scrape
+time from the shared stream state and /proc, which every worker sees the
+same way. Viewers are counted from segment fetches; each worker flushes the
+viewers it saw to a shared directory and scrapes count the union.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from config import Config
+from app.utils.profiler import profiler
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+SEGMENT_EXTENSIONS = ('.ts', '.m4s')
+
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce an HTTP response',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+HTTP_BYTES = Counter(
+    'http_response_bytes_total', 'Response body bytes sent', ['endpoint']
+)
+MONGO_LATENCY = Histogram(
+    'mongo_operation_duration_seconds', 'Duration of model calls to MongoDB',
+    ['model', 'operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+MONGO_ERRORS = Counter(
+    'mongo_operation_errors_total', 'Model calls to MongoDB that raised', ['model', 'operation']
+)
+# Depth of timed model calls on this thread (some call others, e.g. bump_version)
+_mongo_calls = threading.local()
+
+
+def timed_mongo(model: str, operation: str):
+    """
+    Decorator recording latency and errors of a model method
+
+    Every call is recorded under its own operation; only the outermost one
+    counts towards the request's 'mongo' phase, so nested calls are not
+    counted twice.
+    """
+    def decorator(func):
+        histogram = MONGO_LATENCY.labels(model, operation)
+        errors = MONGO_ERRORS.labels(model, operation)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_mongo_calls, 'depth', 0)
+            _mongo_calls.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                _mongo_calls.depth = depth
+                histogram.observe(elapsed)
+                if depth == 0 and profiler.phases_enabled:
+                    profiler.add_phase('mongo', elapsed)
+        return wrapper
+    return decorator
+
+
+class ViewerTracker:
+    """Distinct clients fetching segments per stream within VIEWER_WINDOW seconds"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.path.join(Config.STREAM_STATE_DIR, 'viewers')
+        self.seen: Dict[str, Dict[str, float]] = {}
+        self.flushed_at = 0.0
+        # seen is shared by the worker's request threads; flushes write one file at a time
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def record(self, stream: str, viewer: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.seen.setdefault(stream, {})[viewer] = now
+        if now - self.flushed_at >= Config.VIEWER_FLUSH_INTERVAL:
+            # Segment requests don't wait for a flush another thread is doing
+            self.flush(wait=False)
+
+    def _prune(self, now: float) -> None:
+        """Drop expired viewers (caller holds the lock)"""
+        for stream in list(self.seen):
+            viewers = {viewer: at for viewer, at in self.seen[stream].items() if now - at < Config.VIEWER_WINDOW}
+            if viewers:
+                self.seen[stream] = viewers
+            else:
+                del self.seen[stream]
+
+    def flush(self, wait: bool = True) -> None:
+        """Publish this worker's recent viewers for the other workers' scrapes"""
+        if not self.flush_lock.acquire(blocking=wait):
+            return
+        try:
+            now = time.time()
+            self.flushed_at = now
+            with self.lock:
+                self._prune(now)
+                snapshot = {stream: dict(viewers) for stream, viewers in self.seen.items()}
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f'{os.getpid()}.json')
+                with open(f'{path}.tmp', 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(f'{path}.tmp', path)
+            except OSError as e:
+                print(f"✗ Viewer flush failed: {e}")
+        finally:
+            self.flush_lock.release()
+
+    def counts(self) -> Dict[str, int]:
+        """Viewers per stream over all workers"""
+        self.flush()
+        now = time.time()
+        viewers: Dict[str, set] = {}
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > Config.VIEWER_WINDOW:
+                    # Worker gone (or idle): its viewers have expired anyway
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    seen = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for stream, clients in seen.items():
+                recent = {viewer for viewer, at in clients.items() if now - at < Config.VIEWER_WINDOW}
+                viewers.setdefault(stream, set()).update(recent)
+        return {stream: len(clients) for stream, clients in viewers.items()}
+
+
+viewer_tracker = ViewerTracker()
+
+
+def read_segment_activity(path: str, window: float = 60) -> dict:
+    """Age of the newest segment and segments written in the last `window` seconds"""
+    now = time.time()
+    newest = None
+    recent = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(SEGMENT_EXTENSIONS):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                newest = mtime if newest is None else max(newest, mtime)
+                if now - mtime < window:
+                    recent += 1
+    except OSError:
+        pass
+    return {
+        'newest_segment_age': now - newest if newest is not None else None,
+        'segments_per_second': recent / window
+    }
+
+
+class StreamCollector:
+    """Transcoder and HLS output metrics, computed from shared state at scrape time"""
+
+    def describe(self) -> Iterator:
+        # Without it, registering calls collect() at import, reading every stream's state
+        return iter(())
+
+    def collect(self) -> Iterator:
+        from app.utils.stream_manager import iter_managers
+        from app.utils.process_registry import process_registry
+
+        up = GaugeMetricFamily('ffmpeg_up', 'Whether the FFmpeg process is running', labels=['stream'])
+        cpu = CounterMetricFamily('ffmpeg_cpu_seconds', 'CPU time used by FFmpeg', labels=['stream'])
+        rss = GaugeMetricFamily('ffmpeg_rss_bytes', 'Resident memory of FFmpeg', labels=['stream'])
+        restarts = CounterMetricFamily('ffmpeg_restarts', 'Automatic restarts after crashes', labels=['stream'])
+        fps = GaugeMetricFamily('ffmpeg_fps', 'Frames per second reported by FFmpeg', labels=['stream'])
+        speed = GaugeMetricFamily('ffmpeg_speed', 'Encoding speed relative to real time', labels=['stream'])
+        dropped = CounterMetricFamily('ffmpeg_dropped_frames', 'Frames dropped by FFmpeg', labels=['stream'])
+        segment_age = GaugeMetricFamily('hls_newest_segment_age_seconds', 'Seconds since the newest segment was written', labels=['stream'])
+        segment_rate = GaugeMetricFamily('hls_segments_per_second', 'Segments written per second over the last minute', labels=['stream'])
+        viewers = GaugeMetricFamily('hls_viewers', f'Distinct clients fetching segments in the last {Config.VIEWER_WINDOW:g}s', labels=['stream'])
+
+        viewer_counts = viewer_tracker.counts()
+        for manager in iter_managers():
+            stream = manager.stream_id or 'default'
+            state = manager._load_state() or {}
+            alive = process_registry.is_alive(state)
+            up.add_metric([stream], 1 if alive else 0)
+            restarts.add_metric([stream], state.get('restarts', 0))
+            if alive:
+                stats = manager.get_resources()
+                if stats['cpu_seconds'] is not None:
+                    cpu.add_metric([stream], stats['cpu_seconds'])
+                if stats['rss_bytes'] is not None:
+                    rss.add_metric([stream], stats['rss_bytes'])
+                progress = state.get('progress') or {}
+                if progress.get('fps') is not None:
+                    fps.add_metric([stream], progress['fps'])
+                if progress.get('speed') is not None:
+                    speed.add_metric([stream], progress['speed'])
+                if progress.get('drop_frames') is not None:
+                    dropped.add_metric([stream], progress['drop_frames'])
+            activity = read_segment_activity(manager.media_dir)
+            if activity['newest_segment_age'] is not None:
+                segment_age.add_metric([stream], activity['newest_segment_age'])
+            segment_rate.add_metric([stream], activity['segments_per_second'])
+            viewers.add_metric([stream], viewer_counts.get(stream, 0))
+
+        yield from (up, cpu, rss, restarts, fps, speed, dropped, segment_age, segment_rate, viewers)
+
+
+_stream_collector = StreamCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(_stream_collector)
+
+
+def render() -> tuple:
+    """(body, content type) of the metrics exposition"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stream_collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def viewer_id(forwarded: str, remote_addr: Optional[str], user_agent: str) -> str:
+    """Identify a viewer by client address (behind proxies, the first forwarded one) and user agent"""
+    address = forwarded.split(',')[0].strip() or remote_addr or ''
+    return f"{address}|{user_agent}"
+
+
+def init_app(app) -> None:
+    """Record latency, response size and segment viewers of every request"""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or 'unmatched'
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            HTTP_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+        if response.content_length:
+            HTTP_BYTES.labels(endpoint).inc(response.content_length)
+        if response.status_code in (200, 206, 304) and request.path.endswith(SEGMENT_EXTENSIONS):
+            stream = (request.view_args or {}).get('stream_id', 'default')
+            viewer_tracker.record(stream, viewer_id(
+                request.headers.get('X-Forwarded-For', ''), request.remote_addr, request.headers.get('User-Agent', '')
+            ))
+        return response
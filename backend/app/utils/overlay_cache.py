@@ -0,0 +1,111 @@
+"""
+Overlay Cache - Serves the overlay list from memory until the collection changes
+
+Every overlay write bumps a version counter in the meta collection. Each
+worker keeps the serialized overlay list together with the version it was
+read at, and learns about newer versions from a change stream on the meta
+collection, or, where change streams are unavailable (standalone MongoDB),
+by re-reading the counter at most every OVERLAY_VERSION_CHECK_INTERVAL
+seconds. Reads in between cost neither a database round trip nor JSON
+serialization.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+from flask import current_app
+from pymongo.errors import PyMongoError
+from config import Config
+from app.models.overlay import Overlay, VERSION_ID
+
+
+class CachedOverlays:
+    """Serialized overlay list at one collection version"""
+
+    __slots__ = ('version', 'body', 'count', 'etag')
+
+    def __init__(self, version: int, body: bytes, count: int):
+        self.version = version
+        self.body = body
+        self.count = count
+        self.etag = f'overlays-{version}'
+
+
+class OverlayCache:
+    """Per-worker cache of the GET /api/overlays response body"""
+
+    def __init__(self, check_interval: Optional[float] = None):
+        self.check_interval = check_interval if check_interval is not None else Config.OVERLAY_VERSION_CHECK_INTERVAL
+        self.cached: Optional[CachedOverlays] = None
+        self.latest_version: Optional[int] = None
+        self.checked_at = 0.0
+        self.watching = False
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def ensure_started(self) -> None:
+        """Start the change stream listener (once per worker process, also after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.watching = False
+            self._thread = threading.Thread(target=self._watch, name='overlay-cache', daemon=True)
+            self._thread.start()
+
+    def _watch(self) -> None:
+        pipeline = [{'$match': {'documentKey._id': VERSION_ID}}]
+        try:
+            with Overlay.meta.watch(pipeline, full_document='updateLookup') as stream:
+                self.watching = True
+                # Changes before the stream opened were not seen
+                self.invalidate()
+                for change in stream:
+                    document = change.get('fullDocument') or {}
+                    self.latest_version = document.get('version', self.latest_version)
+        except PyMongoError as e:
+            # Standalone servers have no change streams; fall back to polling the counter
+            print(f"ℹ️  Overlay cache polling every {self.check_interval}s ({e.__class__.__name__})")
+        self.watching = False
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Forget the known version so the next read checks the database"""
+        self.latest_version = None
+
+    def current_version(self) -> int:
+        """Latest known collection version, re-read only when it may be stale"""
+        version = self.latest_version
+        if version is None or (not self.watching and time.monotonic() - self.checked_at >= self.check_interval):
+            version = Overlay.get_version()
+            self.latest_version = version
+            self.checked_at = time.monotonic()
+        return version
+
+    def get(self) -> CachedOverlays:
+        """Overlay list response body at the latest version (needs an app context)"""
+        self.ensure_started()
+        version = self.current_version()
+        cached = self.cached
+        if cached is not None and cached.version == version:
+            return cached
+
+        # Read after taking the version: a concurrent write bumps it again, so the
+        # body may be newer than its version but never older, and is refreshed next time
+        overlays = Overlay.get_all()
+        body = current_app.json.dumps({
+            'success': True,
+            'data': overlays,
+            'count': len(overlays)
+        }).encode()
+        cached = CachedOverlays(version, body, len(overlays))
+        self.cached = cached
+        return cached
+
+
+# Global cache for the overlay list
+overlay_cache = OverlayCache()
@@ -0,0 +1,138 @@
+"""
+Probe - Inspects stream sources with ffprobe to pick copy or transcode per track
+
+Re-encoding is the expensive part of a stream: a track the browser can
+already play (H.264 video, AAC audio) is copied into the HLS segments
+instead. Probing a camera takes a moment, so results are cached per URL for
+PROBE_CACHE_TTL seconds; restarts and repeated starts of the same camera
+reuse them. When a source can't be probed, video is copied and audio is
+transcoded, as before probing existed.
+"""
+
+import json
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+# Codecs every HLS player handles without transcoding
+PASSTHROUGH_VIDEO_CODECS = {'h264'}
+PASSTHROUGH_AUDIO_CODECS = {'aac'}
+# Fields kept from each ffprobe stream entry
+STREAM_FIELDS = ('index', 'codec_type', 'codec_name', 'profile', 'width', 'height',
+                 'pix_fmt', 'sample_rate', 'channels')
+
+
+def run_ffprobe(url: str) -> Optional[List[dict]]:
+    """Tracks of a source (ffprobe stream entries), or None if it can't be probed"""
+    cmd = [Config.FFPROBE_BIN, '-v', 'error']
+    cmd += ['-rtsp_transport', 'tcp'] if url.startswith('rtsp') else []
+    cmd += ['-show_entries', f'stream={",".join(STREAM_FIELDS)}', '-of', 'json', '-i', url]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=Config.PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"✗ Probing {url} failed: {e}")
+        return None
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        print(f"✗ Probing {url} failed: {lines[-1] if lines else result.returncode}")
+        return None
+    try:
+        streams = json.loads(result.stdout).get('streams', [])
+    except ValueError:
+        return None
+    return [{field: stream[field] for field in STREAM_FIELDS if field in stream} for stream in streams]
+
+
+class ProbeCache:
+    """Per-worker probe results by URL, each kept for PROBE_CACHE_TTL seconds"""
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else Config.PROBE_CACHE_TTL
+        self.entries: Dict[str, Tuple[float, List[dict]]] = {}
+        self.locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[List[dict]]:
+        """Cached tracks of a source, probing it when they are missing or expired"""
+        entry = self.entries.get(url)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        with self.lock:
+            url_lock = self.locks.setdefault(url, threading.Lock())
+        # Concurrent starts of one camera share a single probe
+        with url_lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            streams = run_ffprobe(url)
+            if streams is None:
+                # Not cached: the camera may just be coming up
+                return None
+            with self.lock:
+                now = time.time()
+                for expired in [key for key, (expires, _) in self.entries.items() if expires <= now]:
+                    del self.entries[expired]
+                self.entries[url] = (now + self.ttl, streams)
+            return streams
+
+    def invalidate(self, url: str) -> None:
+        self.entries.pop(url, None)
+
+
+def choose_codecs(streams: Optional[List[dict]], transcode_video: Optional[str] = None,
+                  transcode_audio: Optional[str] = None) -> dict:
+    """
+    Copy or transcode decision for the video and audio track
+
+    transcode_video and transcode_audio name the stream option that needs
+    the track re-encoded (burn_in, low_latency, ladder), if any. Each
+    decision records the source codec and the reason, for the start
+    response and stream status.
+    """
+    if streams is None:
+        return {
+            'probed': False,
+            'video': {'action': 'transcode' if transcode_video else 'copy', 'codec': None,
+                      'reason': f'required by {transcode_video}' if transcode_video else 'source not probed'},
+            'audio': {'action': 'transcode', 'codec': None,
+                      'reason': f'required by {transcode_audio}' if transcode_audio else 'source not probed'}
+        }
+
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    decisions = {'probed': True}
+
+    if video is None:
+        decisions['video'] = {'action': 'none', 'codec': None, 'reason': 'no video track'}
+    elif transcode_video:
+        decisions['video'] = {'action': 'transcode', 'codec': video.get('codec_name'), 'reason': f'required by {transcode_video}'}
+    elif video.get('codec_name') in PASSTHROUGH_VIDEO_CODECS:
+        decisions['video'] = {'action': 'copy', 'codec': video['codec_name'], 'reason': 'playable by browsers'}
+    else:
+        decisions['video'] = {'action': 'transcode', 'codec': video.get('codec_name'), 'reason': 'not playable by browsers'}
+
+    if audio is None:
+        decisions['audio'] = {'action': 'none', 'codec': None, 'reason': 'no audio track'}
+    elif transcode_audio:
+        decisions['audio'] = {'action': 'transcode', 'codec': audio.get('codec_name'), 'reason': f'required by {transcode_audio}'}
+    elif audio.get('codec_name') in PASSTHROUGH_AUDIO_CODECS:
+        decisions['audio'] = {'action': 'copy', 'codec': audio['codec_name'], 'reason': 'playable by browsers'}
+    else:
+        decisions['audio'] = {'action': 'transcode', 'codec': audio.get('codec_name'), 'reason': 'not playable by browsers'}
+    return decisions
+
+
+def audio_args(codecs: Optional[dict]) -> list:
+    """FFmpeg audio arguments for a decision (AAC when there is none)"""
+    action = (codecs or {}).get('audio', {}).get('action')
+    if action == 'copy':
+        return ['-c:a', 'copy']
+    if action == 'none':
+        return ['-an']
+    return ['-c:a', 'aac']
+
+
+# Global probe cache
+probe_cache = ProbeCache()
@@ -0,0 +1,136 @@
+"""
+Process Registry - Shares FFmpeg process state between gunicorn workers
+"""
+
+import json
+import os
+import signal
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server only
+    fcntl = None
+
+
+def read_pid_start_time(pid: int) -> Optional[int]:
+    """Kernel start time of a process, used to detect PID reuse (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def is_pid_alive(pid: int, start_time: Optional[int] = None) -> bool:
+    """Check that a PID exists, is not a zombie and is the process we started"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        if fields[0] == 'Z':
+            return False
+        if start_time is not None and int(fields[19]) != start_time:
+            return False
+    except (OSError, IndexError, ValueError):
+        pass
+    return True
+
+
+def terminate_pid(pid: int, timeout: float = 5) -> bool:
+    """Send SIGTERM, escalate to SIGKILL after timeout. Returns True if it had to force kill."""
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        return False
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not is_pid_alive(pid):
+            return False
+        time.sleep(0.05)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    return True
+
+
+class ProcessRegistry:
+    """
+    File-backed registry of stream processes.
+
+    Every worker reads and writes the same JSON state files, and starts/stops
+    are serialized with an flock per stream, so only one FFmpeg runs per
+    stream no matter which worker handled the request.
+    """
+
+    def __init__(self, state_dir: Optional[str] = None):
+        self.state_dir = state_dir or Config.STREAM_STATE_DIR
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.state_dir, f'{key}{suffix}')
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """Exclusive cross-process lock for one stream"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self._path(key, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self, key: str) -> Optional[dict]:
+        """Read the recorded state of a stream, or None if never started"""
+        try:
+            with open(self._path(key, '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key: str, state: dict) -> None:
+        """Atomically replace the recorded state of a stream"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._path(key, '.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, key: str) -> None:
+        """Forget a stream"""
+        try:
+            os.remove(self._path(key, '.json'))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> List[str]:
+        """Keys of all recorded streams"""
+        try:
+            return sorted(name[:-5] for name in os.listdir(self.state_dir) if name.endswith('.json'))
+        except OSError:
+            return []
+
+    @staticmethod
+    def is_alive(state: Optional[dict]) -> bool:
+        """Check whether the process recorded in a state is still running"""
+        if not state or not state.get('pid'):
+            return False
+        return is_pid_alive(state['pid'], state.get('pid_start_time'))
+
+
+# Global registry shared by every StreamManager in this process
+process_registry = ProcessRegistry()
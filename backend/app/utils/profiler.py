@@ -0,0 +1,244 @@
+"""
+Profiler - On-demand sampling profiler and request phase timers for one worker
+
+Enabled with PROFILER_TOKEN; the admin endpoints (profiler_routes) start and
+stop it in the worker that receives the request and return its data. While
+running, a thread samples the Python stack of every other thread in the
+worker every few milliseconds and counts identical stacks, which are dumped
+in collapsed format (one "frame;frame;frame count" line per stack, the
+input of flamegraph.pl and speedscope). Threads waiting for work (their
+innermost frame in threading, queue or selectors) are left out unless idle
+samples are requested.
+
+Phase timers add up the time each request spends in Overlay database calls,
+JSON serialization and send_file, reported per request in a Server-Timing
+header and per endpoint by the phases endpoint. Both only cost a flag
+check when the profiler is stopped, and nothing at all without a token.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from typing import Dict, Optional
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+# Modules whose frames at the top of a stack mean the thread is waiting for work
+IDLE_MODULES = ('threading.py', 'queue.py', 'selectors.py')
+# Distinct stacks kept; further new stacks are counted under one line
+MAX_STACKS = 50000
+TRUNCATED_STACK = '[stack limit reached]'
+
+
+class _NullPhase:
+    """Phase timer used while the profiler is stopped"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """Sampling profiler and phase statistics of this worker process"""
+
+    def __init__(self):
+        self.phases_enabled = False
+        self.running = False
+        self.interval = 0.005
+        self.include_idle = False
+        self.stacks: StackCounter = StackCounter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stops_at: Optional[float] = None
+        # (endpoint, phase) -> [requests, total seconds, max seconds]
+        self.phase_stats: Dict[tuple, list] = {}
+        self.labels: Dict[object, str] = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, interval: float, duration: float, phases: bool = True, include_idle: bool = False) -> None:
+        """Start sampling every interval seconds for at most duration seconds (clears earlier data)"""
+        self.stop()
+        with self.lock:
+            self.stacks = StackCounter()
+            self.phase_stats = {}
+            self.samples = 0
+            self.interval = interval
+            self.include_idle = include_idle
+            self.started_at = time.time()
+            self.stops_at = self.started_at + duration
+            self.running = True
+            self.phases_enabled = phases
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, args=(self._stop,), name='profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and phase timing; collected data stays available"""
+        self.phases_enabled = False
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            if thread is not threading.current_thread():
+                thread.join()
+        self._thread = None
+        if self.running:
+            self.running = False
+            self.stops_at = min(self.stops_at or time.time(), time.time())
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            self.labels[code] = label
+        return label
+
+    def _sample(self, stop: threading.Event) -> None:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        names_at = 0.0
+        while not stop.wait(self.interval):
+            now = time.time()
+            if now >= self.stops_at:
+                break
+            frames = sys._current_frames()
+            if now - names_at > 1 or not names.keys() >= frames.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                names_at = now
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                if not self.include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                key = ';'.join(reversed(stack))
+                with self.lock:
+                    if key in self.stacks or len(self.stacks) < MAX_STACKS:
+                        self.stacks[key] += 1
+                    else:
+                        self.stacks[TRUNCATED_STACK] += 1
+                    self.samples += 1
+        # Stopped by its duration: phase timing ends with it
+        if not stop.is_set():
+            self.phases_enabled = False
+            self.running = False
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format, most frequent first"""
+        with self.lock:
+            lines = [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def phase(self, name: str):
+        """Context manager adding its duration to the current request's phase"""
+        if not self.phases_enabled or not has_request_context():
+            return NULL_PHASE
+        return _Phase(self, name)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        if not self.phases_enabled or not has_request_context():
+            return
+        phases = g.setdefault('profiler_phases', {})
+        phases[name] = phases.get(name, 0.0) + seconds
+
+    def record_request(self, response) -> None:
+        """Server-Timing header and per-endpoint statistics of a finished request"""
+        phases = g.pop('profiler_phases', None) or {}
+        start = g.pop('profiler_start', None)
+        if start is not None:
+            phases['total'] = time.perf_counter() - start
+        if not phases:
+            return
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.3f}' for name, seconds in phases.items()
+        )
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            for name, seconds in phases.items():
+                stats = self.phase_stats.setdefault((endpoint, name), [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def get_phase_stats(self) -> dict:
+        """Per endpoint and phase: requests that spent time in it, mean and max milliseconds"""
+        with self.lock:
+            items = sorted(self.phase_stats.items())
+        endpoints: Dict[str, dict] = {}
+        for (endpoint, name), (count, total, longest) in items:
+            endpoints.setdefault(endpoint, {})[name] = {
+                'requests': count,
+                'mean_ms': round(total / count * 1000, 3),
+                'max_ms': round(longest * 1000, 3),
+                'total_ms': round(total * 1000, 1)
+            }
+        return endpoints
+
+    def get_status(self) -> dict:
+        return {
+            'pid': os.getpid(),
+            'running': self.running,
+            'phases_enabled': self.phases_enabled,
+            'interval_ms': round(self.interval * 1000, 3),
+            'include_idle': self.include_idle,
+            'samples': self.samples,
+            'stacks': len(self.stacks),
+            'started_at': self.started_at,
+            'stops_at': self.stops_at
+        }
+
+
+class ProfiledJSONProvider(DefaultJSONProvider):
+    """JSON provider whose serialization counts as the "json" phase"""
+
+    def dumps(self, obj, **kwargs):
+        with profiler.phase('json'):
+            return super().dumps(obj, **kwargs)
+
+
+def init_app(app) -> None:
+    """Time request phases while the profiler runs (only called when PROFILER_TOKEN is set)"""
+    app.json = ProfiledJSONProvider(app)
+
+    @app.before_request
+    def start_phases():
+        if profiler.phases_enabled:
+            g.profiler_start = time.perf_counter()
+
+    @app.after_request
+    def record_phases(response):
+        if profiler.phases_enabled:
+            profiler.record_request(response)
+        return response
+
+
+# Global profiler of this worker
+profiler = Profiler()
@@ -0,0 +1,319 @@
+"""
+Schedule Index - Which overlays are active at a given time
+
+Overlays may carry a start_at/end_at window. A window is either wall-clock
+(datetimes) or stream-relative (seconds since the stream was started); a
+missing bound leaves that side open, and overlays without a window are
+always active. Windows are half-open: an overlay shows from start_at up
+to, but not including, end_at.
+
+Each worker keeps a centered interval tree per clock and stream_id, built
+from the overlay collection. A query visits one node per tree level and only
+scans intervals that contain the time, so it costs O(log n + k) for k
+active overlays instead of a pass over every overlay.
+
+Writes reach the index through the overlay events on the event bus: a
+changed document replaces the stored one, and a changed window is kept in
+a short list scanned next to the trees (its old interval is ignored), so a
+stream of moves and resizes never rebuilds anything. The trees are rebuilt
+from the collection in the background, with the previous ones serving
+until then: when the version (overlay_cache) moved and the last build is
+SCHEDULE_REBUILD_INTERVAL seconds old, when more than MAX_PENDING_CHANGES
+windows changed, or when events were lost.
+"""
+
+import bisect
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Set, Tuple
+from config import Config
+from app.models.overlay import Overlay
+from app.utils.event_bus import event_bus
+from app.utils.overlay_cache import overlay_cache
+
+INF = float('inf')
+WALL_CLOCK = 'wall'
+STREAM_CLOCK = 'stream'
+# Changed windows kept outside the trees before they are rebuilt
+MAX_PENDING_CHANGES = 1000
+
+
+def parse_schedule_time(value):
+    """
+    start_at/end_at value from request data: a naive UTC datetime for ISO 8601
+    or HTTP-date strings, a float for stream-relative seconds, or None
+
+    Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError('not a time')
+    if isinstance(value, (int, float)):
+        if not 0 <= value < INF:
+            raise ValueError('stream-relative times are seconds from 0')
+        return float(value)
+    if not isinstance(value, str):
+        raise ValueError('not a time')
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        # The format datetimes are returned in
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            raise ValueError('not an ISO 8601 or HTTP date') from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def window_clock(start, end) -> Optional[str]:
+    """Clock a window is on (WALL_CLOCK for no window), or None if it is invalid"""
+    bounds = [bound for bound in (start, end) if bound is not None]
+    if all(isinstance(bound, datetime) for bound in bounds):
+        clock = WALL_CLOCK
+    elif all(isinstance(bound, (int, float)) for bound in bounds):
+        clock = STREAM_CLOCK
+    else:
+        return None
+    return None if Overlay.schedule_error(start, end) else clock
+
+
+def timestamp(value: datetime) -> float:
+    """Unix time of a naive UTC datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _bounds(start, end) -> Tuple[float, float]:
+    if isinstance(start, datetime):
+        start = timestamp(start)
+    if isinstance(end, datetime):
+        end = timestamp(end)
+    return (-INF if start is None else start), (INF if end is None else end)
+
+
+def _entry(overlay: dict) -> Optional[tuple]:
+    """((clock, stream_id), start, end) of an overlay's window, or None if it is never active"""
+    start, end = overlay.get('start_at'), overlay.get('end_at')
+    clock = window_clock(start, end)
+    if clock is None:
+        return None
+    return ((clock, overlay.get('stream_id')),) + _bounds(start, end)
+
+
+class _Node:
+    __slots__ = ('center', 'by_start', 'starts', 'by_end', 'ends', 'left', 'right')
+
+
+class IntervalTree:
+    """
+    Static centered interval tree over half-open [start, end) intervals
+
+    Each node holds the intervals containing its center, sorted by start and
+    by end; intervals entirely before or after it go to the left or right
+    subtree. The center is the median start, so every node keeps at least
+    one interval and each subtree gets at most half of the rest.
+    """
+
+    def __init__(self, intervals: List[Tuple[float, float, dict]]):
+        self.size = len(intervals)
+        # Sorted once: partitioning keeps the order, so every node's share is sorted by start too
+        self.root = self._build(sorted(intervals, key=lambda interval: interval[0]))
+
+    @classmethod
+    def _build(cls, intervals):
+        if not intervals:
+            return None
+        node = _Node()
+        node.center = intervals[len(intervals) // 2][0]
+        left, here, right = [], [], []
+        for interval in intervals:
+            if interval[1] <= node.center:
+                left.append(interval)
+            elif interval[0] > node.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        node.by_start = here
+        node.starts = [interval[0] for interval in here]
+        # Ascending, so the intervals still open at a time are a suffix
+        node.by_end = sorted(here, key=lambda interval: interval[1])
+        node.ends = [interval[1] for interval in node.by_end]
+        node.left = cls._build(left)
+        node.right = cls._build(right)
+        return node
+
+    def stab(self, at: float) -> list:
+        """Values of the intervals containing at"""
+        found = []
+        node = self.root
+        while node is not None:
+            if at < node.center:
+                # Every interval here ends after the center: those started by now contain at
+                found.extend(interval[2] for interval in node.by_start[:bisect.bisect_right(node.starts, at)])
+                node = node.left
+            elif at > node.center:
+                # Every interval here started by the center: those not ended yet contain at
+                found.extend(interval[2] for interval in node.by_end[bisect.bisect_right(node.ends, at):])
+                node = node.right
+            else:
+                found.extend(interval[2] for interval in node.by_start)
+                break
+        return found
+
+
+class ScheduleIndex:
+    """Per-worker interval trees of overlay windows, in step with the overlay collection"""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        # (clock, stream_id) -> tree of overlay ids
+        self.trees: Dict[tuple, IntervalTree] = {}
+        # Current document and window entry per overlay id
+        self.documents: Dict[str, dict] = {}
+        self.entries: Dict[str, tuple] = {}
+        # Overlays whose window changed since the build: their tree interval no longer holds,
+        # and their current window is in changed, scanned on every query
+        self.stale: Set[str] = set()
+        self.changed: Dict[tuple, Dict[str, Tuple[float, float]]] = {}
+        self.built_at = 0.0
+        self.subscriber = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    @staticmethod
+    def build(overlays: List[dict]) -> Tuple[Dict[tuple, IntervalTree], Dict[str, tuple]]:
+        """Trees and window entries of a list of overlay documents (invalid windows are never active)"""
+        intervals: Dict[tuple, list] = {}
+        entries = {}
+        for overlay in overlays:
+            entry = _entry(overlay)
+            if entry is None:
+                continue
+            entries[overlay['_id']] = entry
+            intervals.setdefault(entry[0], []).append(entry[1:] + (overlay['_id'],))
+        return {key: IntervalTree(items) for key, items in intervals.items()}, entries
+
+    def load(self, overlays: List[dict], version: Optional[int] = None, subscriber=None) -> None:
+        """Replace the index with one built from overlays"""
+        trees, entries = self.build(overlays)
+        documents = {overlay['_id']: overlay for overlay in overlays}
+        with self.lock:
+            if self.subscriber is not None and self.subscriber is not subscriber:
+                event_bus.unsubscribe(self.subscriber)
+            self.trees, self.entries, self.documents = trees, entries, documents
+            self.stale, self.changed = set(), {}
+            self.version, self.subscriber = version, subscriber
+            self.built_at = time.monotonic()
+
+    def rebuild(self, wait: bool = False) -> None:
+        """Build the index from the collection, unless another thread is building it"""
+        if not self.build_lock.acquire(blocking=wait):
+            return
+        try:
+            if wait and self.built_at:
+                # Built by the thread waited for
+                return
+            version = overlay_cache.current_version()
+            # Subscribed before reading, so no write falls between the two; events
+            # the read already reflects are applied again, which changes nothing
+            subscriber = event_bus.subscribe()
+            try:
+                overlays = Overlay.get_all()
+            except Exception:
+                event_bus.unsubscribe(subscriber)
+                raise
+            self.load(overlays, version, subscriber)
+        finally:
+            self.build_lock.release()
+
+    def _rebuild_in_background(self) -> None:
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"✗ Schedule index rebuild failed: {e}")
+        threading.Thread(target=run, name='schedule-index', daemon=True).start()
+
+    def sync(self) -> None:
+        """Apply overlay changes since the last call, rebuilding the trees when they are due"""
+        overlay_cache.ensure_started()
+        if not self.built_at:
+            # Nothing to serve yet: the first build is waited for
+            self.rebuild(wait=True)
+            return
+        lost = self._apply_events()
+        version = overlay_cache.current_version()
+        due = version != self.version and time.monotonic() - self.built_at >= Config.SCHEDULE_REBUILD_INTERVAL
+        if lost or due or len(self.stale) > MAX_PENDING_CHANGES:
+            self._rebuild_in_background()
+
+    def _apply_events(self) -> bool:
+        """Apply the overlay events delivered since the last call; True if some were lost"""
+        subscriber = self.subscriber
+        if subscriber is None:
+            return False
+        with self.lock:
+            while True:
+                try:
+                    event = subscriber.events.get_nowait()
+                except queue.Empty:
+                    return False
+                if event is None:
+                    # Overflowed: the subscriber is closed and the gap can only be filled by a rebuild
+                    return True
+                data = event.get('data') or {}
+                # An update without a document is followed by its delete (same batch)
+                if event['type'] in ('overlay.created', 'overlay.updated') and 'type' in data:
+                    self._apply(str(data['_id']), data)
+                elif event['type'] == 'overlay.deleted':
+                    self._apply(str(data['_id']), None)
+
+    def _apply(self, overlay_id: str, overlay: Optional[dict]) -> None:
+        """Store one changed (None: deleted) overlay (caller holds the lock)"""
+        entry = _entry(overlay) if overlay is not None else None
+        if overlay is None:
+            self.documents.pop(overlay_id, None)
+        else:
+            self.documents[overlay_id] = overlay
+        previous = self.entries.get(overlay_id)
+        if entry == previous:
+            return
+        self.stale.add(overlay_id)
+        if previous is not None:
+            self.changed.get(previous[0], {}).pop(overlay_id, None)
+        if entry is None:
+            self.entries.pop(overlay_id, None)
+        else:
+            self.entries[overlay_id] = entry
+            self.changed.setdefault(entry[0], {})[overlay_id] = entry[1:]
+
+    def active(self, at: float, stream_id: Optional[str] = None, offset: Optional[float] = None) -> List[dict]:
+        """
+        Overlays shown on a stream (None is the default stream) at Unix time at
+
+        offset is the stream position in seconds, for stream-relative windows;
+        without it they are never active.
+        """
+        scopes = [None] if stream_id is None else [stream_id, None]
+        found = []
+        with self.lock:
+            for scope in scopes:
+                for clock, point in ((WALL_CLOCK, at), (STREAM_CLOCK, offset)):
+                    if point is None:
+                        continue
+                    tree = self.trees.get((clock, scope))
+                    if tree is not None:
+                        found.extend(overlay_id for overlay_id in tree.stab(point) if overlay_id not in self.stale)
+                    for overlay_id, (start, end) in self.changed.get((clock, scope), {}).items():
+                        if start <= point < end:
+                            found.append(overlay_id)
+            return [self.documents[overlay_id] for overlay_id in found if overlay_id in self.documents]
+
+
+# Global schedule index of this worker
+schedule_index = ScheduleIndex()
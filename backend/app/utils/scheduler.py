@@ -0,0 +1,342 @@
+"""
+Scheduler - Places stream jobs on agents within their CPU budget
+
+With STREAM_SCHEDULER enabled the web tier no longer starts FFmpeg in
+whichever worker took the request. Start, stop and restart requests become
+jobs in the shared state directory (one JSON file per stream, next to the
+stream state), and agent processes (agent.py) run them. Each agent
+declares how many CPU cores it may use and only claims queued jobs whose
+estimated cost still fits, oldest first; jobs wait in the queue until an
+agent has room. Agents send a heartbeat every SCHEDULER_POLL_INTERVAL
+seconds. An agent silent for SCHEDULER_AGENT_TIMEOUT seconds is declared
+dead by the others and its jobs are queued again for the agents that are
+left; an agent that shuts down cleanly hands its jobs back right away.
+The agent taking over a job stops the dead agent's FFmpeg and starts its
+own, since nothing would supervise the old process or drain its output.
+
+Jobs and heartbeats live in the process registry, so agents coordinate
+across processes on one host. The registry locks with flock and checks
+processes by PID, neither of which holds across hosts.
+"""
+
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from typing import List, Optional
+from config import Config
+from app.utils import abr
+from app.utils.event_bus import event_bus
+from app.utils.process_registry import process_registry
+from app.utils.stream_manager import StreamRegistry, hls_url_for, stream_manager, stream_registry
+
+SCHEDULER_LOCK = 'scheduler'
+
+
+def job_key(stream_id: Optional[str]) -> str:
+    return 'job' if stream_id is None else f'job-{stream_id}'
+
+
+def estimate_cost(options: dict, codecs: Optional[dict] = None) -> float:
+    """
+    CPU cores a stream is expected to use
+
+    Copying costs SCHEDULER_COPY_COST. An encode costs
+    SCHEDULER_TRANSCODE_COST per 1080p-equivalent of pixels, so a ladder
+    costs the sum of its renditions. codecs (known once the agent probed
+    the source) replace the guess that a plain stream is copied.
+    """
+    if options.get('ladder'):
+        return round(Config.SCHEDULER_COPY_COST + sum(
+            Config.SCHEDULER_TRANSCODE_COST * (abr.RENDITIONS[name]['height'] / 1080) ** 2
+            for name in options['ladder']
+        ), 2)
+    if options.get('low_latency') or options.get('burn_in'):
+        return Config.SCHEDULER_TRANSCODE_COST
+    if codecs and codecs.get('video', {}).get('action') == 'transcode':
+        return Config.SCHEDULER_TRANSCODE_COST
+    return Config.SCHEDULER_COPY_COST
+
+
+class Scheduler:
+    """Job queue operations of the web tier, and the shared view agents work from"""
+
+    def __init__(self, registry=process_registry):
+        self.registry = registry
+
+    def jobs(self) -> List[dict]:
+        keys = [key for key in self.registry.keys() if key == 'job' or key.startswith('job-')]
+        jobs = [self.registry.read(key) for key in keys]
+        return sorted((job for job in jobs if job), key=lambda job: job['enqueued_at'])
+
+    def agents(self) -> List[dict]:
+        agents = [self.registry.read(key) for key in self.registry.keys() if key.startswith('agent-')]
+        return [agent for agent in agents if agent]
+
+    def live_agents(self) -> List[dict]:
+        cutoff = time.time() - Config.SCHEDULER_AGENT_TIMEOUT
+        return [agent for agent in self.agents() if agent['heartbeat_at'] >= cutoff]
+
+    def get_job(self, stream_id: Optional[str]) -> Optional[dict]:
+        return self.registry.read(job_key(stream_id))
+
+    def submit(self, stream_id: Optional[str], rtsp_url: str, options: dict) -> dict:
+        """
+        Queue a stream start, or change the running job of the stream
+
+        Jobs are refused when the queue already holds SCHEDULER_MAX_QUEUED
+        jobs, or when no live agent could ever fit them.
+        """
+        if stream_id is not None and not StreamRegistry.is_valid_id(stream_id):
+            return {'status': 'error', 'message': 'Invalid stream ID (use 1-64 letters, digits, "-" or "_")'}
+        cost = estimate_cost(options)
+        key = job_key(stream_id)
+        with self.registry.lock(SCHEDULER_LOCK):
+            agents = self.live_agents()
+            largest = max((agent['cpu_budget'] for agent in agents), default=None)
+            if largest is not None and cost > largest:
+                return {
+                    'status': 'error',
+                    'message': f'Stream needs {cost:g} CPU cores, the largest agent has {largest:g}'
+                }
+            job = self.registry.read(key)
+            if job is None:
+                queued = sum(1 for other in self.jobs() if other['status'] == 'queued')
+                if queued >= Config.SCHEDULER_MAX_QUEUED:
+                    return {'status': 'error', 'message': f'Job queue is full ({queued} streams waiting)'}
+                job = {
+                    'stream_id': stream_id,
+                    'status': 'queued',
+                    'agent': None,
+                    'generation': 0,
+                    'started_generation': None,
+                    'enqueued_at': time.time(),
+                    'assigned_at': None,
+                    'placements': 0,
+                    'error': None
+                }
+                message = 'Stream queued' if agents else 'Stream queued, waiting for an agent'
+            elif job['rtsp_url'] == rtsp_url and job['options'] == options and not job.get('stop_requested'):
+                return {'status': 'success', 'message': 'Stream already scheduled', 'stream_id': stream_id,
+                        'rtsp_url': rtsp_url, 'hls_url': hls_url_for(stream_id, options), 'job': job}
+            else:
+                # The agent running it applies the change by restarting the stream
+                message = 'Stream change scheduled'
+            job.update({
+                'rtsp_url': rtsp_url,
+                'options': options,
+                'cost': cost,
+                'generation': job['generation'] + 1,
+                'stop_requested': False
+            })
+            self.registry.write(key, job)
+        event_bus.publish('stream.queued', {'stream_id': stream_id, 'rtsp_url': rtsp_url, 'options': options})
+        return {
+            'status': 'success',
+            'message': message,
+            'stream_id': stream_id,
+            'rtsp_url': rtsp_url,
+            'hls_url': hls_url_for(stream_id, options),
+            'options': options,
+            'job': job
+        }
+
+    def cancel(self, stream_id: Optional[str]) -> dict:
+        """Stop a stream: queued jobs are dropped, running ones stopped by their agent"""
+        key = job_key(stream_id)
+        with self.registry.lock(SCHEDULER_LOCK):
+            job = self.registry.read(key)
+            if job is None:
+                return {'status': 'info', 'message': 'No stream is currently running'}
+            if job['agent'] is None:
+                self.registry.clear(key)
+                return {'status': 'success', 'message': 'Queued stream removed'}
+            job['stop_requested'] = True
+            self.registry.write(key, job)
+        return {'status': 'success', 'message': f'Stop requested from agent {job["agent"]}'}
+
+    def restart(self, stream_id: Optional[str]) -> dict:
+        """Have the agent running a stream restart it"""
+        key = job_key(stream_id)
+        with self.registry.lock(SCHEDULER_LOCK):
+            job = self.registry.read(key)
+            if job is None or job.get('stop_requested'):
+                return {'status': 'error', 'message': 'No stream to restart'}
+            job['generation'] += 1
+            self.registry.write(key, job)
+        return {'status': 'success', 'message': 'Restart scheduled', 'job': job}
+
+    def overview(self) -> dict:
+        """Agents with their load, and every job"""
+        jobs = self.jobs()
+        live = {agent['id'] for agent in self.live_agents()}
+        agents = []
+        for agent in self.agents():
+            used = sum(job['cost'] for job in jobs if job['agent'] == agent['id'])
+            agents.append(dict(agent, alive=agent['id'] in live, cpu_used=round(used, 2),
+                               jobs=[job['stream_id'] for job in jobs if job['agent'] == agent['id']]))
+        return {
+            'agents': agents,
+            'jobs': jobs,
+            'queued': sum(1 for job in jobs if job['status'] == 'queued'),
+            'cpu_budget': round(sum(agent['cpu_budget'] for agent in agents if agent['alive']), 2),
+            'cpu_used': round(sum(agent['cpu_used'] for agent in agents if agent['alive']), 2)
+        }
+
+
+class StreamAgent:
+    """Runs the jobs it claims with this process's stream managers"""
+
+    def __init__(self, cpu_budget: float, agent_id: Optional[str] = None,
+                 scheduler: Optional[Scheduler] = None):
+        self.cpu_budget = cpu_budget
+        self.id = agent_id or f'{socket.gethostname()}-{uuid.uuid4().hex[:6]}'
+        self.scheduler = scheduler or Scheduler()
+        self.registry = self.scheduler.registry
+        self.key = f'agent-{self.id}'
+        self.started_at = time.time()
+        self.stopping = threading.Event()
+
+    @staticmethod
+    def manager_for(stream_id: Optional[str]):
+        """This process's manager of a stream, or None if it never had state"""
+        return stream_manager if stream_id is None else stream_registry.get(stream_id)
+
+    def _stop(self, stream_id: Optional[str]) -> None:
+        manager = self.manager_for(stream_id)
+        if manager is not None:
+            manager.stop_stream()
+
+    def heartbeat(self) -> None:
+        self.registry.write(self.key, {
+            'id': self.id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'cpu_budget': self.cpu_budget,
+            'started_at': self.started_at,
+            'heartbeat_at': time.time()
+        })
+
+    def run(self) -> None:
+        """Heartbeat and schedule until SIGTERM/SIGINT, then hand the jobs back"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self.stopping.set())
+        print(f"✓ Agent {self.id} running with a budget of {self.cpu_budget:g} CPU cores")
+        self.heartbeat()
+        # Heartbeats don't wait for slow starts (probing a camera can take PROBE_TIMEOUT seconds)
+        heartbeats = threading.Thread(target=self._heartbeat_loop, name='agent-heartbeat', daemon=True)
+        heartbeats.start()
+        while not self.stopping.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"✗ Scheduling failed: {e}")
+            self.stopping.wait(Config.SCHEDULER_POLL_INTERVAL)
+        heartbeats.join()
+        self.shutdown()
+
+    def _heartbeat_loop(self) -> None:
+        while not self.stopping.wait(Config.SCHEDULER_POLL_INTERVAL):
+            try:
+                self.heartbeat()
+            except OSError as e:
+                print(f"✗ Agent heartbeat failed: {e}")
+
+    def tick(self) -> None:
+        """One scheduling round: reclaim dead agents' jobs, stop, claim and (re)start"""
+        to_stop, to_start = [], []
+        with self.registry.lock(SCHEDULER_LOCK):
+            jobs = self.scheduler.jobs()
+            self._requeue_orphans(jobs)
+            mine = [job for job in jobs if job['agent'] == self.id]
+            used = 0.0
+            for job in mine:
+                if job.get('stop_requested'):
+                    to_stop.append(job)
+                elif job['generation'] != job['started_generation']:
+                    used += job['cost']
+                    to_start.append(job)
+                elif job['status'] != 'failed':
+                    # A failed start holds no CPU until it is restarted or resubmitted
+                    used += job['cost']
+            for job in jobs:
+                if job['status'] != 'queued' or used + job['cost'] > self.cpu_budget:
+                    continue
+                job.update({'status': 'starting', 'agent': self.id, 'assigned_at': time.time(),
+                            'placements': job['placements'] + 1})
+                self.registry.write(job_key(job['stream_id']), job)
+                used += job['cost']
+                to_start.append(job)
+
+        for job in to_stop:
+            self._stop(job['stream_id'])
+            with self.registry.lock(SCHEDULER_LOCK):
+                current = self.registry.read(job_key(job['stream_id']))
+                if current and current['agent'] == self.id and current.get('stop_requested'):
+                    self.registry.clear(job_key(job['stream_id']))
+        for job in to_start:
+            self._start(job)
+
+    def _requeue_orphans(self, jobs: List[dict]) -> None:
+        """Queue the jobs of agents that stopped sending heartbeats (caller holds the lock)"""
+        live = {agent['id'] for agent in self.scheduler.live_agents()}
+        live.add(self.id)
+        for agent in self.scheduler.agents():
+            if agent['id'] not in live:
+                print(f"⚠️  Agent {agent['id']} missed its heartbeats, requeueing its jobs")
+                self.registry.clear(f'agent-{agent["id"]}')
+        for job in jobs:
+            if job['agent'] is None or job['agent'] in live:
+                continue
+            if job.get('stop_requested'):
+                self.registry.clear(job_key(job['stream_id']))
+                job['status'] = 'stopped'
+                continue
+            job.update({'status': 'queued', 'agent': None, 'started_generation': None})
+            self.registry.write(job_key(job['stream_id']), job)
+
+    def _start(self, job: dict) -> None:
+        """Start (or restart with new settings) one claimed stream"""
+        # A restart, changed settings, or a job taken over from a dead agent:
+        # its FFmpeg would run unsupervised with nobody reading its output
+        self._stop(job['stream_id'])
+        if job['stream_id'] is None:
+            result = stream_manager.start_stream(job['rtsp_url'], job['options'])
+        else:
+            result = stream_registry.start_stream(job['stream_id'], job['rtsp_url'], job['options'])
+        with self.registry.lock(SCHEDULER_LOCK):
+            current = self.registry.read(job_key(job['stream_id']))
+            if not current or current['agent'] != self.id:
+                return
+            current['started_generation'] = job['generation']
+            if result['status'] == 'success':
+                current.update({'status': 'running', 'error': None,
+                                'cost': estimate_cost(job['options'], result.get('codecs'))})
+            else:
+                current.update({'status': 'failed', 'error': result['message']})
+            self.registry.write(job_key(job['stream_id']), current)
+        if result['status'] == 'success':
+            print(f"✓ Agent {self.id} started {job['stream_id'] or 'default stream'} ({current['cost']:g} cores)")
+        else:
+            print(f"✗ Agent {self.id} could not start {job['stream_id'] or 'default stream'}: {result['message']}")
+
+    def shutdown(self) -> None:
+        """Stop this agent's streams and queue their jobs for the other agents"""
+        with self.registry.lock(SCHEDULER_LOCK):
+            mine = [job for job in self.scheduler.jobs() if job['agent'] == self.id]
+            for job in mine:
+                if job.get('stop_requested'):
+                    self.registry.clear(job_key(job['stream_id']))
+                else:
+                    job.update({'status': 'queued', 'agent': None, 'started_generation': None})
+                    self.registry.write(job_key(job['stream_id']), job)
+            self.registry.clear(self.key)
+        for job in mine:
+            self._stop(job['stream_id'])
+        print(f"✓ Agent {self.id} stopped, {len(mine)} jobs handed back")
+
+
+# Global scheduler used by the web tier
+scheduler = Scheduler()
@@ -0,0 +1,181 @@
+"""
+Segment Cache - Serves HLS playlists and segments from memory
+"""
+
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+from config import Config
+
+HLS_EXTENSIONS = ('.m3u8', '.ts', '.m4s', '.mp4')
+# Rewritten in place by FFmpeg (playlists, fMP4 init segments); everything else is write-once
+MUTABLE_EXTENSIONS = ('.m3u8', '.mp4')
+CHUNK_SIZE = 64 * 1024
+
+
+class CachedFile:
+    """One playlist or segment held in memory"""
+
+    __slots__ = ('data', 'size', 'mtime_ns', 'etag', 'last_modified')
+
+    def __init__(self, data, size: int, mtime_ns: int):
+        # Segments are mmap'ed so every worker shares the same page cache pages;
+        # playlists are small and rewritten constantly, so they are plain bytes
+        self.data = data
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.etag = f'{size:x}-{mtime_ns:x}'
+        self.last_modified = datetime.fromtimestamp(mtime_ns / 1e9, tz=timezone.utc)
+
+    @property
+    def is_mutable(self) -> bool:
+        return isinstance(self.data, bytes)
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Yield the content in chunks without copying the whole segment per request"""
+        if self.is_mutable:
+            yield self.data
+            return
+        for offset in range(0, self.size, CHUNK_SIZE):
+            yield self.data[offset:offset + CHUNK_SIZE]
+
+
+class SegmentCache:
+    """
+    Watches an HLS output directory and keeps its files in memory.
+
+    A background thread polls the directory (and one level of per-stream
+    subdirectories). New segments are loaded once, changed playlists are
+    re-read, and files that FFmpeg deleted are dropped from the cache.
+    """
+
+    def __init__(self, root: str, poll_interval: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.root = os.path.abspath(root)
+        self.poll_interval = poll_interval if poll_interval is not None else Config.SEGMENT_CACHE_POLL_INTERVAL
+        self.max_bytes = max_bytes if max_bytes is not None else Config.SEGMENT_CACHE_MAX_BYTES
+        self.entries: 'OrderedDict[str, CachedFile]' = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def ensure_started(self) -> None:
+        """Start the watcher thread (once per worker process, also after fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self.lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._watch, name='segment-cache', daemon=True)
+            self._thread.start()
+
+    def _watch(self) -> None:
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"✗ Segment cache scan failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def _iter_files(self) -> Iterator[tuple]:
+        """Yield (relative path, DirEntry) for HLS files in root and stream subdirectories"""
+        try:
+            with os.scandir(self.root) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry)
+                    elif entry.name.endswith(HLS_EXTENSIONS):
+                        yield entry.name, entry
+        except OSError:
+            return
+        for subdir in subdirs:
+            try:
+                with os.scandir(subdir.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(HLS_EXTENSIONS) and entry.is_file():
+                            yield f'{subdir.name}/{entry.name}', entry
+            except OSError:
+                continue
+
+    def scan(self) -> None:
+        """Sync the cache with the directory once"""
+        seen = set()
+        for relpath, entry in self._iter_files():
+            seen.add(relpath)
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            cached = self.entries.get(relpath)
+            if cached is not None and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+                continue
+            self._load(relpath, entry.path)
+
+        with self.lock:
+            for relpath in [key for key in self.entries if key not in seen]:
+                self._evict(relpath)
+
+    def _load(self, relpath: str, path: str) -> Optional[CachedFile]:
+        """Read one file into the cache"""
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size == 0:
+                    return None
+                if path.endswith(MUTABLE_EXTENSIONS):
+                    data = f.read()
+                else:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        cached = CachedFile(data, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if relpath in self.entries:
+                self._evict(relpath)
+            self.entries[relpath] = cached
+            self.total_bytes += cached.size
+            # Oldest entries go first when over budget; they are re-read from disk on demand
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self._evict(next(iter(self.entries)))
+        return cached
+
+    def _evict(self, relpath: str) -> None:
+        # The mmap is not closed here: responses still streaming it keep a reference,
+        # and it is unmapped when the last one is garbage collected
+        cached = self.entries.pop(relpath, None)
+        if cached is not None:
+            self.total_bytes -= cached.size
+
+    def get(self, relpath: str) -> Optional[CachedFile]:
+        """Get a cached file by path relative to the root, loading it on a miss"""
+        relpath = os.path.normpath(relpath).replace(os.sep, '/')
+        if relpath.startswith(('..', '/')) or not relpath.endswith(HLS_EXTENSIONS):
+            return None
+
+        self.ensure_started()
+        cached = self.entries.get(relpath)
+        if cached is not None:
+            return cached
+        # Written since the last scan (or evicted for size): load it now
+        return self._load(relpath, os.path.join(self.root, relpath))
+
+    def get_stats(self) -> dict:
+        """Cache size for status reporting"""
+        return {
+            'files': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+
+# Global cache over the HLS output directory
+segment_cache = SegmentCache(Config.HLS_OUTPUT_DIR)
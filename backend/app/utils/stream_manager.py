@@ -4,73 +4,376 @@ Stream Manager - Handles RTSP to HLS conversion
 
 import subprocess
 import os
+import re
 import signal
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional
 from config import Config
+from app.utils import abr, burn_in, dvr, ingest, llhls, probe, supervisor
+from app.utils.event_bus import event_bus
+from app.utils.process_registry import process_registry, read_pid_start_time, terminate_pid
+
+# Stream IDs become directory names and URL segments, so keep them boring
+STREAM_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def read_process_stats(pid: int) -> dict:
+    """Read CPU time and resident memory of a process from /proc (Linux only)"""
+    stats = {'cpu_seconds': None, 'rss_bytes': None}
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces, so split after the closing paren
+            fields = f.read().rsplit(')', 1)[1].split()
+        stats['cpu_seconds'] = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        with open(f'/proc/{pid}/statm') as f:
+            stats['rss_bytes'] = int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    return stats
+
+
+def read_directory_usage(path: str) -> dict:
+    """Count HLS segments and bytes on disk in an output directory"""
+    usage = {'disk_bytes': 0, 'segment_count': 0}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                usage['disk_bytes'] += entry.stat().st_size
+                if entry.name.endswith('.ts'):
+                    usage['segment_count'] += 1
+    except OSError:
+        pass
+    return usage
+
+
+def parse_stream_options(data: dict) -> dict:
+    """
+    Extract stream options from a start request body
+    
+    Raises:
+        ValueError: if an option has an invalid value
+    """
+    options = {}
+    if 'low_latency' in data:
+        if not isinstance(data['low_latency'], bool):
+            raise ValueError('low_latency must be true or false')
+        if data['low_latency']:
+            options['low_latency'] = True
+    if 'burn_in' in data:
+        if not isinstance(data['burn_in'], bool):
+            raise ValueError('burn_in must be true or false')
+        if data['burn_in']:
+            options['burn_in'] = True
+    if 'ingest' in data:
+        if not isinstance(data['ingest'], bool):
+            raise ValueError('ingest must be true or false')
+        if data['ingest']:
+            options['ingest'] = True
+            if options.get('low_latency'):
+                raise ValueError('low_latency cannot be combined with ingest')
+    if data.get('ladder'):
+        options['ladder'] = abr.resolve_ladder(data['ladder'])
+        if options.get('low_latency'):
+            raise ValueError('low_latency cannot be combined with a bitrate ladder')
+    if 'dvr' in data:
+        if not isinstance(data['dvr'], bool):
+            raise ValueError('dvr must be true or false')
+        if data['dvr']:
+            options['dvr'] = True
+            if options.get('low_latency') or options.get('ladder'):
+                raise ValueError('dvr cannot be combined with low_latency or a bitrate ladder')
+    return options
+
+
+def hls_url_for(stream_id: Optional[str], options: dict) -> str:
+    """Public URL of a stream's playlist"""
+    playlist = abr.MASTER_PLAYLIST if options.get('ladder') else 'stream.m3u8'
+    if stream_id is None:
+        return f'/{playlist}'
+    return f'/streams/{stream_id}/{playlist}'
+
 
 class StreamManager:
     """Manages RTSP to HLS conversion process"""
     
-    def __init__(self):
+    def __init__(self, stream_id: Optional[str] = None, output_dir: Optional[str] = None):
         self.process: Optional[subprocess.Popen] = None
         self.current_rtsp_url: Optional[str] = None
-        self.output_dir = Config.HLS_OUTPUT_DIR
+        self.stream_id = stream_id
+        self.output_dir = output_dir or Config.HLS_OUTPUT_DIR
+        self.started_at: Optional[float] = None
+        self.start_count = 0
+        self.options: dict = {}
+        # Output readers of the process this worker started (full log ring buffer)
+        self.output: Optional[supervisor.ProcessOutput] = None
+        # Key of this stream in the cross-worker process registry
+        self.state_key = 'stream' if stream_id is None else f'stream-{stream_id}'
+    
+    @property
+    def media_dir(self) -> str:
+        """Directory holding the stream's playlists and segments (shared memory in ingest mode)"""
+        if self.options.get('ingest'):
+            return ingest.ingest_ring.stream_dir(self.stream_id)
+        return self.output_dir
+    
+    @property
+    def hls_url(self) -> str:
+        """Public URL of the stream playlist"""
+        return hls_url_for(self.stream_id, self.options)
+    
+    def _load_state(self) -> Optional[dict]:
+        """Refresh local fields from the shared registry (another worker may own the process)"""
+        # Reap our own child if it exited, so it doesn't linger as a zombie
+        if self.process is not None and self.process.poll() is not None:
+            self.process = None
+        
+        state = process_registry.read(self.state_key)
+        self.current_rtsp_url = state.get('rtsp_url') if state else None
+        self.started_at = state.get('started_at') if state else None
+        self.start_count = state.get('start_count', 0) if state else 0
+        self.options = state.get('options', {}) if state else {}
+        return state
         
     def is_running(self) -> bool:
         """Check if conversion process is running"""
-        return self.process is not None and self.process.poll() is None
+        return process_registry.is_alive(self._load_state())
     
-    def start_stream(self, rtsp_url: str) -> dict:
+    def build_ffmpeg_command(self, rtsp_url: str, options: Optional[dict] = None,
+                             burn_graph: Optional[str] = None, ingest_token: Optional[str] = None,
+                             codecs: Optional[dict] = None) -> list:
         """
-        Start RTSP to HLS conversion
+        Build the FFmpeg command line for this stream
         
-        Args:
-            rtsp_url: RTSP stream URL
-            
-        Returns:
-            dict with status and message
+        burn_graph is the overlay filtergraph for burn-in mode; drawing on
+        the video means it has to be re-encoded instead of copied. With an
+        ingest_token, output is uploaded to this server's ingest endpoint
+        instead of written to the output directory. codecs are the copy or
+        transcode decisions from probe.choose_codecs(); without them video
+        is copied and audio encoded to AAC.
         """
-        # Stop existing stream if running
-        if self.is_running():
-            self.stop_stream()
+        options = options or {}
+        # Progress goes to stdout for the supervisor to parse
+        input_args = list(supervisor.PROGRESS_ARGS)
+        input_args += ['-rtsp_transport', 'tcp'] if rtsp_url.startswith('rtsp') else []
+        input_args += ['-i', rtsp_url]
+        if ingest_token:
+            location = ingest.ingest_url(self.stream_id, ingest_token)
+            input_args += ['-method', 'PUT']
+        else:
+            location = self.output_dir
         
-        # Create output directory
-        os.makedirs(self.output_dir, exist_ok=True)
+        if options.get('ladder'):
+            return [Config.FFMPEG_BIN] + input_args + abr.build_output_args(
+                options['ladder'], location,
+                prefilter=burn_graph, prefilter_label=burn_in.OUTPUT_LABEL,
+                audio=(codecs or {}).get('audio', {}).get('action') != 'none'
+            )
         
-        output_path = os.path.join(self.output_dir, 'stream.m3u8')
+        if burn_graph:
+            input_args += ['-filter_complex', burn_graph, '-map', f'[{burn_in.OUTPUT_LABEL}]', '-map', '0:a?']
         
-        # FFmpeg command
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-rtsp_transport', 'tcp',
-            '-i', rtsp_url,
-            '-c:v', 'copy',
-            '-c:a', 'aac',
+        if options.get('low_latency'):
+            return [Config.FFMPEG_BIN] + input_args + self._low_latency_output_args(codecs)
+        
+        if burn_graph or (codecs or {}).get('video', {}).get('action') == 'transcode':
+            video_args = [
+                '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency',
+                '-force_key_frames', 'expr:gte(t,n_forced*2)'
+            ]
+        else:
+            video_args = ['-c:v', 'copy']
+        if ingest_token:
+            # Uploads are stored atomically by the ingest endpoint, and append_list
+            # would read the old playlist back, which it doesn't serve
+            hls_flags = 'delete_segments+program_date_time'
+        else:
+            hls_flags = 'delete_segments+append_list+temp_file+program_date_time'
+        output_path = os.path.join(location, 'stream.m3u8')
+        return [Config.FFMPEG_BIN] + input_args + video_args + probe.audio_args(codecs) + [
             '-f', 'hls',
             '-hls_time', '2',
             '-hls_list_size', '10',
-            '-hls_flags', 'delete_segments+append_list',
-            '-hls_segment_filename', os.path.join(self.output_dir, 'stream%d.ts'),
+            # temp_file: segments only appear once complete, so they can be cached as immutable
+            '-hls_flags', hls_flags,
+            # Number segments from the epoch so names are never reused across restarts
+            '-hls_start_number_source', 'epoch',
+            '-hls_segment_filename', os.path.join(location, 'stream%d.ts'),
             '-loglevel', 'warning',  # Reduce log verbosity
             output_path
         ]
+    
+    def _low_latency_output_args(self, codecs: Optional[dict] = None) -> list:
+        """
+        Output arguments for LL-HLS mode
+        
+        Video is re-encoded with a keyframe forced every part so each short
+        fMP4 segment FFmpeg writes can be served as an independent LL-HLS part.
+        """
+        part = Config.LLHLS_PART_DURATION
+        parts_per_segment = Config.LLHLS_PARTS_PER_SEGMENT
+        return [
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-tune', 'zerolatency',
+            '-force_key_frames', f'expr:gte(t,n_forced*{part})',
+            '-sc_threshold', '0'
+        ] + probe.audio_args(codecs) + [
+            '-f', 'hls',
+            '-hls_time', str(part),
+            # Keep a few segments' worth of parts so in-flight segment requests still find them
+            '-hls_list_size', str(parts_per_segment * 6),
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', llhls.INIT_SEGMENT,
+            '-hls_flags', 'delete_segments+temp_file+program_date_time+independent_segments',
+            # Not epoch seconds: parts are shorter than a second, so a restart would reuse names
+            '-start_number', str(llhls.start_number(part, parts_per_segment)),
+            '-hls_segment_filename', os.path.join(self.output_dir, llhls.PART_FILENAME),
+            '-loglevel', 'warning',
+            os.path.join(self.output_dir, llhls.SOURCE_PLAYLIST)
+        ]
+    
+    def _remove_stale_playlists(self) -> None:
+        """Drop playlists and LL-HLS parts left by a previous run so routes don't serve them as live"""
+        try:
+            names = os.listdir(self.output_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.m3u8') or llhls.PART_PATTERN.match(name):
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except OSError:
+                    pass
+    
+    def start_stream(self, rtsp_url: str, options: Optional[dict] = None) -> dict:
+        """
+        Start RTSP to HLS conversion
+        
+        Starts are deduplicated across workers: if the same URL is already
+        being converted with the same options by any worker, the running
+        process is kept.
+        
+        Args:
+            rtsp_url: RTSP stream URL
+            options: stream options from parse_stream_options()
+            
+        Returns:
+            dict with status and message
+        """
+        options = options or {}
+        with process_registry.lock(self.state_key):
+            state = self._load_state()
+            
+            if process_registry.is_alive(state):
+                if state['rtsp_url'] == rtsp_url and state.get('options', {}) == options:
+                    return {
+                        'status': 'success',
+                        'message': 'Stream already running',
+                        'stream_id': self.stream_id,
+                        'rtsp_url': rtsp_url,
+                        'hls_url': self.hls_url,
+                        'options': options
+                    }
+                # Stop existing stream if running
+                self._terminate(state)
+            
+            result = self._spawn(rtsp_url, options, state)
+        self._publish_started(result)
+        return result
+    
+    def _publish_started(self, result: dict) -> None:
+        """Announce a successful spawn (after the stream lock is released: publishing waits on MongoDB)"""
+        if result['status'] == 'success':
+            event_bus.publish('stream.started', {
+                'stream_id': self.stream_id,
+                'rtsp_url': result['rtsp_url'],
+                'hls_url': result['hls_url'],
+                'options': result['options']
+            })
+    
+    def _spawn(self, rtsp_url: str, options: dict, state: Optional[dict],
+               restarts: int = 0, failures: int = 0) -> dict:
+        """
+        Start FFmpeg and record it in the registry (caller holds the stream lock)
+        
+        restarts and failures carry the supervisor's counters across automatic
+        restarts; a start requested by a user resets them.
+        """
+        # Create output directory
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._remove_stale_playlists()
+        # Files of a previous ingest run would be served instead of this run's
+        ingest.ingest_ring.clear(self.stream_id)
+        ingest_token = ingest.new_token() if options.get('ingest') else None
         
         try:
+            burn_graph = None
+            burn_state = None
+            if options.get('burn_in'):
+                overlays = burn_in.load_overlays(self.stream_id)
+                port = burn_in.allocate_port()
+                burn_graph = burn_in.build_filtergraph(overlays, port)
+                burn_state = {'port': port, 'images': burn_in.image_signature(overlays)}
+            
+            # Copy the tracks players can take as they are, transcode the rest
+            codecs = self.choose_codecs(rtsp_url, options)
+            
             # Start FFmpeg process
             self.process = subprocess.Popen(
-                ffmpeg_cmd,
+                self.build_ffmpeg_command(rtsp_url, options, burn_graph, ingest_token, codecs),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                universal_newlines=True
+                universal_newlines=True,
+                bufsize=1
             )
+            process = self.process
+            
+            process_registry.write(self.state_key, {
+                'pid': self.process.pid,
+                'pid_start_time': read_pid_start_time(self.process.pid),
+                'owner_pid': os.getpid(),
+                'rtsp_url': rtsp_url,
+                'options': options,
+                'burn_in': burn_state,
+                'codecs': codecs,
+                'ingest_token': ingest_token,
+                'output_dir': self.output_dir,
+                'started_at': time.time(),
+                # Stream-relative overlay schedules count from here; automatic restarts keep it
+                'session_started_at': ((state or {}).get('session_started_at') if restarts else None) or time.time(),
+                'start_count': (state or {}).get('start_count', 0) + 1,
+                'restarts': restarts,
+                'failures': failures,
+                'last_exit': (state or {}).get('last_exit') if restarts else None,
+                'restart_at': None,
+                'progress': None,
+                'log_tail': []
+            })
+            self._load_state()
+            # Drain both pipes from the start: a full pipe would block FFmpeg
+            self.output = supervisor.ProcessOutput(process, self._record_progress)
+            threading.Thread(target=self._supervise, args=(process, self.output), daemon=True).start()
+            if options.get('dvr'):
+                dvr.DvrArchiver(dvr.dvr_store, self.stream_id, self.media_dir, process).start()
             
-            self.current_rtsp_url = rtsp_url
+            if burn_state is not None:
+                # Text slots start empty; fill them once the zmq filter is listening
+                threading.Thread(target=self._push_overlays_after_start, daemon=True).start()
             
             return {
                 'status': 'success',
                 'message': 'Stream started successfully',
+                'stream_id': self.stream_id,
                 'rtsp_url': rtsp_url,
-                'hls_url': '/stream.m3u8'
+                'hls_url': self.hls_url,
+                'options': options,
+                'codecs': codecs
             }
             
         except FileNotFoundError:
@@ -83,37 +386,150 @@ class StreamManager:
                 'status': 'error',
                 'message': f'Failed to start stream: {str(e)}'
             }
+
+    @staticmethod
+    def choose_codecs(rtsp_url: str, options: dict) -> dict:
+        """Copy or transcode decision per track, from the (cached) probe of the source"""
+        streams = probe.probe_cache.get(rtsp_url) if Config.PROBE_SOURCES else None
+        if options.get('ladder'):
+            return probe.choose_codecs(streams, transcode_video='ladder', transcode_audio='ladder')
+        if options.get('low_latency'):
+            return probe.choose_codecs(streams, transcode_video='low_latency')
+        return probe.choose_codecs(streams, transcode_video='burn_in' if options.get('burn_in') else None)
+    
+    def _update_state(self, pid: int, **fields) -> Optional[dict]:
+        """Update fields of the shared state if it still belongs to this process"""
+        with process_registry.lock(self.state_key):
+            state = process_registry.read(self.state_key)
+            if not state or state.get('pid') != pid:
+                return None
+            state.update(fields)
+            process_registry.write(self.state_key, state)
+            return state
+    
+    def _record_progress(self, output: supervisor.ProcessOutput, progress: dict) -> None:
+        """Share the latest progress and log lines with the other workers"""
+        self._update_state(
+            output.process.pid,
+            progress=progress,
+            log_tail=output.tail(Config.FFMPEG_STATUS_LOG_LINES)
+        )
+    
+    def _supervise(self, process: subprocess.Popen, output: supervisor.ProcessOutput) -> None:
+        """
+        Wait for FFmpeg to exit and restart it with exponential backoff
+        
+        Stops and restarts replace or clear the state under the stream lock
+        before the process is gone, so an exit seen with this PID still
+        registered is a crash. A run of FFMPEG_STABLE_SECONDS resets the backoff.
+        """
+        returncode = process.wait()
+        output.join()
+        log_tail = output.tail(Config.FFMPEG_STATUS_LOG_LINES)
+        
+        with process_registry.lock(self.state_key):
+            state = process_registry.read(self.state_key)
+            if not state or state.get('pid') != process.pid:
+                return
+            ran_for = time.time() - (state.get('started_at') or time.time())
+            failures = 1 if ran_for >= Config.FFMPEG_STABLE_SECONDS else state.get('failures', 0) + 1
+            delay = supervisor.restart_delay(failures) if Config.FFMPEG_AUTO_RESTART else None
+            state.update({
+                'failures': failures,
+                'last_exit': {'returncode': returncode, 'at': time.time(), 'log_tail': log_tail},
+                'restart_at': time.time() + delay if delay is not None else None,
+                'log_tail': log_tail
+            })
+            process_registry.write(self.state_key, state)
+        # The camera may have been reconfigured; probe it again before the restart
+        probe.probe_cache.invalidate(state.get('rtsp_url'))
+        
+        print(f"✗ FFmpeg exited (code {returncode}) while the stream was running")
+        for line in log_tail[-5:]:
+            print(f"   {line}")
+        event_bus.publish('stream.crashed', {
+            'stream_id': self.stream_id,
+            'rtsp_url': state.get('rtsp_url'),
+            'returncode': returncode,
+            'restart_in': delay
+        })
+        
+        while delay is not None:
+            time.sleep(delay)
+            with process_registry.lock(self.state_key):
+                state = process_registry.read(self.state_key)
+                # Stopped, or started again by someone else, while we waited
+                if not state or state.get('pid') != process.pid:
+                    return
+                print(f"🔄 Restarting FFmpeg after {delay:g}s (failure {failures})")
+                result = self._spawn(
+                    state['rtsp_url'], state.get('options', {}), state,
+                    restarts=state.get('restarts', 0) + 1, failures=failures
+                )
+                if result['status'] != 'success':
+                    failures += 1
+                    delay = supervisor.restart_delay(failures)
+                    state.update({'failures': failures, 'restart_at': time.time() + delay})
+                    process_registry.write(self.state_key, state)
+            if result['status'] == 'success':
+                self._publish_started(result)
+                return
+            print(f"✗ Restart failed: {result['message']}")
+    
+    def _terminate(self, state: dict) -> bool:
+        """Stop the process recorded in state. Returns True if it had to be force killed."""
+        if self.process is not None and self.process.pid == state['pid']:
+            # Our own child: wait on it directly so it gets reaped
+            try:
+                self.process.terminate()
+                self.process.wait(timeout=5)
+                return False
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+                return True
+            finally:
+                self.process = None
+        # Started by another worker: signal it by PID
+        return terminate_pid(state['pid'])
     
     def stop_stream(self) -> dict:
         """Stop the current stream"""
-        if not self.is_running():
+        with process_registry.lock(self.state_key):
+            result = self._stop_locked()
+        if result['status'] == 'success':
+            # Outside the lock, like stream.started: publishing waits on MongoDB
+            event_bus.publish('stream.stopped', {'stream_id': self.stream_id})
+        return result
+    
+    def _stop_locked(self) -> dict:
+        """Stop the stream's process and clear its state (caller holds the stream lock)"""
+        state = self._load_state()
+        if not process_registry.is_alive(state):
+            if state and state.get('restart_at'):
+                # Crashed and waiting for the supervisor: cancel the restart
+                process_registry.clear(self.state_key)
+                ingest.ingest_ring.clear(self.stream_id)
+                self._load_state()
+                return {
+                    'status': 'success',
+                    'message': 'Automatic restart cancelled'
+                }
             return {
                 'status': 'info',
                 'message': 'No stream is currently running'
             }
         
         try:
-            # Send SIGTERM to gracefully stop FFmpeg
-            self.process.terminate()
-            self.process.wait(timeout=5)
-            
-            self.process = None
-            self.current_rtsp_url = None
+            # Send SIGTERM to gracefully stop FFmpeg, force kill if it doesn't stop
+            forced = self._terminate(state)
+            process_registry.clear(self.state_key)
+            ingest.ingest_ring.clear(self.stream_id)
+            self._load_state()
             
             return {
                 'status': 'success',
-                'message': 'Stream stopped successfully'
-            }
-            
-        except subprocess.TimeoutExpired:
-            # Force kill if it doesn't stop gracefully
-            self.process.kill()
-            self.process = None
-            self.current_rtsp_url = None
-            
-            return {
-                'status': 'success',
-                'message': 'Stream force stopped'
+                'message': 'Stream force stopped' if forced else 'Stream stopped successfully'
             }
         except Exception as e:
             return {
@@ -123,14 +539,96 @@ class StreamManager:
     
     def get_status(self) -> dict:
         """Get current stream status"""
-        return {
-            'is_running': self.is_running(),
+        state = self._load_state()
+        is_running = process_registry.is_alive(state)
+        status = {
+            'is_running': is_running,
             'rtsp_url': self.current_rtsp_url,
-            'hls_url': '/stream.m3u8' if self.is_running() else None
+            'hls_url': self.hls_url if is_running else None,
+            'options': self.options,
+            'codecs': (state or {}).get('codecs'),
+            'supervisor': self.get_supervisor_status(state)
+        }
+        if self.options.get('dvr'):
+            status['dvr'] = dvr.dvr_store.index(self.stream_id).get_stats()
+        if self.stream_id is not None:
+            status['stream_id'] = self.stream_id
+            status['resources'] = self.get_resources()
+        return status
+    
+    def get_session_start(self) -> Optional[float]:
+        """When a user last started the running stream (stream time 0 of overlay schedules), or None"""
+        state = self._load_state()
+        if not process_registry.is_alive(state):
+            return None
+        return state.get('session_started_at') or state.get('started_at')
+    
+    def get_supervisor_status(self, state: Optional[dict]) -> dict:
+        """Progress metrics, restart counters and recent FFmpeg log lines"""
+        state = state or {}
+        restart_at = state.get('restart_at')
+        return {
+            'progress': state.get('progress'),
+            'restarts': state.get('restarts', 0),
+            'consecutive_failures': state.get('failures', 0),
+            'restart_pending': bool(restart_at) and not process_registry.is_alive(state),
+            'restart_in': round(max(restart_at - time.time(), 0), 1) if restart_at else None,
+            'last_exit': state.get('last_exit'),
+            'log_tail': state.get('log_tail', [])
+        }
+    
+    def get_resources(self) -> dict:
+        """Get resource usage of the FFmpeg process and its output directory"""
+        state = self._load_state()
+        is_running = process_registry.is_alive(state)
+        resources = {
+            'pid': state['pid'] if is_running else None,
+            'uptime_seconds': round(time.time() - self.started_at, 1) if is_running and self.started_at else 0,
+            'start_count': self.start_count,
+            'cpu_seconds': None,
+            'cpu_percent': None,
+            'rss_bytes': None
         }
+        if is_running:
+            resources.update(read_process_stats(state['pid']))
+            if resources['cpu_seconds'] is not None and resources['uptime_seconds'] > 0:
+                # Average over the process lifetime, as a share of one core
+                resources['cpu_percent'] = round(100 * resources['cpu_seconds'] / resources['uptime_seconds'], 1)
+        if self.options.get('ladder'):
+            resources['renditions'] = abr.estimate_rendition_cpu(self.options['ladder'], resources['cpu_percent'])
+        resources.update(read_directory_usage(self.media_dir))
+        return resources
+    
+    def _push_overlays_after_start(self, attempts: int = 20) -> None:
+        """Retry the first overlay sync until the encoder's command socket is up"""
+        for _ in range(attempts):
+            time.sleep(0.5)
+            result = self.sync_overlays()
+            if result['status'] != 'error':
+                return
+        print(f"✗ Burn-in overlays not applied: {result['message']}")
+    
+    def sync_overlays(self, overlays: Optional[list] = None) -> dict:
+        """
+        Bring burned-in overlays in line with the database
+        
+        Text overlays and image positions are changed in the running encoder
+        through filter commands. A different set of images needs a new
+        filtergraph, so the stream is restarted.
+        """
+        state = self._load_state()
+        if not process_registry.is_alive(state) or not state.get('burn_in'):
+            return {'status': 'info', 'message': 'No burn-in stream is running'}
+        
+        if overlays is None:
+            overlays = burn_in.load_overlays(self.stream_id)
+        if burn_in.image_signature(overlays) != state['burn_in']['images']:
+            return self.restart_stream()
+        return burn_in.send_commands(state['burn_in']['port'], burn_in.build_commands(overlays))
     
     def restart_stream(self) -> dict:
         """Restart the current stream"""
+        self._load_state()
         if not self.current_rtsp_url:
             return {
                 'status': 'error',
@@ -138,8 +636,136 @@ class StreamManager:
             }
         
         rtsp_url = self.current_rtsp_url
+        options = self.options
         self.stop_stream()
-        return self.start_stream(rtsp_url)
+        return self.start_stream(rtsp_url, options)
+
+
+class StreamRegistry:
+    """Keeps one StreamManager per stream ID, each with its own output directory"""
+    
+    def __init__(self, base_dir: Optional[str] = None, max_streams: Optional[int] = None):
+        self.base_dir = base_dir or Config.HLS_OUTPUT_DIR
+        self.max_streams = max_streams if max_streams is not None else Config.MAX_STREAMS
+        self.streams: Dict[str, StreamManager] = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def is_valid_id(stream_id: str) -> bool:
+        """Check that a stream ID is safe to use as a directory name"""
+        return bool(stream_id) and STREAM_ID_PATTERN.match(stream_id) is not None
+    
+    def stream_dir(self, stream_id: str) -> str:
+        """Output directory for a stream"""
+        return os.path.join(self.base_dir, stream_id)
+    
+    def get(self, stream_id: str) -> Optional[StreamManager]:
+        """Get the manager for a stream, if it was ever started (by any worker)"""
+        manager = self.streams.get(stream_id)
+        if manager is None and self.is_valid_id(stream_id) and process_registry.read(f'stream-{stream_id}'):
+            with self.lock:
+                manager = self.streams.setdefault(
+                    stream_id, StreamManager(stream_id, self.stream_dir(stream_id))
+                )
+        return manager
+    
+    def known_ids(self) -> list:
+        """IDs of streams started by this or any other worker"""
+        shared = [key[len('stream-'):] for key in process_registry.keys() if key.startswith('stream-')]
+        return sorted(set(self.streams) | set(shared))
+    
+    def running_count(self) -> int:
+        """Number of streams with a live FFmpeg process"""
+        managers = [self.get(stream_id) for stream_id in self.known_ids()]
+        return sum(1 for manager in managers if manager is not None and manager.is_running())
+    
+    def start_stream(self, stream_id: str, rtsp_url: str, options: Optional[dict] = None) -> dict:
+        """Start (or replace) the conversion for one stream"""
+        if not self.is_valid_id(stream_id):
+            return {
+                'status': 'error',
+                'message': 'Invalid stream id. Use letters, digits, "-" or "_" (max 64 chars)'
+            }
+        
+        manager = self.get(stream_id)
+        already_running = manager is not None and manager.is_running()
+        if not already_running and self.max_streams and self.running_count() >= self.max_streams:
+            return {
+                'status': 'error',
+                'message': f'Stream limit reached ({self.max_streams} running streams)'
+            }
+        if manager is None:
+            with self.lock:
+                manager = self.streams.setdefault(
+                    stream_id, StreamManager(stream_id, self.stream_dir(stream_id))
+                )
+        
+        return manager.start_stream(rtsp_url, options)
+    
+    def stop_stream(self, stream_id: str) -> dict:
+        """Stop the conversion for one stream"""
+        manager = self.get(stream_id)
+        if manager is None:
+            return {
+                'status': 'error',
+                'message': f'Unknown stream: {stream_id}'
+            }
+        return manager.stop_stream()
+    
+    def get_status(self, stream_id: str) -> Optional[dict]:
+        """Get status of one stream, or None if unknown"""
+        manager = self.get(stream_id)
+        return manager.get_status() if manager is not None else None
+    
+    def list_streams(self) -> dict:
+        """Status of every known stream plus totals for resource accounting"""
+        managers = [self.get(stream_id) for stream_id in self.known_ids()]
+        streams = [manager.get_status() for manager in managers if manager is not None]
+        totals = {'running': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0, 'disk_bytes': 0, 'segment_count': 0}
+        for status in streams:
+            resources = status['resources']
+            totals['running'] += 1 if status['is_running'] else 0
+            totals['cpu_seconds'] += resources['cpu_seconds'] or 0
+            totals['rss_bytes'] += resources['rss_bytes'] or 0
+            totals['disk_bytes'] += resources['disk_bytes']
+            totals['segment_count'] += resources['segment_count']
+        totals['cpu_seconds'] = round(totals['cpu_seconds'], 2)
+        return {
+            'streams': streams,
+            'count': len(streams),
+            'max_streams': self.max_streams,
+            'totals': totals
+        }
+    
+    def stop_all(self) -> None:
+        """Stop every running stream"""
+        for manager in [self.get(stream_id) for stream_id in self.known_ids()]:
+            if manager is not None:
+                manager.stop_stream()
+
 
 # Global stream manager instance
 stream_manager = StreamManager()
+
+# Global registry for multi-camera streams
+stream_registry = StreamRegistry()
+
+
+def iter_managers():
+    """The default stream's manager followed by those of all known multi-streams"""
+    yield stream_manager
+    for stream_id in stream_registry.known_ids():
+        manager = stream_registry.get(stream_id)
+        if manager is not None:
+            yield manager
+
+
+def sync_burn_in_overlays() -> None:
+    """Push the current overlays to every stream running in burn-in mode"""
+    managers = [manager for manager in iter_managers() if (manager._load_state() or {}).get('burn_in')]
+    if not managers:
+        return
+    for manager in managers:
+        result = manager.sync_overlays()
+        if result['status'] == 'error':
+            print(f"✗ Burn-in update failed for {manager.hls_url}: {result['message']}")
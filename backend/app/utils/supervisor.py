@@ -0,0 +1,102 @@
+"""
+FFmpeg Supervisor - Drains FFmpeg's output and tracks its progress
+
+FFmpeg runs with "-progress pipe:1", which writes key=value blocks to stdout
+after every stats period, and logs warnings to stderr. Both pipes are read
+by background threads so FFmpeg never blocks on a full pipe buffer: stderr
+goes into a bounded ring buffer, progress blocks are parsed into metrics.
+"""
+
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+from config import Config
+
+# Global options added to every FFmpeg command
+PROGRESS_ARGS = ['-nostats', '-progress', 'pipe:1']
+
+
+def _number(value: Optional[str], suffix: str = '', cast=float):
+    """Parse '1234.5kbits/s' or '1.01x'; FFmpeg reports N/A before the first frame"""
+    if value is None:
+        return None
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+
+def parse_progress(block: dict) -> dict:
+    """Metrics from one -progress block"""
+    out_time_us = _number(block.get('out_time_us'), cast=int)
+    return {
+        'frame': _number(block.get('frame'), cast=int),
+        'fps': _number(block.get('fps')),
+        'bitrate_kbps': _number(block.get('bitrate'), 'kbits/s'),
+        'speed': _number(block.get('speed'), 'x'),
+        'drop_frames': _number(block.get('drop_frames'), cast=int),
+        'dup_frames': _number(block.get('dup_frames'), cast=int),
+        'out_time_seconds': round(out_time_us / 1e6, 3) if out_time_us is not None else None,
+        'updated_at': time.time()
+    }
+
+
+def restart_delay(failures: int) -> float:
+    """Exponential backoff before restart number `failures` (1-based)"""
+    return min(Config.FFMPEG_RESTART_BASE_DELAY * 2 ** max(failures - 1, 0), Config.FFMPEG_RESTART_MAX_DELAY)
+
+
+class ProcessOutput:
+    """Reads one FFmpeg process's stdout (progress) and stderr (log) until it exits"""
+
+    def __init__(self, process: subprocess.Popen,
+                 on_progress: Optional[Callable[['ProcessOutput', dict], None]] = None):
+        self.process = process
+        # Called with the latest progress at most every FFMPEG_PROGRESS_INTERVAL seconds
+        self.on_progress = on_progress
+        self.log: deque = deque(maxlen=Config.FFMPEG_LOG_LINES)
+        self.progress: Optional[dict] = None
+        self._reported_at = 0.0
+        self._threads = [
+            threading.Thread(target=self._read_progress, name=f'ffmpeg-progress-{process.pid}', daemon=True),
+            threading.Thread(target=self._read_log, name=f'ffmpeg-log-{process.pid}', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _read_progress(self) -> None:
+        block = {}
+        for line in self.process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+            # "progress=continue" (or "end") closes a block
+            self.progress = parse_progress(block)
+            block = {}
+            if self.on_progress is None or time.time() - self._reported_at < Config.FFMPEG_PROGRESS_INTERVAL:
+                continue
+            self._reported_at = time.time()
+            try:
+                self.on_progress(self, self.progress)
+            except Exception as e:
+                print(f"✗ Progress update failed: {e}")
+
+    def _read_log(self) -> None:
+        for line in self.process.stderr:
+            line = line.rstrip()
+            if line:
+                self.log.append(line)
+
+    def tail(self, lines: int) -> list:
+        return list(self.log)[-lines:]
+
+    def join(self, timeout: float = 2) -> None:
+        """Wait for both pipes to reach EOF after the process exited"""
+        for thread in self._threads:
+            thread.join(timeout)
@@ -0,0 +1,309 @@
+"""
+Thumbnails - Keyframe previews and scrub sprite sheets of running streams
+
+A thumbnail is the first keyframe of a stream's newest segment, decoded by
+FFmpeg (only keyframes are decoded) and scaled to the requested width.
+Each stream is re-checked for a newer segment at most every
+THUMBNAIL_INTERVAL seconds; requests in between, and requests arriving
+while a frame is being decoded, get the current thumbnail.
+
+Frames are cached per segment file in an in-memory LRU bounded by
+THUMBNAIL_CACHE_MAX_BYTES, so a segment is decoded once per width however
+often it is shown. Current thumbnails are looked up in the same LRU, so
+they count against its budget whatever widths are requested. Sprite sheets tile the frames of the retained segments
+(the DVR archive, or else the live playlist) and only decode segments that
+have no cached frame yet.
+"""
+
+import hashlib
+import math
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from app.utils import abr, dvr, llhls
+from app.utils.llhls import LowLatencyPlaylist
+
+MIN_WIDTH = 16
+MAX_WIDTH = 1920
+# JPEG start-of-frame markers (holding the image size); C4, C8 and CC are other segments
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG's start-of-frame segment"""
+    offset = 2
+    while offset + 9 < len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        length = int.from_bytes(data[offset + 2:offset + 4], 'big')
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[offset + 5:offset + 7], 'big')
+            width = int.from_bytes(data[offset + 7:offset + 9], 'big')
+            return width, height
+        offset += 2 + length
+    return None
+
+
+class Image:
+    """An encoded JPEG with its validator"""
+
+    __slots__ = ('data', 'etag', 'created_at')
+
+    def __init__(self, data: bytes, key: str):
+        self.data = data
+        self.etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+        self.created_at = time.time()
+
+
+class Sprite(Image):
+    """Sprite sheet and the position and time range of each tile"""
+
+    __slots__ = ('tiles', 'tile_width', 'tile_height')
+
+    def __init__(self, data: bytes, key: str, tiles: List[dict], tile_width: int, tile_height: int):
+        super().__init__(data, key)
+        self.tiles = tiles
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+
+    def render_vtt(self, image_url: str) -> str:
+        """WebVTT thumbnail track mapping times (seconds from the first tile) to tiles"""
+        lines = ['WEBVTT', '']
+        for tile in self.tiles:
+            lines.append(f'{_vtt_time(tile["start"])} --> {_vtt_time(tile["end"])}')
+            lines.append(f'{image_url}#xywh={tile["x"]},{tile["y"]},{self.tile_width},{self.tile_height}')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+def _vtt_time(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:06.3f}'
+
+
+class ImageCache:
+    """LRU of encoded images, bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[tuple, Image]' = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Image]:
+        with self.lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+            return image
+
+    def put(self, key: tuple, image: Image) -> None:
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous.data)
+            self.entries[key] = image
+            self.total_bytes += len(image.data)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted.data)
+
+    def __contains__(self, key: tuple) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def find(self, etag: str) -> Optional[Image]:
+        """Cached image with this ETag (a few hundred entries at most)"""
+        with self.lock:
+            return next((image for image in self.entries.values() if image.etag == etag), None)
+
+
+class ThumbnailService:
+    """Per-worker thumbnails and sprite sheets of every stream"""
+
+    def __init__(self, max_bytes: Optional[int] = None, interval: Optional[float] = None):
+        self.cache = ImageCache(max_bytes or Config.THUMBNAIL_CACHE_MAX_BYTES)
+        self.interval = interval if interval is not None else Config.THUMBNAIL_INTERVAL
+        # Cache key of the newest thumbnail per (stream, width) and when the stream was last checked
+        self.latest: Dict[tuple, Tuple[tuple, float]] = {}
+        self.locks: Dict[tuple, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def _lock_for(self, key: tuple) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def live_segments(manager) -> Tuple[str, List[llhls.Part], Optional[str]]:
+        """(directory, segments, init segment) of a stream's live playlist, lowest rendition for ladders"""
+        options = manager.options
+        init = None
+        if options.get('ladder'):
+            name = min(options['ladder'], key=lambda rendition: abr.RENDITIONS[rendition]['height'])
+            playlist = f'stream_{name}.m3u8'
+        elif options.get('low_latency'):
+            playlist, init = llhls.SOURCE_PLAYLIST, llhls.INIT_SEGMENT
+        else:
+            playlist = 'stream.m3u8'
+        try:
+            with open(os.path.join(manager.media_dir, playlist)) as f:
+                segments = LowLatencyPlaylist._parse(f.read())
+        except OSError:
+            segments = []
+        return manager.media_dir, segments, init
+
+    def frame(self, directory: str, filename: str, init: Optional[str], width: int) -> Optional[Image]:
+        """First keyframe of a segment file, decoded once per width"""
+        path = os.path.join(directory, filename)
+        key = ('frame', path, width)
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+        # Decodes of a stream run one at a time, so concurrent requests don't decode a segment twice
+        with self._lock_for(('frame', directory)):
+            image = self.cache.get(key)
+            if image is not None:
+                return image
+            # fMP4 parts only decode together with their init segment
+            source = f'concat:{os.path.join(directory, init)}|{path}' if init else path
+            data = self._run_ffmpeg([
+                '-skip_frame', 'nokey', '-i', source,
+                '-frames:v', '1', '-vf', f'scale={width}:-2',
+                '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '5', 'pipe:1'
+            ])
+            if not data:
+                return None
+            image = Image(data, f'{path}:{width}')
+            self.cache.put(key, image)
+            return image
+
+    def _latest(self, key: tuple) -> Tuple[Optional[Image], float]:
+        """Current thumbnail and when it was checked; (None, 0) once the cache evicted it"""
+        latest = self.latest.get(key)
+        image = self.cache.get(latest[0]) if latest is not None else None
+        return (image, latest[1]) if image is not None else (None, 0.0)
+
+    def _forget_evicted(self) -> None:
+        """Drop thumbnails (and their locks) whose frame the cache evicted"""
+        with self.lock:
+            self.latest = {key: latest for key, latest in self.latest.items() if latest[0] in self.cache}
+            for key in [key for key, lock in self.locks.items()
+                        if key[0] == 'thumbnail' and key[1:] not in self.latest and not lock.locked()]:
+                del self.locks[key]
+
+    def thumbnail(self, manager, width: int) -> Optional[Image]:
+        """Keyframe of the stream's newest segment, re-checked at most every THUMBNAIL_INTERVAL seconds"""
+        key = (manager.stream_id, width)
+        image, checked_at = self._latest(key)
+        if image is not None and time.time() - checked_at < self.interval:
+            return image
+        lock = self._lock_for(('thumbnail',) + key)
+        if not lock.acquire(blocking=image is None):
+            # Another request is decoding the new one; don't wait for it
+            return image
+        try:
+            image, checked_at = self._latest(key)
+            if image is not None and time.time() - checked_at < self.interval:
+                return image
+            directory, segments, init = self.live_segments(manager)
+            # Newest first: the newest segment may be deleted while it is decoded
+            for segment in reversed(segments[-3:]):
+                newest = self.frame(directory, segment.uri, init, width)
+                if newest is not None:
+                    self.latest[key] = (('frame', os.path.join(directory, segment.uri), width), time.time())
+                    break
+            else:
+                return image
+        finally:
+            lock.release()
+        self._forget_evicted()
+        return newest
+
+    def sprite(self, manager, width: int, columns: Optional[int] = None,
+               max_tiles: Optional[int] = None) -> Optional[Sprite]:
+        """Sprite sheet of the retained segments, sampled evenly down to max_tiles"""
+        columns = columns or Config.THUMBNAIL_SPRITE_COLUMNS
+        max_tiles = max_tiles or Config.THUMBNAIL_SPRITE_MAX_TILES
+        init = None
+        if manager.options.get('dvr'):
+            index = dvr.dvr_store.index(manager.stream_id)
+            directory = index.directory
+            with index.lock:
+                segments = [(segment['file'], segment['start'], segment['duration']) for segment in index.segments]
+        else:
+            directory, parts, init = self.live_segments(manager)
+            segments = []
+            start = 0.0
+            for part in parts:
+                segments.append((part.uri, start, part.duration))
+                start += part.duration
+        if not segments:
+            return None
+
+        step = max(math.ceil(len(segments) / max_tiles), 1)
+        sampled = segments[::step]
+        key = ('sprite', directory, width, columns) + tuple(name for name, _, _ in sampled)
+        sprite = self.cache.get(key)
+        if sprite is not None:
+            return sprite
+
+        frames = []
+        for index, (name, start, duration) in enumerate(sampled):
+            image = self.frame(directory, name, init, width)
+            if image is None:
+                continue
+            # A tile stands for every segment up to the next tile
+            end = sampled[index + 1][1] if index + 1 < len(sampled) else start + duration
+            frames.append((image, start, end))
+        if not frames:
+            return None
+        size = jpeg_size(frames[0][0].data)
+        if size is None:
+            return None
+        tile_width, tile_height = size
+        columns = min(columns, len(frames))
+        rows = math.ceil(len(frames) / columns)
+        data = self._run_ffmpeg([
+            '-f', 'image2pipe', '-c:v', 'mjpeg', '-i', 'pipe:0',
+            # Frames of an earlier run may differ in height; every tile gets the first one's size
+            '-vf', f'scale={tile_width}:{tile_height},tile={columns}x{rows}',
+            '-frames:v', '1', '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '5', 'pipe:1'
+        ], b''.join(image.data for image, _, _ in frames))
+        if not data:
+            return None
+        origin = frames[0][1]
+        tiles = [{
+            'start': round(start - origin, 3),
+            'end': round(end - origin, 3),
+            'x': (index % columns) * tile_width,
+            'y': (index // columns) * tile_height
+        } for index, (_, start, end) in enumerate(frames)]
+        sprite = Sprite(data, repr(key), tiles, tile_width, tile_height)
+        self.cache.put(key, sprite)
+        return sprite
+
+    @staticmethod
+    def _run_ffmpeg(args: list, stdin: Optional[bytes] = None) -> Optional[bytes]:
+        try:
+            result = subprocess.run(
+                [Config.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error'] + args,
+                input=stdin, capture_output=True, timeout=Config.THUMBNAIL_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"✗ Thumbnail extraction failed: {e}")
+            return None
+        if result.returncode != 0:
+            message = result.stderr.decode(errors='replace').strip().splitlines()
+            print(f"✗ Thumbnail extraction failed: {message[-1] if message else result.returncode}")
+            return None
+        return result.stdout
+
+
+# Global thumbnail service
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,174 @@
+"""
+Write Buffer - Coalesces overlay position and size updates before they reach MongoDB
+
+Dragging or resizing an overlay sends a stream of PUTs that only change
+position or size. Each worker keeps the latest value per overlay in memory,
+answers with the buffered fields immediately, and writes everything pending
+every OVERLAY_FLUSH_INTERVAL seconds. The flush is one bulk_write, one
+version bump and one read of the written documents, however many updates
+it absorbed. Change events, burn-in updates and other workers see the new
+values at that point.
+
+The buffer is flushed when the worker stops (atexit, and gunicorn's
+worker_exit hook), so graceful restarts lose no updates. A failed flush
+keeps its updates and retries on the next interval, unless newer values
+for the same overlays have arrived in the meantime.
+"""
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+from prometheus_client import Counter
+from pymongo.errors import PyMongoError
+from config import Config
+from app.models.overlay import Overlay
+
+# Fields an update may consist of to be buffered
+BUFFERED_FIELDS = ('position', 'size')
+
+BUFFERED_UPDATES = Counter(
+    'overlay_buffered_updates_total', 'Position/size updates absorbed by the write buffer'
+)
+FLUSHED_UPDATES = Counter(
+    'overlay_flushed_updates_total', 'Overlay documents written by write buffer flushes'
+)
+
+
+class OverlayWriteBuffer:
+    """Per-worker write-behind buffer for overlay position and size changes"""
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval if interval is not None else Config.OVERLAY_FLUSH_INTERVAL
+        # Changed fields per overlay id, not written yet
+        self.pending: Dict[str, dict] = {}
+        # Ids of recently updated overlays known to exist
+        self.known: Set[str] = set()
+        # Bumped by every buffered update, for validators of responses built from the buffer
+        self.sequence = 0
+        self.stats = {'buffered': 0, 'flushed': 0, 'flushes': 0, 'failed_flushes': 0}
+        self.listeners: List[Callable[[list], None]] = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        atexit.register(self.flush)
+
+    @staticmethod
+    def accepts(data) -> bool:
+        """Whether an update only moves or resizes an overlay"""
+        return (Config.OVERLAY_WRITE_BEHIND and isinstance(data, dict) and bool(data)
+                and all(field in BUFFERED_FIELDS and isinstance(value, dict) for field, value in data.items()))
+
+    def add_listener(self, listener: Callable[[list], None]) -> None:
+        """Call listener with ('overlay.updated', document) events after each flush"""
+        self.listeners.append(listener)
+
+    def ensure_started(self) -> None:
+        """Start the flush thread (once per worker process, also after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='overlay-write-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"✗ Overlay write buffer flush failed: {e}")
+
+    def update(self, overlay_id: str, data: dict) -> Optional[dict]:
+        """
+        Buffer a position/size change
+
+        Returns the overlay's pending fields with its _id, or None if it doesn't
+        exist. Other fields are left out: a full update handled by another worker
+        may have changed them since this one last read the overlay.
+        """
+        self.ensure_started()
+        if overlay_id not in self.known and Overlay.get_by_id(overlay_id) is None:
+            # First change of this overlay since a flush last wrote it
+            return None
+        with self.lock:
+            self.known.add(overlay_id)
+            fields = self.pending.setdefault(overlay_id, {})
+            fields.update(data)
+            fields['updated_at'] = datetime.utcnow()
+            self.sequence += 1
+            self.stats['buffered'] += 1
+            buffered = dict(fields, _id=overlay_id)
+        BUFFERED_UPDATES.inc()
+        return buffered
+
+    def apply(self, document: dict) -> dict:
+        """Document with this worker's pending changes applied (fields it doesn't have stay absent)"""
+        fields = self.pending.get(str(document.get('_id')))
+        if fields:
+            document.update({field: value for field, value in fields.items() if field in document})
+        return document
+
+    def validator_suffix(self) -> str:
+        """ETag suffix telling responses built with pending changes apart"""
+        return f'-w{self.sequence}' if self.pending else ''
+
+    def discard(self, overlay_id: str) -> dict:
+        """Forget an overlay that is deleted or fully updated; returns its pending fields"""
+        with self.lock:
+            self.known.discard(overlay_id)
+            fields = self.pending.pop(overlay_id, {})
+        fields.pop('updated_at', None)
+        return fields
+
+    def flush(self) -> int:
+        """Write all pending changes; returns the number of overlays written"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                # Nothing moved for a whole interval: check existence again next time
+                with self.lock:
+                    self.known &= set(self.pending)
+                return 0
+            try:
+                documents = Overlay.apply_field_updates(batch)
+            except PyMongoError as e:
+                with self.lock:
+                    for overlay_id, fields in batch.items():
+                        # Newer values for the same overlay win
+                        self.pending[overlay_id] = dict(fields, **self.pending.get(overlay_id, {}))
+                    self.stats['failed_flushes'] += 1
+                print(f"✗ Overlay write buffer flush failed, retrying: {e}")
+                return 0
+
+            with self.lock:
+                # Overlays deleted meanwhile were not read back
+                written = {document['_id'] for document in documents}
+                self.known = {overlay_id for overlay_id in self.known
+                              if overlay_id in written or overlay_id in self.pending}
+                self.stats['flushed'] += len(batch)
+                self.stats['flushes'] += 1
+            FLUSHED_UPDATES.inc(len(batch))
+
+        events = [('overlay.updated', document) for document in documents]
+        for listener in self.listeners:
+            listener(events)
+        return len(batch)
+
+    def get_stats(self) -> dict:
+        """Counters of this worker, with updates absorbed per document written"""
+        stats = dict(self.stats, pending=len(self.pending), interval=self.interval,
+                     enabled=Config.OVERLAY_WRITE_BEHIND)
+        stats['coalescing_ratio'] = round(stats['buffered'] / stats['flushed'], 2) if stats['flushed'] else None
+        return stats
+
+
+# Global overlay write buffer
+overlay_write_buffer = OverlayWriteBuffer()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmark Suite
+Offline load tests of the backend: no FFmpeg, camera or MongoDB needed.
+Streams are produced by benchmarks/fake_ffmpeg.py (through FFMPEG_BIN) and
+the database is an in-memory mongomock client standing in for a standalone
+MongoDB (no change streams, capped collections created uncapped).
+
+Scenarios:
+    segments    viewers polling a live playlist and fetching its newest
+                segment through the Flask app: throughput and latency
+    overlays    create/list/page/get/update/delete latency (p50/p99)
+                against a pre-filled overlay library
+    lifecycle   StreamManager start (until the first playlist), stop and
+                restart latency
+
+Results are JSON with the git revision. With --baseline, metrics are
+compared against an earlier result file and the run exits with status 1
+if any got worse by more than --tolerance.
+
+Needs mongomock (pip install mongomock).
+
+Usage:
+    python3 benchmarks/backend_suite.py [--scenarios segments,overlays,lifecycle] [--output results.json]
+    python3 benchmarks/backend_suite.py --baseline results-1.4.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+try:
+    import mongomock
+    import pymongo
+    from pymongo.errors import OperationFailure
+except ImportError:
+    sys.exit('The benchmark suite needs mongomock: pip install mongomock')
+
+WORKDIR = tempfile.mkdtemp(prefix='backend-bench-')
+# The app reads these at import time
+os.environ.update({
+    'HLS_OUTPUT_DIR': os.path.join(WORKDIR, 'streams'),
+    'STREAM_STATE_DIR': os.path.join(WORKDIR, 'state'),
+    'DVR_DIR': os.path.join(WORKDIR, 'dvr'),
+    'INGEST_DIR': os.path.join(WORKDIR, 'ingest'),
+    'FFMPEG_BIN': os.path.join(BACKEND_DIR, 'benchmarks', 'fake_ffmpeg.py'),
+    'FFPROBE_BIN': os.path.join(BACKEND_DIR, 'benchmarks', 'fake_ffmpeg.py'),
+    'FFMPEG_AUTO_RESTART': 'false',
+    'MONGO_URI': 'mongodb://localhost:27017/backend_bench'
+})
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+os.environ.setdefault('FAKE_FFMPEG_SEGMENT_BYTES', str(256 * 1024))
+# Segments every 0.5s instead of every 2s, so scenarios see several of them
+os.environ.setdefault('FAKE_FFMPEG_SPEED', '4')
+
+
+def _create_collection(create_collection):
+    def create(self, name, **kwargs):
+        for option in ('capped', 'size', 'max'):
+            kwargs.pop(option, None)
+        return create_collection(self, name, **kwargs)
+    return create
+
+
+def _no_change_streams(self, *args, **kwargs):
+    raise OperationFailure('The $changeStream stage is only supported on replica sets')
+
+
+# In-memory stand-in for a standalone server
+mongomock.database.Database.create_collection = _create_collection(mongomock.database.Database.create_collection)
+mongomock.collection.Collection.watch = _no_change_streams
+pymongo.MongoClient = mongomock.MongoClient
+
+from app import create_app  # noqa: E402
+from app.models.overlay import Overlay  # noqa: E402
+from app.utils.stream_manager import stream_manager, stream_registry  # noqa: E402
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+def latency_summary(seconds):
+    """p50/p99/mean in milliseconds"""
+    if not seconds:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None, 'mean_ms': None}
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 3),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3)
+    }
+
+
+def timed(samples, func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def wait_for_file(path, timeout=10):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise TimeoutError(f'{path} did not appear within {timeout}s')
+        time.sleep(0.005)
+
+
+def bench_segments(app, clients, duration):
+    """Viewers polling the default stream's playlist and fetching its newest segment"""
+    result = stream_manager.start_stream('rtsp://bench.invalid/segments', {})
+    if result['status'] != 'success':
+        raise RuntimeError(result['message'])
+    wait_for_file(os.path.join(stream_manager.output_dir, 'stream.m3u8'))
+
+    playlists, segments = [], []
+    counters = {'bytes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def viewer():
+        client = app.test_client()
+        local_playlists, local_segments, received, errors = [], [], 0, 0
+        while time.time() < deadline:
+            response = timed(local_playlists, client.get, '/stream.m3u8')
+            if response.status_code != 200:
+                errors += 1
+                continue
+            newest = [line for line in response.get_data(as_text=True).splitlines() if line and not line.startswith('#')][-1]
+            response = timed(local_segments, client.get, f'/{newest}')
+            if response.status_code == 200:
+                received += len(response.get_data())
+            else:
+                errors += 1
+        with lock:
+            playlists.extend(local_playlists)
+            segments.extend(local_segments)
+            counters['bytes'] += received
+            counters['errors'] += errors
+
+    threads = [threading.Thread(target=viewer) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stream_manager.stop_stream()
+
+    return {
+        'clients': clients,
+        'requests_per_second': round((len(playlists) + len(segments)) / elapsed, 1),
+        'megabytes_per_second': round(counters['bytes'] / elapsed / 1e6, 2),
+        'errors': counters['errors'],
+        'playlist': latency_summary(playlists),
+        'segment': latency_summary(segments)
+    }
+
+
+def bench_overlays(app, iterations, library_size):
+    """Latency of each overlay endpoint against a library of library_size overlays"""
+    client = app.test_client()
+    for start in range(0, library_size, 500):
+        operations = [
+            {'op': 'create', 'data': {'type': 'text', 'content': f'Library {index}',
+                                      'stream_id': f'cam{index % 10}', 'position': {'x': index % 1280, 'y': 10}}}
+            for index in range(start, min(start + 500, library_size))
+        ]
+        client.post('/api/overlays/batch', json={'operations': operations})
+
+    samples = {name: [] for name in ('create', 'list', 'list_cached', 'page', 'get', 'update', 'delete')}
+    errors = 0
+    for index in range(iterations):
+        response = timed(samples['create'], client.post, '/api/overlays',
+                         json={'type': 'text', 'content': f'Bench {index}', 'stream_id': 'cam1'})
+        overlay_id = response.get_json()['data']['_id']
+        # The first list after a write rebuilds the cached body, the second is served from it
+        responses = [
+            response,
+            timed(samples['list'], client.get, '/api/overlays'),
+            timed(samples['list_cached'], client.get, '/api/overlays'),
+            timed(samples['page'], client.get, '/api/overlays?stream_id=cam1&limit=50&fields=content,position'),
+            timed(samples['get'], client.get, f'/api/overlays/{overlay_id}'),
+            timed(samples['update'], client.put, f'/api/overlays/{overlay_id}', json={'position': {'x': index, 'y': 20}}),
+            timed(samples['delete'], client.delete, f'/api/overlays/{overlay_id}')
+        ]
+        errors += sum(1 for response in responses if response.status_code >= 400)
+
+    return {
+        'iterations': iterations,
+        'library_size': library_size,
+        'errors': errors,
+        **{name: latency_summary(values) for name, values in samples.items()}
+    }
+
+
+def bench_lifecycle(iterations):
+    """StreamManager start, stop and restart latency with the fake FFmpeg"""
+    samples = {name: [] for name in ('start', 'first_playlist', 'stop', 'restart')}
+    errors = 0
+    stream_id = 'lifecycle'
+    for index in range(iterations):
+        started = time.perf_counter()
+        result = stream_registry.start_stream(stream_id, f'rtsp://bench.invalid/{index}')
+        samples['start'].append(time.perf_counter() - started)
+        if result['status'] != 'success':
+            errors += 1
+            continue
+        manager = stream_registry.get(stream_id)
+        playlist = os.path.join(manager.output_dir, 'stream.m3u8')
+        wait_for_file(playlist)
+        samples['first_playlist'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        result = manager.restart_stream()
+        wait_for_file(playlist)
+        samples['restart'].append(time.perf_counter() - started)
+        errors += result['status'] != 'success'
+
+        result = timed(samples['stop'], stream_registry.stop_stream, stream_id)
+        errors += result['status'] != 'success'
+
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        **{name: latency_summary(values) for name, values in samples.items()}
+    }
+
+
+def flatten(results, prefix=''):
+    """{'overlays.create.p99_ms': 1.2, ...} for comparing runs"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that got worse than the baseline by more than tolerance (a share)"""
+    current = flatten(results)
+    regressions = []
+    for key, before in flatten(baseline).items():
+        after = current.get(key)
+        if after is None or not before:
+            continue
+        if key.endswith('_per_second'):
+            change = (before - after) / before
+        elif key.endswith('_ms'):
+            change = (after - before) / before
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({'metric': key, 'baseline': before, 'current': after,
+                                'change_percent': round(100 * change, 1)})
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', '-C', BACKEND_DIR, 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='segments,overlays,lifecycle')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent viewers in the segments scenario')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of the segments scenario')
+    parser.add_argument('--iterations', type=int, default=200, help='rounds of the overlays scenario')
+    parser.add_argument('--library-size', type=int, default=2000, help='overlays stored before the overlays scenario')
+    parser.add_argument('--lifecycle-iterations', type=int, default=10)
+    parser.add_argument('--baseline', help='earlier result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a metric counts as a regression')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(',')
+    app = create_app()
+    results = {}
+    try:
+        if 'segments' in scenarios:
+            print(f"⏱️  segments: {args.clients} viewers for {args.duration:.0f}s...", file=sys.stderr)
+            results['segments'] = bench_segments(app, args.clients, args.duration)
+        if 'overlays' in scenarios:
+            print(f"⏱️  overlays: {args.iterations} rounds, {args.library_size} stored...", file=sys.stderr)
+            results['overlays'] = bench_overlays(app, args.iterations, args.library_size)
+        if 'lifecycle' in scenarios:
+            print(f"⏱️  lifecycle: {args.lifecycle_iterations} start/restart/stop cycles...", file=sys.stderr)
+            results['lifecycle'] = bench_lifecycle(args.lifecycle_iterations)
+    finally:
+        stream_manager.stop_stream()
+        stream_registry.stop_all()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    report = {
+        'benchmark': 'backend_suite',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'fake_ffmpeg': {
+            'segment_bytes': int(os.environ['FAKE_FFMPEG_SEGMENT_BYTES']),
+            'speed': float(os.environ['FAKE_FFMPEG_SPEED'])
+        },
+        'results': results
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline_revision'] = baseline.get('revision')
+        report['regressions'] = compare(results, baseline['results'], args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    if report.get('regressions'):
+        print(f"✗ {len(report['regressions'])} metrics regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
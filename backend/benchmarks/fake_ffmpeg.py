@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Fake FFmpeg
+Stand-in for the ffmpeg binary that accepts the HLS command lines built by
+StreamManager and writes a synthetic live stream instead of transcoding
+one: a segment of random bytes every -hls_time seconds, a sliding playlist
+of -hls_list_size entries with program date times, -progress blocks on
+stdout and FFmpeg's "Opening ... for writing" log line per segment on
+stderr. Older segments are deleted as with delete_segments, and outputs that
+are URLs (ingest mode, -method PUT) are uploaded with HTTP PUT.
+
+Point the app at it with FFMPEG_BIN=benchmarks/fake_ffmpeg.py. Tuning:
+    FAKE_FFMPEG_SEGMENT_BYTES   size of each segment (default 65536)
+    FAKE_FFMPEG_SPEED           segments are written this many times faster than real time (default 1)
+    FAKE_FFMPEG_STARTUP_DELAY   seconds before the first segment, like probing the input (default 0)
+    FAKE_FFMPEG_EXIT_AFTER      exit with an error after this many segments, to exercise restarts
+
+Called with -show_entries it answers like ffprobe (FFPROBE_BIN), reporting
+FAKE_FFMPEG_VIDEO_CODEC (default h264) and FAKE_FFMPEG_AUDIO_CODEC (default
+aac, empty for none) tracks.
+
+Rendition ladders (-var_stream_map) are not simulated; only the first
+output playlist is written.
+"""
+
+import json
+import os
+import signal
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+
+def option(args, name, default=None):
+    """Value following the last occurrence of a command line option"""
+    value = default
+    for index, arg in enumerate(args[:-1]):
+        if arg == name:
+            value = args[index + 1]
+    return value
+
+
+class Output:
+    """Writes files to a directory, or uploads them when the output is a URL"""
+
+    def __init__(self, playlist_location):
+        self.location = os.path.dirname(playlist_location)
+        self.is_url = playlist_location.startswith(('http://', 'https://'))
+
+    def write(self, name, data):
+        if self.is_url:
+            request = urllib.request.Request(f'{self.location}/{name}', data=data, method='PUT')
+            urllib.request.urlopen(request, timeout=5).close()
+            return
+        path = os.path.join(self.location, name)
+        # Written next to the target and renamed, like -hls_flags temp_file
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{path}.tmp', path)
+
+    def delete(self, name):
+        if self.is_url:
+            request = urllib.request.Request(f'{self.location}/{name}', method='DELETE')
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except OSError:
+                pass
+            return
+        try:
+            os.remove(os.path.join(self.location, name))
+        except FileNotFoundError:
+            pass
+
+
+def render_playlist(segments, target, fmp4, init_name):
+    lines = [
+        '#EXTM3U',
+        f'#EXT-X-VERSION:{7 if fmp4 else 3}',
+        f'#EXT-X-TARGETDURATION:{max(int(target + 0.999), 1)}',
+        f'#EXT-X-MEDIA-SEQUENCE:{segments[0][0]}'
+    ]
+    if fmp4:
+        lines.append(f'#EXT-X-MAP:URI="{init_name}"')
+    for sequence, name, started in segments:
+        pdt = datetime.fromtimestamp(started, tz=timezone.utc).isoformat(timespec='milliseconds')
+        lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{pdt}')
+        lines.append(f'#EXTINF:{target:.6f},')
+        lines.append(name)
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def probe():
+    streams = [{'index': 0, 'codec_type': 'video', 'codec_name': os.getenv('FAKE_FFMPEG_VIDEO_CODEC', 'h264'),
+                'width': 1280, 'height': 720, 'pix_fmt': 'yuv420p'}]
+    if os.getenv('FAKE_FFMPEG_AUDIO_CODEC', 'aac'):
+        streams.append({'index': 1, 'codec_type': 'audio', 'codec_name': os.getenv('FAKE_FFMPEG_AUDIO_CODEC', 'aac'),
+                        'sample_rate': '48000', 'channels': 2})
+    print(json.dumps({'streams': streams}))
+    return 0
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args == ['-version']:
+        print('ffmpeg version fake (benchmarks/fake_ffmpeg.py)')
+        return 0
+    if '-show_entries' in args:
+        return probe()
+
+    segment_time = float(option(args, '-hls_time', 2))
+    list_size = int(option(args, '-hls_list_size', 5))
+    fmp4 = option(args, '-hls_segment_type') == 'fmp4'
+    playlist = args[-1]
+    pattern = os.path.basename(option(args, '-hls_segment_filename', 'stream%d.ts'))
+    init_name = option(args, '-hls_fmp4_init_filename', 'init.mp4')
+    progress = option(args, '-progress') == 'pipe:1'
+    segment_bytes = int(os.getenv('FAKE_FFMPEG_SEGMENT_BYTES', 65536))
+    speed = float(os.getenv('FAKE_FFMPEG_SPEED', 1))
+    exit_after = int(os.getenv('FAKE_FFMPEG_EXIT_AFTER', 0))
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    output = Output(playlist)
+    if not output.is_url:
+        os.makedirs(output.location, exist_ok=True)
+    time.sleep(float(os.getenv('FAKE_FFMPEG_STARTUP_DELAY', 0)))
+    if fmp4:
+        output.write(init_name, os.urandom(1024))
+
+    if option(args, '-hls_start_number_source') == 'epoch':
+        sequence = int(time.time())
+    else:
+        sequence = int(option(args, '-start_number', 0))
+    segments = []
+    started = time.time()
+    written = 0
+    while not stopping:
+        output.write(pattern.replace('%d', str(sequence)), os.urandom(segment_bytes))
+        # Logged like FFmpeg's HLS muxer, which rtsp_to_hls.py counts segments by
+        print(f"[hls @ fake] Opening '{pattern.replace('%d', str(sequence))}' for writing", file=sys.stderr, flush=True)
+        segments.append((sequence, pattern.replace('%d', str(sequence)), started + written * segment_time))
+        written += 1
+        sequence += 1
+        while len(segments) > list_size:
+            output.delete(segments.pop(0)[1])
+        output.write(os.path.basename(playlist), render_playlist(segments, segment_time, fmp4, init_name))
+
+        if progress:
+            elapsed = max(time.time() - started, 1e-6)
+            out_time = written * segment_time
+            print(
+                f'frame={int(out_time * 30)}\nfps={out_time * 30 / elapsed:.2f}\n'
+                f'bitrate={segment_bytes * 8 / segment_time / 1000:.1f}kbits/s\n'
+                f'out_time_us={int(out_time * 1e6)}\nspeed={out_time / elapsed:.3g}x\n'
+                f'drop_frames=0\ndup_frames=0\nprogress=continue',
+                flush=True
+            )
+        if exit_after and written >= exit_after:
+            print('Fake input stream ended', file=sys.stderr, flush=True)
+            return 1
+
+        deadline = started + written * segment_time / speed
+        while not stopping and time.time() < deadline:
+            time.sleep(min(0.01, max(deadline - time.time(), 0)))
+
+    if progress:
+        print('progress=end', flush=True)
+    # FFmpeg exits with 255 when interrupted by a signal
+    return 255
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+LL-HLS Latency Benchmark
+Compares live-edge latency of the regular HLS output and the LL-HLS mode
+using a synthetic FFmpeg testsrc source (no camera or RTSP server needed)
+
+Usage:
+    python3 benchmarks/llhls_latency.py [--duration 30] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The app reads its output directory at import time
+os.environ['HLS_OUTPUT_DIR'] = tempfile.mkdtemp(prefix='llhls-bench-')
+
+from config import Config  # noqa: E402
+from app import create_app  # noqa: E402
+from app.utils.dvr import parse_iso_time  # noqa: E402
+from app.utils.stream_manager import stream_manager  # noqa: E402
+
+PDT_PATTERN = re.compile(r'#EXT-X-PROGRAM-DATE-TIME:(\S+)')
+
+
+def start_test_source(port):
+    """Serve an FFmpeg test pattern as FLV over TCP, paced in real time (one client)"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-re',
+        '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=1000',
+        '-pix_fmt', 'yuv420p',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-g', '15',
+        '-c:a', 'aac',
+        '-f', 'flv', f'tcp://127.0.0.1:{port}?listen=1'
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def parse_entries(playlist):
+    """(program date time, duration, uri) of each entry of a regular HLS playlist"""
+    entries = []
+    pdt = None
+    duration = None
+    for line in playlist.splitlines():
+        match = PDT_PATTERN.match(line)
+        if match:
+            pdt = parse_iso_time(match.group(1)).timestamp()
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0])
+        elif line and not line.startswith('#') and duration is not None:
+            entries.append((pdt, duration, line))
+            pdt = pdt + duration if pdt is not None else None
+            duration = None
+    return entries
+
+
+def media_clock(anchor):
+    """
+    Map program date times to the wall time the source emitted that media
+
+    FFmpeg stamps the first segment when its muxer starts, after probing the
+    input, so absolute program date times run ahead of the source. Offsets
+    from the first segment are exact though, and the paced source emits
+    media time 0 when its process starts (the anchor).
+    """
+    first = {}
+
+    def emitted_at(pdt):
+        first.setdefault('pdt', pdt)
+        return anchor + (pdt - first['pdt'])
+    return emitted_at
+
+
+def measure_regular(client, duration, anchor):
+    """Poll the regular playlist and record how late each new segment appears"""
+    delays = []
+    seen = set()
+    target = 2
+    emitted_at = media_clock(anchor)
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        response = client.get('/stream.m3u8')
+        if response.status_code == 200:
+            for pdt, length, uri in parse_entries(response.get_data(as_text=True)):
+                if pdt is None:
+                    continue
+                end = emitted_at(pdt) + length
+                if uri in seen:
+                    continue
+                seen.add(uri)
+                delays.append(time.time() - end)
+        time.sleep(0.05)
+    # The first segments were already in the playlist when polling started
+    delays = delays[3:]
+    return {'availability_delays': delays, 'hold_back': 3 * target}
+
+
+def measure_low_latency(client, duration, anchor):
+    """Follow the live edge with blocking reloads and record how late each part appears"""
+    delays = []
+    emitted_at = media_clock(anchor)
+    deadline = time.time() + duration
+    next_msn = next_part = None
+    hold_back = None
+    while time.time() < deadline:
+        url = '/stream.m3u8'
+        if next_msn is not None:
+            url += f'?_HLS_msn={next_msn}&_HLS_part={next_part}'
+        response = client.get(url)
+        arrived = time.time()
+        if response.status_code != 200:
+            time.sleep(0.1)
+            continue
+        text = response.get_data(as_text=True)
+        hold_back = float(re.search(r'PART-HOLD-BACK=([\d.]+)', text).group(1))
+        last = None
+        segment_pdt = None
+        offset = 0.0
+        for line in text.splitlines():
+            match = PDT_PATTERN.match(line)
+            if match:
+                segment_pdt = emitted_at(parse_iso_time(match.group(1)).timestamp())
+                offset = 0.0
+            elif line.startswith('#EXT-X-PART:'):
+                part_duration = float(re.search(r'DURATION=([\d.]+)', line).group(1))
+                sequence = int(re.search(r'part(\d+)\.m4s', line).group(1))
+                offset += part_duration
+                last = (sequence, segment_pdt + offset if segment_pdt is not None else None)
+        if last is None:
+            time.sleep(0.1)
+            continue
+        if next_msn is not None and last[1] is not None:
+            delays.append(arrived - last[1])
+        next_msn, next_part = divmod(last[0] + 1, Config.LLHLS_PARTS_PER_SEGMENT)
+    return {'availability_delays': delays[2:], 'hold_back': hold_back}
+
+
+def summarize(name, result):
+    delays = result['availability_delays']
+    if not delays:
+        return {'mode': name, 'samples': 0}
+    mean_delay = statistics.mean(delays)
+    return {
+        'mode': name,
+        'samples': len(delays),
+        'availability_delay_mean': round(mean_delay, 3),
+        'availability_delay_max': round(max(delays), 3),
+        'player_hold_back': result['hold_back'],
+        # A player sits hold_back behind the live edge, which itself trails capture by the delay
+        'estimated_latency': round(mean_delay + (result['hold_back'] or 0), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30, help='seconds to measure each mode')
+    parser.add_argument('--port', type=int, default=5004, help='TCP port for the test source')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    source_url = f'tcp://127.0.0.1:{args.port}'
+    results = []
+    for name, options, measure in (
+        ('regular', {}, measure_regular),
+        ('low_latency', {'low_latency': True}, measure_low_latency),
+    ):
+        print(f"⏱️  Measuring {name} mode for {args.duration:.0f}s...", file=sys.stderr)
+        # -re paces the source from its own start, even while it waits for our connection
+        anchor = time.time()
+        source = start_test_source(args.port)
+        time.sleep(0.5)
+        try:
+            started = stream_manager.start_stream(source_url, options)
+            if started['status'] != 'success':
+                print(f"❌ {started['message']}", file=sys.stderr)
+                sys.exit(1)
+            # Let the encoder fill the playlist before measuring
+            time.sleep(6)
+            results.append(summarize(name, measure(client, args.duration, anchor)))
+        finally:
+            stream_manager.stop_stream()
+            source.terminate()
+            source.wait()
+
+    output = json.dumps({'benchmark': 'llhls_latency', 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
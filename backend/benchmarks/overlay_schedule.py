@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Overlay Schedule Benchmark
+Active-set queries over tens of thousands of scheduled overlays: the
+schedule index (app.utils.schedule_index) against a scan of every overlay,
+and GET /api/overlays/active through the Flask app (with an in-memory
+mongomock client standing in for MongoDB).
+
+The library mimics a day of show rundowns spread over --streams streams:
+most overlays have wall-clock windows of 10 seconds to 30 minutes, a
+quarter are stream-relative within the first 4 hours, a few are
+open-ended and a few have no window. A third are shown on every stream.
+
+Measures:
+    build       building the index from the overlay documents, which each
+                worker does after every overlay write (plus reading the
+                collection)
+    query       index and scan latency (p50/p99) at random times, with the
+                mean number of active overlays; the scan checks windows
+                converted to numbers beforehand, and every index answer is
+                checked against it
+    edits       query latency while overlays change: before each query the
+                index applies an overlay.updated event (a move, or every
+                tenth a new window), as it does for edits from any worker
+    endpoint    request latency with the index built, including JSON
+                serialization of the active overlays
+
+Needs mongomock (pip install mongomock).
+
+Usage:
+    python3 benchmarks/overlay_schedule.py [--overlays 50000] [--streams 20] [--queries 500] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+try:
+    import mongomock
+    import pymongo
+    from pymongo.errors import OperationFailure
+except ImportError:
+    sys.exit('The overlay schedule benchmark needs mongomock: pip install mongomock')
+
+WORKDIR = tempfile.mkdtemp(prefix='schedule-bench-')
+# The app reads these at import time
+os.environ.update({
+    'HLS_OUTPUT_DIR': os.path.join(WORKDIR, 'streams'),
+    'STREAM_STATE_DIR': os.path.join(WORKDIR, 'state'),
+    'MONGO_URI': 'mongodb://localhost:27017/schedule_bench'
+})
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+
+def _no_change_streams(self, *args, **kwargs):
+    raise OperationFailure('The $changeStream stage is only supported on replica sets')
+
+
+# In-memory stand-in for a standalone server
+mongomock.collection.Collection.watch = _no_change_streams
+pymongo.MongoClient = mongomock.MongoClient
+
+from bson import ObjectId  # noqa: E402
+from app import create_app  # noqa: E402
+from app.models.overlay import Overlay  # noqa: E402
+from app.utils.event_bus import Subscriber  # noqa: E402
+from app.utils.overlay_cache import overlay_cache  # noqa: E402
+from app.utils.schedule_index import (  # noqa: E402
+    INF, STREAM_CLOCK, ScheduleIndex, schedule_index, timestamp, window_clock
+)
+
+DAY_START = datetime(2030, 1, 1)
+DAY_SECONDS = 24 * 3600
+STREAM_SECONDS = 4 * 3600
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+def latency_summary(seconds):
+    """p50/p99/mean in milliseconds"""
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 4),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 4),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 4)
+    }
+
+
+def make_overlays(count, streams, rng):
+    """Overlay documents with a mix of wall-clock, stream-relative, open and missing windows"""
+    overlays = []
+    for index in range(count):
+        kind = rng.random()
+        if kind < 0.72:
+            start = DAY_START + timedelta(seconds=rng.uniform(0, DAY_SECONDS))
+            end = start + timedelta(seconds=rng.uniform(10, 1800))
+        elif kind < 0.97:
+            start = round(rng.uniform(0, STREAM_SECONDS), 3)
+            end = start + round(rng.uniform(10, 1800), 3)
+        elif kind < 0.99:
+            start = DAY_START + timedelta(seconds=rng.uniform(0, DAY_SECONDS))
+            end = None
+        else:
+            start = end = None
+        document = Overlay.build_document({
+            'type': 'text',
+            'content': f'Rundown item {index}',
+            'stream_id': None if rng.random() < 1 / 3 else f'cam{rng.randrange(streams)}',
+            'start_at': start,
+            'end_at': end
+        })
+        document['_id'] = str(ObjectId())
+        overlays.append(document)
+    return overlays
+
+
+def scan_entries(overlays):
+    """(stream_id, clock, start, end, overlay) per overlay with a valid window, in seconds"""
+    entries = []
+    for overlay in overlays:
+        start, end = overlay['start_at'], overlay['end_at']
+        clock = window_clock(start, end)
+        if clock is None:
+            continue
+        if clock != STREAM_CLOCK:
+            start = timestamp(start) if start is not None else None
+            end = timestamp(end) if end is not None else None
+        entries.append((overlay['stream_id'], clock, -INF if start is None else start,
+                        INF if end is None else end, overlay))
+    return entries
+
+
+def scan(entries, at, stream_id, offset):
+    """Active overlays by checking every window, as a query without the index would"""
+    scopes = {None} if stream_id is None else {stream_id, None}
+    found = []
+    for scope, clock, start, end, overlay in entries:
+        if scope in scopes:
+            point = offset if clock == STREAM_CLOCK else at
+            if start <= point < end:
+                found.append(overlay)
+    return found
+
+
+def random_query(streams, rng):
+    """(Unix time during the day, stream_id or None, stream offset)"""
+    at = timestamp(DAY_START) + rng.uniform(0, DAY_SECONDS)
+    stream_id = None if rng.random() < 0.2 else f'cam{rng.randrange(streams)}'
+    return at, stream_id, rng.uniform(0, STREAM_SECONDS)
+
+
+def bench_index(overlays, streams, queries, rng):
+    started = time.perf_counter()
+    index = ScheduleIndex()
+    index.load(overlays)
+    build_seconds = time.perf_counter() - started
+
+    entries = scan_entries(overlays)
+    index_samples, scan_samples, active = [], [], []
+    for _ in range(queries):
+        at, stream_id, offset = random_query(streams, rng)
+        started = time.perf_counter()
+        found = index.active(at, stream_id, offset)
+        index_samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        expected = scan(entries, at, stream_id, offset)
+        scan_samples.append(time.perf_counter() - started)
+        if sorted(overlay['_id'] for overlay in found) != sorted(overlay['_id'] for overlay in expected):
+            sys.exit(f'✗ Index and scan disagree at {at} (stream {stream_id}, offset {offset:.1f})')
+        active.append(len(found))
+
+    index_summary, scan_summary = latency_summary(index_samples), latency_summary(scan_samples)
+    return {
+        'build_ms': round(build_seconds * 1000, 1),
+        'mean_active': round(sum(active) / len(active), 1),
+        'index': index_summary,
+        'scan': scan_summary,
+        'speedup': round(scan_summary['mean_ms'] / index_summary['mean_ms'], 1)
+    }
+
+
+def bench_edits(overlays, streams, queries, rng):
+    index = ScheduleIndex()
+    # At the current version, so sync() only applies the events
+    index.load(overlays, overlay_cache.current_version(), Subscriber(queries + 1))
+    current = {overlay['_id']: overlay for overlay in overlays}
+    samples = []
+    for number in range(queries):
+        document = dict(current[rng.choice(overlays)['_id']])
+        if number % 10 == 0:
+            other = make_overlays(1, streams, rng)[0]
+            document.update(start_at=other['start_at'], end_at=other['end_at'])
+        else:
+            document['position'] = {'x': rng.uniform(0, 1280), 'y': rng.uniform(0, 720)}
+        current[document['_id']] = document
+        index.subscriber.deliver({'seq': number + 1, 'type': 'overlay.updated', 'data': document})
+        at, stream_id, offset = random_query(streams, rng)
+        started = time.perf_counter()
+        index.sync()
+        found = index.active(at, stream_id, offset)
+        samples.append(time.perf_counter() - started)
+
+    expected = scan(scan_entries(list(current.values())), at, stream_id, offset)
+    if sorted(overlay['_id'] for overlay in found) != sorted(overlay['_id'] for overlay in expected):
+        sys.exit('✗ Index and scan disagree after edits')
+    return {'edits': queries, 'windows_changed': len(index.stale), 'query': latency_summary(samples)}
+
+
+def bench_endpoint(overlays, streams, requests, rng):
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        # As synced at the current collection version: reading 50k documents
+        # from mongomock would only measure mongomock
+        schedule_index.load(overlays, overlay_cache.current_version())
+
+    samples = []
+    for _ in range(requests):
+        at, stream_id, offset = random_query(streams, rng)
+        query = f'at={at}&offset={offset}' + (f'&stream_id={stream_id}' if stream_id else '')
+        started = time.perf_counter()
+        response = client.get(f'/api/overlays/active?{query}')
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            sys.exit(f'✗ GET /api/overlays/active returned {response.status_code}')
+    return {'requests': latency_summary(samples)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', '-C', BACKEND_DIR, 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--overlays', type=int, default=50000, help='scheduled overlays in the library')
+    parser.add_argument('--streams', type=int, default=20, help='streams the overlays are spread over')
+    parser.add_argument('--queries', type=int, default=500, help='active-set queries against index and scan')
+    parser.add_argument('--requests', type=int, default=200, help='GET /api/overlays/active requests (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    overlays = make_overlays(args.overlays, args.streams, rng)
+    print(f"⏱️  {args.queries} queries over {args.overlays} overlays on {args.streams} streams...", file=sys.stderr)
+    results = {'query': bench_index(overlays, args.streams, args.queries, rng)}
+    results['edits'] = bench_edits(overlays, args.streams, args.queries, rng)
+    if args.requests:
+        print(f"⏱️  {args.requests} GET /api/overlays/active requests...", file=sys.stderr)
+        results['endpoint'] = bench_endpoint(overlays, args.streams, args.requests, rng)
+
+    report = {
+        'benchmark': 'overlay_schedule',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'overlays': args.overlays,
+        'streams': args.streams,
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
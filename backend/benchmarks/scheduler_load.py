@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Scheduler Load Test
+Runs several local agent processes (agent.py's StreamAgent) against one job
+queue, with benchmarks/fake_ffmpeg.py standing in for FFmpeg and in-memory
+mongomock clients standing in for MongoDB.
+
+Measures:
+    placement   time from submitting a job until an agent runs it, and how
+                many jobs stay queued because no agent has room
+    budget      the most CPU any agent had claimed (sampled), which must
+                never exceed its declared budget
+    rebalance   after one agent is killed (SIGKILL, no goodbye), time until
+                its jobs are queued again and until they run elsewhere
+
+Half of the jobs (--transcode-share) are low-latency streams, which always
+transcode and cost SCHEDULER_TRANSCODE_COST; the rest are copied.
+
+Needs mongomock (pip install mongomock).
+
+Usage:
+    python3 benchmarks/scheduler_load.py [--agents 4] [--cpu 3] [--jobs 12] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+try:
+    import mongomock
+    import pymongo
+except ImportError:
+    sys.exit('The scheduler load test needs mongomock: pip install mongomock')
+
+AGENT_MODE = '--agent' in sys.argv
+if not AGENT_MODE:
+    # Agents inherit these, so every process shares one state directory
+    WORKDIR = tempfile.mkdtemp(prefix='scheduler-bench-')
+    os.environ.update({
+        'HLS_OUTPUT_DIR': os.path.join(WORKDIR, 'streams'),
+        'STREAM_STATE_DIR': os.path.join(WORKDIR, 'state'),
+        'DVR_DIR': os.path.join(WORKDIR, 'dvr'),
+        'INGEST_DIR': os.path.join(WORKDIR, 'ingest'),
+        'FFMPEG_BIN': os.path.join(BACKEND_DIR, 'benchmarks', 'fake_ffmpeg.py'),
+        'FFPROBE_BIN': os.path.join(BACKEND_DIR, 'benchmarks', 'fake_ffmpeg.py'),
+        'FFMPEG_AUTO_RESTART': 'false',
+        'STREAM_SCHEDULER': 'true',
+        'MONGO_URI': 'mongodb://localhost:27017/scheduler_bench'
+    })
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ.setdefault('SCHEDULER_POLL_INTERVAL', '0.2')
+    os.environ.setdefault('SCHEDULER_AGENT_TIMEOUT', '2')
+    os.environ.setdefault('FAKE_FFMPEG_SEGMENT_BYTES', str(16 * 1024))
+
+
+def _create_collection(create_collection):
+    def create(self, name, **kwargs):
+        for option in ('capped', 'size', 'max'):
+            kwargs.pop(option, None)
+        return create_collection(self, name, **kwargs)
+    return create
+
+
+# Each process gets its own in-memory stand-in (only stream events are written)
+mongomock.database.Database.create_collection = _create_collection(mongomock.database.Database.create_collection)
+pymongo.MongoClient = mongomock.MongoClient
+
+from config import Config  # noqa: E402
+from app.utils.scheduler import StreamAgent, scheduler  # noqa: E402
+from app.utils.stream_manager import stream_registry  # noqa: E402
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+def seconds_summary(values):
+    """p50/p99/max in milliseconds"""
+    if not values:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1)
+    }
+
+
+def spawn_agent(agent_id, cpu):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--agent', agent_id, '--cpu', str(cpu)],
+        stdout=subprocess.DEVNULL
+    )
+
+
+def sample_load(peaks):
+    """Record each agent's claimed CPU; return the jobs by stream ID"""
+    overview = scheduler.overview()
+    for agent in overview['agents']:
+        peaks[agent['id']] = max(peaks.get(agent['id'], 0), agent['cpu_used'])
+    return {job['stream_id']: job for job in overview['jobs']}
+
+
+def has_room(job):
+    """Whether a live agent could claim this job now"""
+    overview = scheduler.overview()
+    return any(agent['alive'] and agent['cpu_budget'] - agent['cpu_used'] >= job['cost']
+               for agent in overview['agents'])
+
+
+def wait_until(condition, peaks, timeout):
+    """Seconds until condition(jobs) held, or None on timeout"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if condition(sample_load(peaks)):
+            return time.perf_counter() - started
+        time.sleep(0.02)
+    return None
+
+
+def run(args):
+    agents = {f'agent{index}': spawn_agent(f'agent{index}', args.cpu) for index in range(args.agents)}
+    peaks = {}
+    wait_until(lambda jobs: len(scheduler.live_agents()) == args.agents, peaks, 30)
+
+    # Placement: submit everything at once, then watch jobs get claimed
+    submitted = {}
+    transcoded = round(args.jobs * args.transcode_share)
+    for index in range(args.jobs):
+        stream_id = f'cam{index}'
+        options = {'low_latency': True} if index < transcoded else {}
+        result = scheduler.submit(stream_id, f'rtsp://bench.invalid/{stream_id}', options)
+        if result['status'] == 'success':
+            submitted[stream_id] = time.perf_counter()
+
+    placed = {}
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        jobs = sample_load(peaks)
+        for stream_id, job in jobs.items():
+            if job['status'] == 'running' and stream_id not in placed:
+                placed[stream_id] = time.perf_counter() - submitted[stream_id]
+        if all(job['status'] != 'starting' for job in jobs.values()) and placed and \
+                time.perf_counter() - submitted[max(submitted, key=submitted.get)] > 4 * Config.SCHEDULER_POLL_INTERVAL:
+            break
+        time.sleep(0.02)
+    jobs = sample_load(peaks)
+    placement = {
+        'submitted': len(submitted),
+        'rejected': args.jobs - len(submitted),
+        'running': sum(1 for job in jobs.values() if job['status'] == 'running'),
+        'queued': sum(1 for job in jobs.values() if job['status'] == 'queued'),
+        'failed': sum(1 for job in jobs.values() if job['status'] == 'failed'),
+        'seconds': seconds_summary(list(placed.values()))
+    }
+
+    # Rebalance: kill the busiest agent without letting it hand its jobs back
+    victim = max(agents, key=lambda agent_id: sum(1 for job in jobs.values() if job['agent'] == agent_id))
+    orphaned = [stream_id for stream_id, job in jobs.items() if job['agent'] == victim]
+    agents.pop(victim).kill()
+    killed_at = time.perf_counter()
+    requeued = wait_until(lambda jobs: all(jobs[stream_id]['agent'] != victim for stream_id in orphaned),
+                          peaks, args.timeout)
+    # Settled once every orphan runs again, or waits because no surviving agent has room for it
+    settled = wait_until(lambda jobs: all(jobs[stream_id]['status'] == 'running' or
+                                          (jobs[stream_id]['status'] == 'queued' and not has_room(jobs[stream_id]))
+                                          for stream_id in orphaned),
+                         peaks, args.timeout)
+    settled_seconds = time.perf_counter() - killed_at if settled is not None else None
+    jobs = sample_load(peaks)
+    rebalance = {
+        'agent_timeout_seconds': Config.SCHEDULER_AGENT_TIMEOUT,
+        'orphaned_jobs': len(orphaned),
+        'requeued_seconds': round(requeued, 3) if requeued is not None else None,
+        'settled_seconds': round(settled_seconds, 3) if settled_seconds is not None else None,
+        'replaced': sum(1 for stream_id in orphaned if jobs[stream_id]['status'] == 'running'),
+        'still_queued': sum(1 for stream_id in orphaned if jobs[stream_id]['status'] == 'queued')
+    }
+
+    for process in agents.values():
+        process.send_signal(signal.SIGTERM)
+    for process in agents.values():
+        process.wait(timeout=30)
+    budget = {
+        'cpu_per_agent': args.cpu,
+        'peak_cpu_used': {agent_id: round(peak, 2) for agent_id, peak in sorted(peaks.items())},
+        'exceeded': any(peak > args.cpu + 1e-9 for peak in peaks.values())
+    }
+    return {'placement': placement, 'budget': budget, 'rebalance': rebalance}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', '-C', BACKEND_DIR, 'describe', '--always', '--dirty'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agent', help=argparse.SUPPRESS)
+    parser.add_argument('--agents', type=int, default=4, help='agent processes to run')
+    parser.add_argument('--cpu', type=float, default=3, help='CPU budget of each agent')
+    parser.add_argument('--jobs', type=int, default=12, help='streams to submit')
+    parser.add_argument('--transcode-share', type=float, default=0.5, help='share of streams that transcode')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for each phase')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    if args.agent:
+        StreamAgent(args.cpu, args.agent).run()
+        return
+
+    print(f"⏱️  {args.jobs} jobs on {args.agents} agents with {args.cpu:g} CPU cores each...", file=sys.stderr)
+    try:
+        results = run(args)
+    finally:
+        # Streams of the killed agent are still running
+        stream_registry.stop_all()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    report = {
+        'benchmark': 'scheduler_load',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'settings': {
+            'agents': args.agents,
+            'jobs': args.jobs,
+            'transcode_share': args.transcode_share,
+            'poll_interval': Config.SCHEDULER_POLL_INTERVAL,
+            'copy_cost': Config.SCHEDULER_COPY_COST,
+            'transcode_cost': Config.SCHEDULER_TRANSCODE_COST
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    if results['budget']['exceeded']:
+        print("✗ An agent claimed more CPU than its budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
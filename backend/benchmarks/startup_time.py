@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Startup Time Benchmark
+Measures a worker's cold start: interpreter start to create_app() returning
+and the first HLS segment served, in fresh processes. With --baseline-ref
+the same measurement runs on another git revision (checked out in a
+temporary worktree) to show the difference.
+
+MongoDB does not need to be running; workers that only serve HLS should
+not wait for it.
+
+Usage:
+    python3 benchmarks/startup_time.py [--runs 10] [--baseline-ref HEAD~1] [--output startup.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+
+# Runs in the measured process; prints its timings as JSON
+PROBE = '''
+import json, sys, time
+launched = float(sys.argv[1])
+started = time.time()
+from app import create_app
+imported = time.time()
+app = create_app()
+created = time.time()
+response = app.test_client().get('/stream1.ts')
+served = time.time()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'interpreter_seconds': started - launched,
+    'import_seconds': imported - started,
+    'create_app_seconds': created - imported,
+    'first_segment_seconds': served - created,
+    'ready_seconds': served - launched
+}))
+'''
+
+
+def measure(backend_dir, runs, env):
+    samples = []
+    for _ in range(runs):
+        launched = time.time()
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, repr(launched)],
+            cwd=backend_dir, env=env, capture_output=True, text=True, timeout=120
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'probe failed')
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {key: round(statistics.median(sample[key] for sample in samples), 4) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per revision (medians are reported)')
+    parser.add_argument('--baseline-ref', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('--mongo-uri', default='mongodb://127.0.0.1:27017/startup_bench')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='startup-bench-')
+    streams = os.path.join(workdir, 'streams')
+    os.makedirs(streams)
+    with open(os.path.join(streams, 'stream1.ts'), 'wb') as f:
+        f.write(os.urandom(256 * 1024))
+    env = dict(os.environ, HLS_OUTPUT_DIR=streams, STREAM_STATE_DIR=os.path.join(workdir, 'state'),
+               MONGO_URI=args.mongo_uri)
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+    results = []
+    worktree = None
+    try:
+        print(f"⏱️  Measuring the working tree ({args.runs} runs)...", file=sys.stderr)
+        results.append({'revision': 'working tree', **measure(BACKEND_DIR, args.runs, env)})
+        if args.baseline_ref:
+            worktree = os.path.join(workdir, 'baseline')
+            subprocess.run(['git', '-C', REPO_DIR, 'worktree', 'add', '--detach', worktree, args.baseline_ref],
+                           check=True, capture_output=True)
+            print(f"⏱️  Measuring {args.baseline_ref} ({args.runs} runs)...", file=sys.stderr)
+            results.append({'revision': args.baseline_ref,
+                            **measure(os.path.join(worktree, 'backend'), args.runs, env)})
+    finally:
+        if worktree is not None:
+            subprocess.run(['git', '-C', REPO_DIR, 'worktree', 'remove', '--force', worktree], capture_output=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'benchmark': 'startup_time', 'runs': args.runs, 'results': results}
+    if len(results) == 2:
+        current, baseline = results
+        report['ready_seconds_saved'] = round(baseline['ready_seconds'] - current['ready_seconds'], 4)
+        report['ready_reduction_percent'] = round(100 * report['ready_seconds_saved'] / baseline['ready_seconds'], 1)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Viewer Capacity Benchmark
+Compares how many concurrent viewers the sync (gunicorn gthread) and async
+(uvicorn worker, asgi.py) serving modes keep up with
+
+A simulated encoder writes an LL-HLS stream (one part every
+LLHLS_PART_DURATION seconds) next to a regular stream of static segments,
+so no FFmpeg or camera is needed. Each viewer is paced like a player:
+regular viewers fetch the playlist and a segment every 2 seconds, LL-HLS
+viewers follow the live edge with blocking playlist reloads and fetch every
+new part. A level is kept up with when segment fetches stay under
+--max-latency at p99, blocking reloads return within one part duration of
+the part being written at p99, and under 1% of requests fail.
+
+Usage:
+    python3 benchmarks/viewer_capacity.py [--levels 50,100,200,400,800] [--duration 15] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from config import Config  # noqa: E402
+
+LL_STREAM = 'llbench'
+SEGMENT_SIZE = 256 * 1024
+PART_SIZE = 48 * 1024
+PART_URI_PATTERN = re.compile(r'URI="part(\d+)\.m4s"')
+
+
+class SimulatedEncoder:
+    """Writes LL-HLS parts and the source playlist the way FFmpeg does in low-latency mode"""
+
+    def __init__(self, directory, part_duration):
+        self.directory = directory
+        self.part_duration = part_duration
+        self.written_at = {}
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'init.mp4'), 'wb') as f:
+            f.write(os.urandom(1024))
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        keep = Config.LLHLS_PARTS_PER_SEGMENT * 6
+        sequence = 0
+        started = time.time()
+        while not self._stop.is_set():
+            path = os.path.join(self.directory, f'part{sequence}.m4s')
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(os.urandom(PART_SIZE))
+            os.replace(f'{path}.tmp', path)
+            first = max(sequence - keep + 1, 0)
+            lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:1', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+            for number in range(first, sequence + 1):
+                pdt = datetime.fromtimestamp(started + number * self.part_duration, tz=timezone.utc)
+                lines += [f'#EXT-X-PROGRAM-DATE-TIME:{pdt.isoformat()}', f'#EXTINF:{self.part_duration:.3f},', f'part{number}.m4s']
+            playlist = os.path.join(self.directory, 'll_source.m3u8')
+            with open(f'{playlist}.tmp', 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(f'{playlist}.tmp', playlist)
+            self.written_at[sequence] = time.time()
+            if first > 0:
+                try:
+                    os.remove(os.path.join(self.directory, f'part{first - 1}.m4s'))
+                except FileNotFoundError:
+                    pass
+            sequence += 1
+            self._stop.wait(started + sequence * self.part_duration - time.time())
+
+
+def write_regular_stream(directory, count=10):
+    """Static regular HLS stream: segments never change, so only serving is measured"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:100']
+    for number in range(100, 100 + count):
+        with open(os.path.join(directory, f'stream{number}.ts'), 'wb') as f:
+            f.write(os.urandom(SEGMENT_SIZE))
+        lines += ['#EXTINF:2.000,', f'stream{number}.ts']
+    with open(os.path.join(directory, 'stream.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+class HttpConnection:
+    """Minimal keep-alive HTTP/1.1 client, so the benchmark needs no extra packages"""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path, timeout):
+        for attempt in range(2):
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+                self.writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+                return await asyncio.wait_for(self._read_response(), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self):
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).strip(), 16)
+                body += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            body = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Results:
+    def __init__(self):
+        self.segment_latencies = []
+        self.reload_lateness = []
+        self.requests = 0
+        self.errors = 0
+
+
+async def regular_viewer(port, deadline, results, timeout):
+    connection = HttpConnection(port)
+    number = 100
+    while time.time() < deadline:
+        period_start = time.time()
+        try:
+            for path in ('/stream.m3u8', f'/stream{number}.ts'):
+                started = time.time()
+                status, _ = await connection.get(path, timeout)
+                results.requests += 1
+                if status != 200:
+                    results.errors += 1
+                elif path.endswith('.ts'):
+                    results.segment_latencies.append(time.time() - started)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            results.requests += 1
+            results.errors += 1
+            connection.close()
+        number = 100 + (number - 99) % 10
+        await asyncio.sleep(max(2 - (time.time() - period_start), 0))
+    connection.close()
+
+
+async def low_latency_viewer(port, deadline, results, encoder, timeout):
+    connection = HttpConnection(port)
+    base = f'/streams/{LL_STREAM}'
+    next_part = None
+    while time.time() < deadline:
+        try:
+            if next_part is None:
+                path = f'{base}/stream.m3u8'
+            else:
+                msn, part = divmod(next_part, Config.LLHLS_PARTS_PER_SEGMENT)
+                path = f'{base}/stream.m3u8?_HLS_msn={msn}&_HLS_part={part}'
+            status, body = await connection.get(path, timeout)
+            arrived = time.time()
+            results.requests += 1
+            if status != 200:
+                results.errors += 1
+                await asyncio.sleep(0.1)
+                continue
+            parts = [int(number) for number in PART_URI_PATTERN.findall(body.decode())]
+            if not parts:
+                await asyncio.sleep(0.1)
+                continue
+            if next_part is not None and next_part in encoder.written_at:
+                results.reload_lateness.append(arrived - encoder.written_at[next_part])
+            status, _ = await connection.get(f'{base}/part{parts[-1]}.m4s', timeout)
+            results.requests += 1
+            if status != 200:
+                results.errors += 1
+            next_part = parts[-1] + 1
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            results.requests += 1
+            results.errors += 1
+            connection.close()
+            next_part = None
+    connection.close()
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * share), len(ordered) - 1)], 4)
+
+
+async def run_level(port, viewers, ll_share, duration, encoder, timeout):
+    results = Results()
+    deadline = time.time() + duration
+    ll_viewers = int(viewers * ll_share)
+    tasks = [low_latency_viewer(port, deadline, results, encoder, timeout) for _ in range(ll_viewers)]
+    tasks += [regular_viewer(port, deadline, results, timeout) for _ in range(viewers - ll_viewers)]
+    await asyncio.gather(*tasks)
+    return results
+
+
+def start_server(mode, port, env, workers, threads):
+    if mode == 'sync':
+        cmd = ['gunicorn', 'run:app', '--worker-class', 'gthread', '--threads', str(threads)]
+    else:
+        cmd = ['gunicorn', 'asgi:app', '--worker-class', 'uvicorn.workers.UvicornWorker']
+    cmd += ['-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+            '--timeout', '120', '--log-level', 'warning']
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+async def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = HttpConnection(port)
+            status, _ = await connection.get('/stream.m3u8', 2)
+            connection.close()
+            if status == 200:
+                return
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.3)
+    raise RuntimeError('server did not start')
+
+
+def summarize(mode, viewers, results, duration, max_latency, part_duration):
+    error_rate = results.errors / results.requests if results.requests else 1
+    segment_p99 = percentile(results.segment_latencies, 0.99)
+    reload_p99 = percentile(results.reload_lateness, 0.99)
+    kept_up = (
+        error_rate < 0.01
+        and (segment_p99 is None or segment_p99 <= max_latency)
+        and (reload_p99 is None or reload_p99 <= part_duration)
+    )
+    return {
+        'mode': mode,
+        'viewers': viewers,
+        'requests_per_second': round(results.requests / duration, 1),
+        'error_rate': round(error_rate, 4),
+        'segment_latency_p50': percentile(results.segment_latencies, 0.5),
+        'segment_latency_p99': segment_p99,
+        'reload_lateness_p50': percentile(results.reload_lateness, 0.5),
+        'reload_lateness_p99': reload_p99,
+        'kept_up': kept_up
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='50,100,200,400,800', help='comma separated viewer counts')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per level')
+    parser.add_argument('--ll-share', type=float, default=0.5, help='share of viewers using LL-HLS blocking reloads')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers in both modes')
+    parser.add_argument('--threads', type=int, default=32, help='threads per sync worker')
+    parser.add_argument('--max-latency', type=float, default=1.0, help='p99 segment latency a level may reach')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--port', type=int, default=5010)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(',')]
+    part_duration = Config.LLHLS_PART_DURATION
+    workdir = tempfile.mkdtemp(prefix='viewer-bench-')
+    output_dir = os.path.join(workdir, 'streams')
+    os.makedirs(output_dir)
+    write_regular_stream(output_dir)
+    encoder = SimulatedEncoder(os.path.join(output_dir, LL_STREAM), part_duration)
+    encoder.start()
+
+    env = dict(os.environ, HLS_OUTPUT_DIR=output_dir, STREAM_STATE_DIR=os.path.join(workdir, 'state'),
+               PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'))
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            server = start_server(mode, args.port, env, args.workers, args.threads)
+            try:
+                asyncio.run(wait_until_up(args.port))
+                for viewers in levels:
+                    print(f"⏱️  {mode}: {viewers} viewers for {args.duration:.0f}s...", file=sys.stderr)
+                    level = asyncio.run(run_level(args.port, viewers, args.ll_share, args.duration, encoder,
+                                                  timeout=10 * args.max_latency))
+                    results.append(summarize(mode, viewers, level, args.duration, args.max_latency, part_duration))
+            finally:
+                os.killpg(server.pid, signal.SIGTERM)
+                server.wait()
+    finally:
+        encoder.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    capacity = {}
+    for mode in args.modes.split(','):
+        kept_up = [result['viewers'] for result in results if result['mode'] == mode and result['kept_up']]
+        capacity[mode] = max(kept_up) if kept_up else 0
+    output = json.dumps({
+        'benchmark': 'viewer_capacity',
+        'workers': args.workers,
+        'll_share': args.ll_share,
+        'capacity': capacity,
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
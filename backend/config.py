@@ -11,4 +11,101 @@ class Config:
     HOST = os.getenv('HOST', '0.0.0.0')
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:5173').split(',')
     HLS_OUTPUT_DIR = os.getenv('HLS_OUTPUT_DIR', './streams')
-    RTSP_TIMEOUT = int(os.getenv('RTSP_TIMEOUT', 30))
\ No newline at end of file
+    RTSP_TIMEOUT = int(os.getenv('RTSP_TIMEOUT', 30))
+    # Shared PID registry and lock files, must be visible to every worker
+    STREAM_STATE_DIR = os.getenv('STREAM_STATE_DIR', os.path.join(HLS_OUTPUT_DIR, '.state'))
+    MAX_STREAMS = int(os.getenv('MAX_STREAMS', 0))  # 0 = unlimited
+    SEGMENT_CACHE_POLL_INTERVAL = float(os.getenv('SEGMENT_CACHE_POLL_INTERVAL', 0.25))
+    SEGMENT_CACHE_MAX_BYTES = int(os.getenv('SEGMENT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    HLS_PLAYLIST_MAX_AGE = int(os.getenv('HLS_PLAYLIST_MAX_AGE', 1))
+    HLS_SEGMENT_MAX_AGE = int(os.getenv('HLS_SEGMENT_MAX_AGE', 31536000))
+    LLHLS_PART_DURATION = float(os.getenv('LLHLS_PART_DURATION', 0.5))
+    LLHLS_PARTS_PER_SEGMENT = int(os.getenv('LLHLS_PARTS_PER_SEGMENT', 4))
+    # Named rendition ladders, selectable per stream with "ladder" in the start request
+    ABR_LADDERS = os.getenv('ABR_LADDERS', 'default=1080p,720p,360p;mobile=720p,360p;full=1080p,720p,480p,360p,240p')
+    # Server-side overlay burn-in: drawtext slots and the editor canvas overlay positions refer to
+    BURN_IN_TEXT_SLOTS = int(os.getenv('BURN_IN_TEXT_SLOTS', 16))
+    BURN_IN_CANVAS_WIDTH = int(os.getenv('BURN_IN_CANVAS_WIDTH', 1280))
+    BURN_IN_CANVAS_HEIGHT = int(os.getenv('BURN_IN_CANVAS_HEIGHT', 720))
+    # How stale a worker's overlay list may get when no change stream is available (seconds)
+    OVERLAY_VERSION_CHECK_INTERVAL = float(os.getenv('OVERLAY_VERSION_CHECK_INTERVAL', 1.0))
+    # Overlay moves and resizes are buffered per worker and written every OVERLAY_FLUSH_INTERVAL seconds
+    OVERLAY_WRITE_BEHIND = os.getenv('OVERLAY_WRITE_BEHIND', 'true').lower() == 'true'
+    OVERLAY_FLUSH_INTERVAL = float(os.getenv('OVERLAY_FLUSH_INTERVAL', 0.25))
+    # Paginated overlay listings: default and largest page size
+    OVERLAY_PAGE_SIZE = int(os.getenv('OVERLAY_PAGE_SIZE', 100))
+    OVERLAY_MAX_PAGE_SIZE = int(os.getenv('OVERLAY_MAX_PAGE_SIZE', 1000))
+    # Scheduled overlays: how often a worker at most rebuilds its schedule index while overlays change (seconds)
+    SCHEDULE_REBUILD_INTERVAL = float(os.getenv('SCHEDULE_REBUILD_INTERVAL', 10))
+    # Image overlay proxy: fetched originals and scaled copies on disk, least recently used deleted first
+    IMAGE_PROXY_DIR = os.getenv('IMAGE_PROXY_DIR', os.path.join(HLS_OUTPUT_DIR, '.images'))
+    IMAGE_PROXY_MAX_BYTES = int(os.getenv('IMAGE_PROXY_MAX_BYTES', 256 * 1024 * 1024))
+    IMAGE_PROXY_MAX_SOURCE_BYTES = int(os.getenv('IMAGE_PROXY_MAX_SOURCE_BYTES', 20 * 1024 * 1024))
+    IMAGE_PROXY_TIMEOUT = float(os.getenv('IMAGE_PROXY_TIMEOUT', 10))
+    IMAGE_PROXY_REFRESH_INTERVAL = float(os.getenv('IMAGE_PROXY_REFRESH_INTERVAL', 10))
+    # Hosts and networks the image proxy may fetch from although they are private (e.g. localhost,10.0.0.0/8)
+    IMAGE_PROXY_ALLOWED_HOSTS = [host.strip() for host in os.getenv('IMAGE_PROXY_ALLOWED_HOSTS', '').split(',') if host.strip()]
+    # Push events: capped collection size and SSE connection tuning
+    EVENT_BUS_MAX_BYTES = int(os.getenv('EVENT_BUS_MAX_BYTES', 4 * 1024 * 1024))
+    EVENT_BUS_MAX_EVENTS = int(os.getenv('EVENT_BUS_MAX_EVENTS', 5000))
+    SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', 15))
+    SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 3000))
+    # FFmpeg executable (benchmarks run a stand-in, benchmarks/fake_ffmpeg.py)
+    FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+    # Stream scheduler: the web tier queues stream jobs, agent processes (agent.py) run them within a CPU budget
+    STREAM_SCHEDULER = os.getenv('STREAM_SCHEDULER', 'false').lower() == 'true'
+    SCHEDULER_POLL_INTERVAL = float(os.getenv('SCHEDULER_POLL_INTERVAL', 1))
+    SCHEDULER_AGENT_TIMEOUT = float(os.getenv('SCHEDULER_AGENT_TIMEOUT', 10))  # silence after which an agent's jobs move
+    SCHEDULER_MAX_QUEUED = int(os.getenv('SCHEDULER_MAX_QUEUED', 100))
+    SCHEDULER_AGENT_CPU = float(os.getenv('SCHEDULER_AGENT_CPU', os.cpu_count() or 1))
+    SCHEDULER_COPY_COST = float(os.getenv('SCHEDULER_COPY_COST', 0.1))  # CPU cores per stream copied
+    SCHEDULER_TRANSCODE_COST = float(os.getenv('SCHEDULER_TRANSCODE_COST', 1.0))  # per 1080p encode
+    # Source probing: copy tracks players can take instead of transcoding them
+    PROBE_SOURCES = os.getenv('PROBE_SOURCES', 'true').lower() == 'true'
+    FFPROBE_BIN = os.getenv('FFPROBE_BIN', 'ffprobe')
+    PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 10))
+    PROBE_CACHE_TTL = float(os.getenv('PROBE_CACHE_TTL', 300))
+    # FFmpeg supervision: restart crashed processes with exponential backoff
+    FFMPEG_AUTO_RESTART = os.getenv('FFMPEG_AUTO_RESTART', 'true').lower() == 'true'
+    FFMPEG_RESTART_BASE_DELAY = float(os.getenv('FFMPEG_RESTART_BASE_DELAY', 1))
+    FFMPEG_RESTART_MAX_DELAY = float(os.getenv('FFMPEG_RESTART_MAX_DELAY', 60))
+    FFMPEG_STABLE_SECONDS = float(os.getenv('FFMPEG_STABLE_SECONDS', 30))  # a run this long resets the backoff
+    FFMPEG_PROGRESS_INTERVAL = float(os.getenv('FFMPEG_PROGRESS_INTERVAL', 2))
+    FFMPEG_LOG_LINES = int(os.getenv('FFMPEG_LOG_LINES', 200))
+    FFMPEG_STATUS_LOG_LINES = int(os.getenv('FFMPEG_STATUS_LOG_LINES', 20))
+    # Viewers are clients that fetched a segment within VIEWER_WINDOW seconds
+    VIEWER_WINDOW = float(os.getenv('VIEWER_WINDOW', 30))
+    VIEWER_FLUSH_INTERVAL = float(os.getenv('VIEWER_FLUSH_INTERVAL', 5))
+    MONGO_HEALTH_TIMEOUT = float(os.getenv('MONGO_HEALTH_TIMEOUT', 2))
+    # HTTP ingest: FFmpeg uploads to INGEST_BASE_URL, files are kept on a tmpfs
+    INGEST_BASE_URL = os.getenv('INGEST_BASE_URL', f'http://127.0.0.1:{PORT}')
+    INGEST_DIR = os.getenv('INGEST_DIR', '/dev/shm/streamoverlay-ingest' if os.path.isdir('/dev/shm') else os.path.join(HLS_OUTPUT_DIR, '.ingest'))
+    INGEST_MAX_SEGMENTS = int(os.getenv('INGEST_MAX_SEGMENTS', 30))
+    INGEST_MAX_STREAM_BYTES = int(os.getenv('INGEST_MAX_STREAM_BYTES', 128 * 1024 * 1024))
+    INGEST_MAX_UPLOAD_BYTES = int(os.getenv('INGEST_MAX_UPLOAD_BYTES', 32 * 1024 * 1024))
+    # DVR: segments kept beyond the live window for rewind, per stream
+    DVR_DIR = os.getenv('DVR_DIR', os.path.join(HLS_OUTPUT_DIR, '.dvr'))
+    DVR_MAX_AGE = float(os.getenv('DVR_MAX_AGE', 2 * 3600))
+    DVR_MAX_BYTES = int(os.getenv('DVR_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+    DVR_POLL_INTERVAL = float(os.getenv('DVR_POLL_INTERVAL', 1))
+    # Stream thumbnails: how often a stream's thumbnail is refreshed, frame cache size and sprite sheet layout
+    THUMBNAIL_INTERVAL = float(os.getenv('THUMBNAIL_INTERVAL', 10))
+    THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', 320))
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    THUMBNAIL_TIMEOUT = float(os.getenv('THUMBNAIL_TIMEOUT', 10))
+    THUMBNAIL_SPRITE_WIDTH = int(os.getenv('THUMBNAIL_SPRITE_WIDTH', 160))
+    THUMBNAIL_SPRITE_COLUMNS = int(os.getenv('THUMBNAIL_SPRITE_COLUMNS', 10))
+    THUMBNAIL_SPRITE_MAX_TILES = int(os.getenv('THUMBNAIL_SPRITE_MAX_TILES', 100))
+    # Runtime profiler: admin endpoints need this bearer token (unset disables them)
+    PROFILER_TOKEN = os.getenv('PROFILER_TOKEN', '')
+    PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+    PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 300))
+    # Async serving mode (asgi.py): threads running the Flask routes it doesn't serve itself
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+    # MongoDB client pool and timeouts (the client is created lazily in each worker)
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+    MONGO_HEALTH_INTERVAL = float(os.getenv('MONGO_HEALTH_INTERVAL', 10))
@@ -0,0 +1,33 @@
+"""
+Gunicorn configuration
+
+Prepares prometheus_client's multiprocess mode so /metrics on any worker
+reports totals over all workers. Worker count and class are set in the
+Procfile.
+"""
+
+import os
+import shutil
+import tempfile
+
+# Set before the workers import prometheus_client
+multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'streamoverlay-metrics')
+)
+
+
+def on_starting(server):
+    # Metrics files of a previous run would be added to this one's
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Moves and resizes still buffered in the stopping worker
+    from app.utils.write_buffer import overlay_write_buffer
+    overlay_write_buffer.flush()
@@ -64,7 +64,7 @@ export function OverlayItem({
       const config = overlay.config as ImageOverlayConfig;
       return (
         <img
-          src={config.imageUrl}
+          src={config.proxyUrl ?? config.imageUrl}
           alt="Overlay"
           className="w-full h-full object-contain"
           draggable={false}
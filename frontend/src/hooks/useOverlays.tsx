@@ -2,12 +2,40 @@ import { useState, useCallback, useEffect, useRef } from 'react';
 import type { Overlay, OverlayPosition, OverlaySize, OverlayFormData, TextOverlayConfig, ImageOverlayConfig } from '@/types/overlay';
 import { v4 as uuidv4 } from 'uuid';
 import { toast } from 'sonner';
+import { subscribeEvents } from '@/lib/events';
 
 const API_BASE = import.meta.env.VITE_API_BASE || 'http://localhost:3001/api';
+// Proxied overlay images are scaled for the screen density (the API accepts 1-3)
+const PIXEL_RATIO = Math.min(3, Math.max(1, Math.round(window.devicePixelRatio || 1)));
 
 // Demo overlays for initial state
 const demoOverlays: Overlay[] = [];
 
+// Map an overlay document from the API (Mongo _id, content/style fields) to the editor shape
+function fromServer(doc: any): Overlay {
+  const style = doc.style || {};
+  return {
+    id: doc.id ?? doc._id,
+    type: doc.type,
+    position: doc.position,
+    size: doc.size,
+    config: doc.config ?? (doc.type === 'text'
+      ? {
+          text: doc.content,
+          fontSize: style.fontSize ?? 24,
+          fontFamily: style.fontFamily ?? 'Arial',
+          color: style.color ?? '#ffffff',
+        }
+      : {
+          imageUrl: doc.content,
+          // Redirects to the image scaled to this size; the size makes resized overlays refetch
+          proxyUrl: `${API_BASE}/overlays/${doc.id ?? doc._id}/image?v=${doc.size?.width}x${doc.size?.height}&dpr=${PIXEL_RATIO}`,
+        }),
+    zIndex: doc.zIndex ?? 1,
+    opacity: doc.opacity ?? style.opacity ?? 1,
+  };
+}
+
 export function useOverlays() {
   const [overlays, setOverlays] = useState<Overlay[]>(demoOverlays);
   const [selectedOverlayId, setSelectedOverlayId] = useState<string | null>(null);
@@ -21,8 +49,9 @@ export function useOverlays() {
       const response = await fetch(`${API_BASE}/overlays`);
       if (response.ok) {
         const data = await response.json();
-        if (Array.isArray(data)) {
-          setOverlays(data);
+        const list = Array.isArray(data) ? data : data.data;
+        if (Array.isArray(list)) {
+          setOverlays(list.map(fromServer));
         }
       }
     } catch (error) {
@@ -36,6 +65,29 @@ export function useOverlays() {
     fetchOverlays();
   }, [fetchOverlays]);
 
+  // Apply changes pushed by the server (made by this or any other operator)
+  useEffect(() => {
+    return subscribeEvents(['overlay.created', 'overlay.updated', 'overlay.deleted'], (data, type) => {
+      const id = data.id ?? data._id;
+      if (type === 'overlay.deleted') {
+        setOverlays(prev => prev.filter(o => o.id !== id));
+        return;
+      }
+      const overlay = fromServer(data);
+      setOverlays(prev => prev.some(o => o.id === id)
+        ? prev.map(o => o.id === id
+            ? {
+                ...o,
+                position: overlay.position,
+                size: overlay.size,
+                // Server documents without content or config leave the editor config alone
+                config: data.config || data.content !== undefined ? overlay.config : o.config,
+              }
+            : o)
+        : [...prev, overlay]);
+    });
+  }, []);
+
   // Add new overlay
   const addOverlay = useCallback(async (formData: OverlayFormData) => {
     const newOverlay: Overlay = {
@@ -54,11 +106,21 @@ export function useOverlays() {
     setSelectedOverlayId(newOverlay.id);
 
     try {
-      await fetch(`${API_BASE}/overlays`, {
+      const response = await fetch(`${API_BASE}/overlays`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(newOverlay),
       });
+      const data = await response.json();
+      const serverId = data.data?._id;
+      if (serverId) {
+        // Adopt the server id; the pushed overlay.created event may already have added it
+        setOverlays(prev => prev
+          .filter(o => o.id !== serverId)
+          .map(o => o.id === newOverlay.id ? { ...o, id: serverId } : o));
+        setSelectedOverlayId(current => current === newOverlay.id ? serverId : current);
+        newOverlay.id = serverId;
+      }
     } catch (error) {
       console.log('API not available, saved locally');
     }
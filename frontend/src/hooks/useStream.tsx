@@ -1,5 +1,6 @@
 import { useState, useCallback, useEffect } from 'react';
 import { toast } from 'sonner';
+import { subscribeEvents } from '@/lib/events';
 
 const API_BASE = import.meta.env.VITE_API_BASE || 'http://localhost:3001/api';
 
@@ -110,12 +111,20 @@ export function useStream() {
     }
   }, [fetchStatus]);
 
-  // Fetch status on mount
+  // Fetch status on mount, then refresh only when the server pushes a state change
   useEffect(() => {
     fetchStatus();
-    // Poll status every 10 seconds
-    const interval = setInterval(fetchStatus, 10000);
-    return () => clearInterval(interval);
+    return subscribeEvents(
+      ['stream.started', 'stream.stopped', 'stream.crashed'],
+      (data) => {
+        // Only the default stream is shown here
+        if (data.stream_id) return;
+        if (data.returncode !== undefined) toast.error('Stream stopped unexpectedly');
+        fetchStatus();
+      },
+      // Catch up on anything missed while disconnected
+      fetchStatus,
+    );
   }, [fetchStatus]);
 
   return {
@@ -0,0 +1,55 @@
+const API_BASE = import.meta.env.VITE_API_BASE || 'http://localhost:3001/api';
+
+type EventHandler = (data: any, type: string) => void;
+
+// One EventSource shared by every hook; opened with the first subscriber
+let source: EventSource | null = null;
+const handlers = new Map<string, Set<EventHandler>>();
+const openHandlers = new Set<() => void>();
+
+function ensureSource() {
+  if (source || typeof EventSource === 'undefined') return;
+  // EventSource reconnects by itself and resumes from the last event id
+  source = new EventSource(`${API_BASE}/events`);
+  source.onopen = () => openHandlers.forEach(handler => handler());
+  handlers.forEach((_, type) => listen(type));
+}
+
+const listening = new Set<string>();
+
+function listen(type: string) {
+  if (!source || listening.has(type)) return;
+  listening.add(type);
+  source.addEventListener(type, (event) => {
+    const data = JSON.parse((event as MessageEvent).data);
+    handlers.get(type)?.forEach(handler => handler(data, type));
+  });
+}
+
+function closeIfUnused() {
+  if (source && handlers.size === 0 && openHandlers.size === 0) {
+    source.close();
+    source = null;
+    listening.clear();
+  }
+}
+
+/** Subscribe to server push events of the given types; returns the unsubscribe function */
+export function subscribeEvents(types: string[], handler: EventHandler, onOpen?: () => void) {
+  types.forEach(type => {
+    if (!handlers.has(type)) handlers.set(type, new Set());
+    handlers.get(type)!.add(handler);
+  });
+  if (onOpen) openHandlers.add(onOpen);
+  ensureSource();
+  types.forEach(listen);
+
+  return () => {
+    types.forEach(type => {
+      handlers.get(type)?.delete(handler);
+      if (handlers.get(type)?.size === 0) handlers.delete(type);
+    });
+    if (onOpen) openHandlers.delete(onOpen);
+    closeIfUnused();
+  };
+}
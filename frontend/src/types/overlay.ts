@@ -7,6 +7,8 @@ export interface TextOverlayConfig {
   
   export interface ImageOverlayConfig {
     imageUrl: string;
+    // Server copy scaled to the saved overlay size (absent until saved)
+    proxyUrl?: string;
   }
   
   export interface OverlayPosition {